@@ -0,0 +1,337 @@
+import argparse
+import json
+import re
+import sqlite3
+import statistics
+import time
+from typing import Any, Callable
+
+import queries
+from table import Table, Row
+from sql import run_sql
+
+# tables replicated for scale factors > 1, with the column
+# holding the movie id, all other tables are kept as they are
+REPLICATED = {"movies": 0, "directors": 0, "awards": 0}
+
+
+def docstring_queries() -> list[tuple[str, list[Callable]]]:
+    """
+
+    Returns the SQL queries from the docstrings of the sequences
+    in queries.py, each with the sequences that implement it.
+
+    >>> [
+    ...     (" ".join(sql.split()[:4]), [f.__name__ for f in fs])
+    ...     for sql, fs in docstring_queries()
+    ... ] # doctest: +NORMALIZE_WHITESPACE
+    [('SELECT DISTINCT m.title FROM', ['run_sequence_1', 'run_sequence_2']),
+     ('SELECT p.name, COUNT(m.movie_id) AS',
+      ['run_group_by_sequence', 'run_improved_group_by_sequence'])]
+    """
+    sequences: dict[str, list[Callable]] = {}
+    for name in dir(queries):
+        func = getattr(queries, name)
+        if not name.startswith("run_") or not callable(func) \
+                or func.__doc__ is None:
+            continue
+        match = re.search(r"SELECT\b.*?;", func.__doc__, re.DOTALL)
+        if match is None:
+            continue
+        sql = " ".join(match.group(0).split())
+        sequences.setdefault(sql, []).append(func)
+    return [
+        (sql, sorted(funcs, key=lambda f: f.__code__.co_firstlineno))
+        for sql, funcs in sorted(
+            sequences.items(),
+            key=lambda item: min(f.__code__.co_firstlineno for f in item[1])
+        )
+    ]
+
+
+def replicate(table: Table, column: int, factor: int, offset: int) -> Table:
+    """
+
+    Replicates the rows of the table factor times, shifting the
+    integer ids in the given column by k * offset for the k-th copy,
+    so joins on the ids stay within each copy.
+
+    >>> t = Table("t", ["id", "x"], [("1", "a"), ("3", "b"), (None, "c")])
+    >>> replicate(t, 0, 2, 10).rows # doctest: +NORMALIZE_WHITESPACE
+    [('1', 'a'), ('3', 'b'), (None, 'c'),
+     ('11', 'a'), ('13', 'b'), (None, 'c')]
+    """
+    if factor == 1:
+        return table
+    rows = list(table.rows)
+    for k in range(1, factor):
+        rows.extend(
+            row[:column]
+            + (None if row[column] is None
+               else str(int(row[column]) + k * offset),)  # type: ignore
+            + row[column + 1:]
+            for row in table.rows
+        )
+    return Table(table.name, table.columns, rows)
+
+
+def scale_tables(tables: dict[str, Table], factor: int) -> dict[str, Table]:
+    """
+
+    Returns the tables with the movie data replicated factor times.
+
+    """
+    # all tables shift the same ids by the same offset, a power
+    # of ten above the largest id, so joins stay one to one
+    max_id = max(
+        (
+            int(row[column])  # type: ignore
+            for name, column in REPLICATED.items() if name in tables
+            for row in tables[name].rows if row[column] is not None
+        ),
+        default=0
+    )
+    offset = 10 ** len(str(max_id))
+    scaled = {
+        name: replicate(table, REPLICATED[name], factor, offset)
+        if name in REPLICATED else table
+        for name, table in tables.items()
+    }
+    queries.create_indexes(scaled)
+    return scaled
+
+
+def load_sqlite(tables: dict[str, Table]) -> sqlite3.Connection:
+    """
+
+    Loads the tables into an in-memory SQLite database, with the
+    same columns as text and indexes on the same columns as
+    the Python engine.
+
+    """
+    db = sqlite3.connect(":memory:")
+    for name, table in tables.items():
+        columns = ", ".join(f'"{column}" TEXT' for column in table.columns)
+        db.execute(f'CREATE TABLE "{name}" ({columns})')
+        db.executemany(
+            f'INSERT INTO "{name}" VALUES '
+            f'({", ".join("?" for _ in table.columns)})',
+            table.rows
+        )
+        for column in table.indexes:
+            db.execute(
+                f'CREATE INDEX "idx_{name}_{column}" '
+                f'ON "{name}" ("{table.columns[column]}")'
+            )
+    db.execute("ANALYZE")
+    db.commit()
+    return db
+
+
+def normalize(rows: list[Any]) -> list[Row]:
+    """
+
+    Normalizes result rows for comparison, as sorted tuples of
+    strings (SQLite returns numbers, the Python engine strings).
+
+    >>> normalize([(1, 7.5, None), ("a", "7.50", "x")])
+    [('1', '7.5', ''), ('a', '7.5', 'x')]
+    """
+    def value(val: Any) -> str:
+        if val is None:
+            return ""
+        try:
+            return repr(float(val)) if not float(val).is_integer() \
+                else str(int(float(val)))
+        except ValueError:
+            return str(val)
+
+    return sorted(tuple(value(val) for val in row) for row in rows)
+
+
+def measure(f: Callable[[], Any], n: int) -> tuple[Any, list[float]]:
+    """
+
+    Runs f n times and returns its last result and
+    the runtimes of all runs in milliseconds.
+
+    """
+    assert n > 0, "n must be greater than 0"
+    runtimes = []
+    result = None
+    for _ in range(n):
+        start = time.perf_counter()
+        result = f()
+        runtimes.append(1000.0 * (time.perf_counter() - start))
+    return result, runtimes
+
+
+def percentile(values: list[float], p: float) -> float:
+    """
+
+    Returns the p-th percentile of the values,
+    using the nearest rank.
+
+    >>> percentile([4.0, 1.0, 3.0, 2.0], 50)
+    2.0
+    >>> percentile([4.0, 1.0, 3.0, 2.0], 95)
+    4.0
+    """
+    values = sorted(values)
+    rank = max(1, -(-len(values) * p // 100))
+    return values[int(rank) - 1]
+
+
+def summarize(runtimes: list[float]) -> dict[str, float]:
+    """
+
+    Summarizes the distribution of runtimes in milliseconds
+    and the throughput in queries per second.
+
+    """
+    mean = statistics.mean(runtimes)
+    return {
+        "mean": mean,
+        "stdev": statistics.stdev(runtimes) if len(runtimes) > 1 else 0.0,
+        "min": min(runtimes),
+        "p50": percentile(runtimes, 50),
+        "p95": percentile(runtimes, 95),
+        "p99": percentile(runtimes, 99),
+        "max": max(runtimes),
+        "qps": 1000.0 / mean if mean > 0 else float("inf")
+    }
+
+
+def run_benchmark(
+    tables: dict[str, Table],
+    factors: list[int],
+    n: int,
+    log: Callable[[str], None] = print
+) -> list[dict[str, Any]]:
+    """
+
+    Runs every query from the docstrings of queries.py n times on
+    SQLite, with each of its hand written sequences and with the
+    SQL front-end, for each scale factor. Returns one record per
+    scale factor, query and engine with the runtime statistics,
+    the number of result rows and whether the result equals
+    the result of SQLite.
+
+    """
+    records = []
+    for factor in factors:
+        log(f"Scale factor {factor}x: preparing tables...")
+        scaled = scale_tables(tables, factor)
+        db = load_sqlite(scaled)
+        for i, (sql, sequences) in enumerate(docstring_queries()):
+            log(f"Scale factor {factor}x: running query {i + 1}...")
+            expected, runtimes = measure(
+                lambda: db.execute(sql).fetchall(),
+                n
+            )
+            expected = normalize(expected)
+            engines: list[tuple[str, Callable[[], list[Row]]]] = [
+                (f.__name__, lambda f=f: f(scaled).rows)  # type: ignore
+                for f in sequences
+            ] + [("sql.py", lambda: run_sql(sql, scaled).rows)]
+            results = [("sqlite", expected, runtimes)]
+            for engine, f in engines:
+                rows, runtimes = measure(f, n)
+                results.append((engine, normalize(rows), runtimes))
+            for engine, rows, runtimes in results:
+                records.append({
+                    "scale_factor": factor,
+                    "query": i + 1,
+                    "sql": sql,
+                    "engine": engine,
+                    "rows": len(rows),
+                    # results of queries with ORDER BY and LIMIT can
+                    # differ legitimately if there are ties at the limit
+                    "equal": rows == expected,
+                    **summarize(runtimes)
+                })
+        db.close()
+    return records
+
+
+def format_records(records: list[dict[str, Any]]) -> str:
+    """
+
+    Formats the benchmark records as a table.
+
+    """
+    header = (
+        f"{'scale':>5} | {'query':>5} | {'engine':<30} | "
+        f"{'mean':>9} | {'p50':>9} | {'p95':>9} | {'max':>9} | "
+        f"{'qps':>8} | {'rows':>6} | equal"
+    )
+    lines = [header, "-" * len(header)]
+    for r in records:
+        lines.append(
+            f"{str(r['scale_factor']) + 'x':>5} | {r['query']:>5} | "
+            f"{r['engine']:<30} | {r['mean']:>7.1f}ms | "
+            f"{r['p50']:>7.1f}ms | {r['p95']:>7.1f}ms | "
+            f"{r['max']:>7.1f}ms | {r['qps']:>8.2f} | {r['rows']:>6} | "
+            f"{'yes' if r['equal'] else 'NO'}"
+        )
+    return "\n".join(lines)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="benchmarks the queries from queries.py on SQLite, "
+        "the hand written sequences and the SQL front-end"
+    )
+    parser.add_argument(
+        "tables",
+        nargs="+",
+        type=str,
+        help="paths to the tsv-files (or binary .tbl-files) "
+        "that will be read as tables"
+    )
+    parser.add_argument(
+        "-n",
+        "--n-times",
+        type=int,
+        default=10,
+        help="number of times each query will be executed per engine"
+    )
+    parser.add_argument(
+        "-s",
+        "--scale-factors",
+        type=int,
+        nargs="+",
+        default=[1, 10, 100],
+        help="replicate the movie data this many times"
+    )
+    parser.add_argument(
+        "--json",
+        type=str,
+        default=None,
+        help="path to a file the results are written to as JSON"
+    )
+    return parser.parse_args()
+
+
+def main(args: argparse.Namespace) -> None:
+    print("Loading tables from files...")
+    tables = {}
+    for file in args.tables:
+        if file.endswith(".tbl"):
+            table = Table.build_from_binary_file(file)
+        else:
+            table = Table.build_from_file(file)
+        assert table.name not in tables, \
+            f"table with name {table.name} already exists"
+        tables[table.name] = table
+
+    records = run_benchmark(tables, args.scale_factors, args.n_times)
+    print()
+    print(format_records(records))
+    if args.json is not None:
+        with open(args.json, "w", encoding="utf8") as of:
+            json.dump(records, of, indent=2)
+
+
+if __name__ == "__main__":
+    main(parse_args())
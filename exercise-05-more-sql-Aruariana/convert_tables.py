@@ -0,0 +1,57 @@
+import argparse
+import os
+import time
+
+from queries import encode_tables
+from table import Table
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="converts TSV tables into the binary table format, "
+        "which can be passed to queries.py instead of the TSV files"
+    )
+    parser.add_argument(
+        "tables",
+        nargs="+",
+        type=str,
+        help="paths to the tsv-files that will be converted"
+    )
+    parser.add_argument(
+        "-o",
+        "--output-dir",
+        type=str,
+        default=None,
+        help="directory for the binary files, defaults to the "
+        "directory of each tsv-file"
+    )
+    parser.add_argument(
+        "--encode",
+        action="store_true",
+        help="whether to store the id and award name columns (see "
+        "queries.DOMAINS) encoded with one dictionary per domain across "
+        "the given tables, so queries.py --encode loads them as codes "
+        "instead of encoding them after loading"
+    )
+    return parser.parse_args()
+
+
+def main(args: argparse.Namespace) -> None:
+    tables = {file: Table.build_from_file(file) for file in args.tables}
+    if args.encode:
+        encode_tables({table.name: table for table in tables.values()})
+    for file, table in tables.items():
+        start = time.perf_counter()
+        base, _ = os.path.splitext(file)
+        if args.output_dir is not None:
+            base = os.path.join(args.output_dir, os.path.basename(base))
+        table.save_binary(base + ".tbl")
+        print(
+            f"Converted {file} to {base}.tbl "
+            f"({table.shape[0]:,} rows), "
+            f"took {(time.perf_counter() - start) * 1000:.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main(parse_args())
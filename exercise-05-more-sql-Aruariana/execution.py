@@ -0,0 +1,353 @@
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+from types import CodeType, FunctionType, GenericAlias, ModuleType, UnionType
+from typing import Any, Callable, Hashable, Iterator
+
+from table import Table, HashIndex, SortedIndex
+
+# operators of operations.py that instrument wraps
+OPERATORS = [
+    "select",
+    "select_eq",
+    "select_range",
+    "select_values",
+    "semi_join",
+    "project",
+    "distinct",
+    "join",
+    "group_by",
+    "order_by",
+    "top_n",
+    "limit"
+]
+
+# default memory budget of the result cache in bytes
+DEFAULT_CACHE_BUDGET = 256 * 1024 * 1024
+
+
+@contextmanager
+def instrument(
+    module: ModuleType,
+    call: Callable[[str, Callable[..., Any], tuple, dict], Any]
+) -> Iterator[None]:
+    """
+
+    Temporarily replaces the operators imported into the given
+    module (e.g. the module of hand written sequences of operations)
+    by wrappers that pass the name of the operator, the operator
+    and its arguments to the given call function instead.
+
+    """
+    originals = {
+        name: getattr(module, name) for name in OPERATORS
+        if hasattr(module, name)
+    }
+
+    def wrap(name: str, func: Callable[..., Any]) -> Callable[..., Any]:
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            return call(name, func, args, kwargs)
+        return wrapper
+
+    for name, func in originals.items():
+        setattr(module, name, wrap(name, func))
+    try:
+        yield
+    finally:
+        for name, func in originals.items():
+            setattr(module, name, func)
+
+
+def _global_names(code: CodeType) -> set[str]:
+    # the names a function may look up in its globals, including
+    # those of the functions and generators nested in its code
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, CodeType):
+            names |= _global_names(const)
+    return names
+
+
+class _Uncacheable(Exception):
+    # raised for arguments without a canonical form
+    pass
+
+
+def _is_lazy(table: Table) -> bool:
+    # whether the rows of the table are not computed yet,
+    # like the rows of the result of order_by
+    return getattr(table, "is_sorted", True) is False
+
+
+def _is_joined(table: Table) -> bool:
+    # whether the table is a result of late_join that only
+    # holds row ids, without materialized rows
+    return getattr(table, "is_materialized", True) is False
+
+
+def _copy(table: Table) -> Table:
+    # new table sharing the rows (or row ids) of the table
+    if _is_joined(table):
+        return type(table)(table.sources, table.ids)  # type: ignore
+    return Table(
+        table.name,
+        list(table.columns),
+        table.rows,
+        table.dictionaries
+    )
+
+
+def _table_size(table: Table) -> int:
+    # rough estimate of the memory used by the rows of a table in
+    # bytes, extrapolated from a sample of the rows
+    if _is_joined(table):
+        return 64 + sum(8 * len(ids) for ids in table.ids)  # type: ignore
+    rows = table.rows
+    sample = rows[:100]
+    if not sample:
+        return 64
+    # the codes of dictionary-encoded columns are shared by all rows
+    sample_size = sum(
+        56 + sum(
+            8 if val is None or isinstance(val, int) else 57 + len(val)
+            for val in row
+        )
+        for row in sample
+    )
+    return 64 + 8 * len(rows) + sample_size * len(rows) // len(sample)
+
+
+class ResultCache:
+    """
+
+    Memoizing execution context for operators. Each result is keyed
+    on a canonical form of the subplan that computed it: the
+    operator, the keys of its input tables (recursively, so equal
+    subplans get equal keys even if they are computed from different
+    intermediate table objects) and its other arguments. Functions
+    like the predicates of select are canonical by their code, the
+    values they capture and the values of the globals they use (but
+    only the code of global functions), so the lambdas that a
+    sequence creates anew on every run still give the same keys, but
+    a changed global does not. Base tables and
+    indexes are keyed by identity and their number of rows, and
+    keep their keys when an operator returns them unchanged.
+
+    The cached results are kept in an LRU cache with a memory budget
+    in bytes. Results are returned as new tables sharing the cached
+    rows, so the rows must not be modified in place. Lazily ordered
+    tables are not cached (computing them is free), but their keys
+    are tracked for the operators consuming them.
+
+    >>> from operations import select, join
+    >>> p = Table.build_from_file("persons.example.tsv")
+    >>> j = Table.build_from_file("jobs.example.tsv")
+    >>> cache = ResultCache()
+    >>> def sequence() -> Table:
+    ...     old = cache.call(select, p, lambda row: row[2] == "38")
+    ...     return cache.call(join, old, j, 3, 0)
+    >>> sequence().rows == sequence().rows
+    True
+    >>> cache.hits, cache.misses
+    (2, 2)
+    >>> _ = cache.call(select, p, lambda row: row[2] == "29")
+    >>> cache.misses
+    3
+    >>> age = "20"
+    >>> _ = cache.call(select, p, lambda row: row[2] == age)
+    >>> age = "18"
+    >>> cache.call(select, p, lambda row: row[2] == age).rows
+    [('1', 'Mary', '18', '2')]
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_CACHE_BUDGET) -> None:
+        assert max_bytes > 0, "memory budget must be positive"
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # whether the last call was answered from the cache
+        self.last_hit = False
+        self._entries: OrderedDict[Hashable, tuple[Table, int]] = \
+            OrderedDict()
+        # keys of the tables seen so far, by id, with a weak
+        # reference to the table to detect reuse of ids
+        self._keys: dict[int, tuple[weakref.ref, Hashable]] = {}
+        self._next_id = 0
+
+    def _known(self, value: Any) -> bool:
+        # whether the object has a key already
+        entry = self._keys.get(id(value))
+        return entry is not None and entry[0]() is value
+
+    def _identity_key(self, value: Any, kind: str) -> Hashable:
+        # the key of a base table or an index, by identity
+        if not self._known(value):
+            self._next_id += 1
+            self._keys[id(value)] = (
+                weakref.ref(value), (kind, self._next_id)
+            )
+            weakref.finalize(value, self._keys.pop, id(value), None)
+        return self._keys[id(value)][1]
+
+    def _table_key(self, table: Table) -> Hashable:
+        key = self._identity_key(table, "table")
+        if key[0] == "table" and not _is_lazy(table):  # type: ignore
+            return key + (id(table.rows), len(table.rows))  # type: ignore
+        return key
+
+    def _canonical(self, value: Any, seen: set[int]) -> Hashable:
+        if isinstance(value, Table):
+            return self._table_key(value)
+        elif isinstance(value, (HashIndex, SortedIndex)):
+            # by identity, instead of walking all of its entries
+            return self._identity_key(value, "index") + (  # type: ignore
+                id(value.rows), value.size
+            )
+        elif isinstance(value, ModuleType):
+            return ("module", value.__name__)
+        elif isinstance(value, (type, GenericAlias, UnionType)):
+            # classes and type aliases, like Row
+            return value
+        elif value is None or isinstance(value, (str, int, float, bool)):
+            return value
+        elif id(value) in seen:
+            return ("recursive",)
+        seen = seen | {id(value)}
+        if isinstance(value, (list, tuple)):
+            return (type(value).__name__,) + tuple(
+                self._canonical(v, seen) for v in value
+            )
+        elif isinstance(value, dict):
+            return ("dict",) + tuple(
+                (k, self._canonical(v, seen))
+                for k, v in sorted(value.items(), key=lambda kv: str(kv[0]))
+            )
+        elif isinstance(value, (set, frozenset)):
+            try:
+                return ("set", frozenset(value))
+            except TypeError:
+                raise _Uncacheable()
+        elif isinstance(value, FunctionType):
+            cells = tuple(
+                self._canonical(cell.cell_contents, seen)
+                for cell in value.__closure__ or ()
+            )
+            global_values = tuple(
+                (name, self._global_key(value.__globals__[name], seen))
+                for name in sorted(_global_names(value.__code__))
+                if name in value.__globals__
+            )
+            return (
+                "function",
+                value.__code__,
+                self._canonical(value.__defaults__, seen),
+                cells,
+                global_values
+            )
+        elif hasattr(value, "__dict__") and not isinstance(value, type):
+            # objects like aggregates, by class and attributes
+            return (type(value), self._canonical(vars(value), seen))
+        try:
+            hash(value)
+        except TypeError:
+            raise _Uncacheable()
+        return value
+
+    def _global_key(self, value: Any, seen: set[int]) -> Hashable:
+        # global functions (like the operators) by their code only,
+        # not by the globals they use in turn, which would walk
+        # through all modules on every call
+        if isinstance(value, FunctionType):
+            return ("global function", value.__code__)
+        return self._canonical(value, seen)
+
+    def key(
+        self,
+        func: Callable[..., Any],
+        args: tuple,
+        kwargs: dict
+    ) -> Hashable | None:
+        """
+
+        Returns the canonical key of calling the operator
+        with the arguments, or None if it has none.
+
+        """
+        try:
+            return self._canonical((func, args, kwargs), set())
+        except _Uncacheable:
+            return None
+
+    def call(
+        self,
+        func: Callable[..., Any],
+        *args: Any,
+        **kwargs: Any
+    ) -> Any:
+        """
+
+        Calls the operator with the given arguments, unless
+        the result of an equal call is in the cache.
+
+        """
+        key = self.key(func, args, kwargs)
+        entry = None if key is None else self._entries.get(key)
+        self.last_hit = entry is not None
+        if entry is not None:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            result = _copy(entry[0])
+        else:
+            self.misses += 1
+            result = func(*args, **kwargs)
+            if key is not None and isinstance(result, Table) \
+                    and not _is_lazy(result) and not self._known(result):
+                self._store(key, result)
+
+        # tables that are returned unchanged, like the base tables
+        # returned by scans, keep their keys (and are not cached)
+        if key is not None and isinstance(result, Table) \
+                and not self._known(result):
+            self._keys[id(result)] = (weakref.ref(result), ("result", key))
+            weakref.finalize(result, self._keys.pop, id(result), None)
+        return result
+
+    def _store(self, key: Hashable, table: Table) -> None:
+        size = _table_size(table)
+        if size > self.max_bytes:
+            return
+        # store a copy, so changes of the name or columns
+        # of the result do not change the cached table
+        self._entries[key] = (_copy(table), size)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self.bytes -= evicted
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.bytes = 0
+
+    def instrument(self, module: ModuleType) -> Any:
+        """
+
+        Temporarily routes the operators imported into the
+        given module through this cache, see instrument.
+
+        """
+        return instrument(
+            module,
+            lambda name, func, args, kwargs: self.call(func, *args, **kwargs)
+        )
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "bytes": self.bytes
+        }
@@ -0,0 +1,254 @@
+import pickle
+from tempfile import TemporaryFile
+from typing import IO, Any, Callable, Iterable, Iterator
+
+from table import Row
+from external_sort import (
+    DEFAULT_MEMORY_BUDGET,
+    encode_values,
+    encode_row,
+    decode_row,
+    read_rows
+)
+
+# number of bits of the hash of a key that select its partition
+# at each level of recursive partitioning
+_PARTITION_BITS = 4
+# partitions are not split any further below this level, because
+# all bits of the (64 bit) hash are used up
+_MAX_LEVEL = 64 // _PARTITION_BITS - 1
+# estimated memory used by an entry of the hash table in bytes,
+# besides its key and state (dict slot and bytes header)
+_ENTRY_SIZE = 120
+# marks keys that are not in the hash table yet
+_MISSING = object()
+
+
+def encode_key(values: Row) -> bytes:
+    """
+
+    Encodes the values of a key (like a row or the columns grouped
+    by) into compact bytes with encode_values, which take much less
+    memory in a hash table than a tuple of strings, and hash and
+    compare as a single value.
+
+    >>> encode_key(("ab", None))
+    b'\\x06ab\\x00'
+    >>> decode_key(encode_key(("ab", None, 7)), 3)
+    ('ab', None, 7)
+    """
+    return encode_values(values)
+
+
+def decode_key(key: bytes, num_values: int) -> Row:
+    """
+
+    Decodes a key encoded with encode_key.
+
+    """
+    return decode_row(key, num_values)
+
+
+def hybrid_hash(
+    rows: Iterable[Row],
+    num_columns: int,
+    key: Callable[[Row], bytes],
+    start: Callable[[Row], Any],
+    update: Callable[[Any, Row], Any] | None = None,
+    state_size: int = 0,
+    memory_budget: int = DEFAULT_MEMORY_BUDGET,
+    emit_first: bool = False
+) -> Iterator[tuple[bytes, Any]]:
+    """
+
+    Hash table with a memory budget, the hashing core of
+    hash_distinct and of group_by with a memory budget. Maps the
+    compact key of each row (see encode_key) to a state, which start
+    creates from the first row of the key and update (if given)
+    updates with each further row of the key, and yields every key
+    with its final state.
+
+    All keys are kept in memory while the estimated size of the hash
+    table (with state_size bytes per state) fits into the budget.
+    Beyond that, the keys are split into 16 partitions by their
+    hash, and the largest partitions are spilled one by one until the
+    rest fits: the states of a spilled partition are pickled to a
+    temporary file, and its rows that arrive afterwards are written
+    to another one (like a hybrid hash join spills the partitions of
+    its build input). Once all rows are consumed, the keys in memory
+    are yielded first, in the order of their first row, then each
+    spilled partition is processed the same way, recursively split
+    on further bits of the hash if it still does not fit. The states
+    must be picklable. The rows can be any iterable, e.g. a
+    generator reading a file.
+
+    With emit_first, each key is yielded with the state created from
+    its first row as soon as that row arrives, and the hash table only
+    remembers the key (for operations like distinct, which do not
+    need to see the further rows of a key).
+
+    >>> rows = [(str(i % 50), str(i)) for i in range(1000)]
+    >>> counts = hybrid_hash(
+    ...     rows,
+    ...     2,
+    ...     lambda row: encode_key(row[:1]),
+    ...     start=lambda row: 1,
+    ...     update=lambda count, row: count + 1,
+    ...     memory_budget=2000
+    ... )
+    >>> counts = sorted((decode_key(k, 1)[0], c) for k, c in counts)
+    >>> len(counts), counts[:2]
+    (50, [('0', 20), ('1', 20)])
+    """
+    assert memory_budget > 0, "memory budget must be positive"
+    return _hybrid_hash(
+        [],
+        rows,
+        num_columns,
+        key,
+        start,
+        update,
+        state_size,
+        memory_budget,
+        emit_first,
+        0
+    )
+
+
+def _hybrid_hash(
+    entries: list[tuple[bytes, Any]],
+    rows: Iterable[Row],
+    num_columns: int,
+    key: Callable[[Row], bytes],
+    start: Callable[[Row], Any],
+    update: Callable[[Any, Row], Any] | None,
+    state_size: int,
+    memory_budget: int,
+    emit_first: bool,
+    level: int
+) -> Iterator[tuple[bytes, Any]]:
+    # processes the states of the keys of a spilled partition
+    # (none at the first level) and the rows of the partition
+    shift = level * _PARTITION_BITS
+    mask = (1 << _PARTITION_BITS) - 1
+    table: dict[bytes, Any] = {}
+    # estimated memory used by the keys and states
+    # of each partition in the hash table
+    sizes = [0] * (mask + 1)
+    total = 0
+    # files with the states and the later rows of spilled partitions
+    spilled: dict[int, tuple[IO[bytes], IO[bytes]]] = {}
+
+    def spill() -> int:
+        # spills the largest partition in memory,
+        # returns the memory freed by it
+        p = max(
+            (p for p in range(mask + 1) if p not in spilled),
+            key=sizes.__getitem__
+        )
+        states, later_rows = TemporaryFile(), TemporaryFile()
+        spilled[p] = (states, later_rows)
+        keys = [k for k in table if hash(k) >> shift & mask == p]
+        pickle.dump([(k, table.pop(k)) for k in keys], states)
+        freed, sizes[p] = sizes[p], 0
+        return freed
+
+    def overflows() -> bool:
+        return total > memory_budget and level < _MAX_LEVEL \
+            and len(spilled) <= mask
+
+    try:
+        for k, state in entries:
+            p = hash(k) >> shift & mask
+            size = _ENTRY_SIZE + len(k) + state_size
+            if p in spilled:
+                pickle.dump([(k, state)], spilled[p][0])
+                continue
+            table[k] = state
+            sizes[p] += size
+            total += size
+            while overflows():
+                total -= spill()
+        del entries[:]
+
+        for row in rows:
+            k = key(row)
+            p = hash(k) >> shift & mask
+            if p in spilled:
+                spilled[p][1].write(encode_row(row))
+                continue
+            state = table.get(k, _MISSING)
+            if state is _MISSING:
+                if emit_first:
+                    table[k] = None
+                    yield k, start(row)
+                else:
+                    table[k] = start(row)
+                size = _ENTRY_SIZE + len(k) + state_size
+                sizes[p] += size
+                total += size
+                while overflows():
+                    total -= spill()
+            elif update is not None:
+                table[k] = update(state, row)
+
+        if not emit_first:
+            yield from table.items()
+        table.clear()
+        for states, later_rows in spilled.values():
+            states.seek(0)
+            later_rows.seek(0)
+            entries = []
+            while True:
+                try:
+                    entries.extend(pickle.load(states))
+                except EOFError:
+                    break
+            yield from _hybrid_hash(
+                entries,
+                read_rows(later_rows, num_columns),
+                num_columns,
+                key,
+                start,
+                update,
+                state_size,
+                memory_budget,
+                emit_first,
+                level + 1
+            )
+    finally:
+        for states, later_rows in spilled.values():
+            states.close()
+            later_rows.close()
+
+
+def hash_distinct(
+    rows: Iterable[Row],
+    num_columns: int,
+    memory_budget: int = DEFAULT_MEMORY_BUDGET
+) -> Iterator[Row]:
+    """
+
+    Yields the distinct rows as they arrive, using a hash table of
+    the compact encoded rows with a memory budget (see hybrid_hash),
+    so only the encoded keys are kept in memory and partitions of
+    the keys are spilled to temporary files if they do not fit.
+    The rows of spilled partitions come after all other rows,
+    otherwise the rows keep their order.
+
+    >>> rows = [(str(i % 7), None if i % 2 else "x") for i in range(100)]
+    >>> list(hash_distinct(rows, 2))[:3]
+    [('0', 'x'), ('1', None), ('2', 'x')]
+    >>> distinct = list(hash_distinct(rows, 2, memory_budget=500))
+    >>> len(distinct), sorted(distinct, key=str) == sorted(set(rows), key=str)
+    (14, True)
+    """
+    for _, row in hybrid_hash(
+        rows,
+        num_columns,
+        encode_key,
+        lambda row: row,
+        memory_budget=memory_budget,
+        emit_first=True
+    ):
+        yield row
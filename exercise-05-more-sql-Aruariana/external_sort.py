@@ -0,0 +1,202 @@
+from heapq import merge
+from struct import Struct
+from tempfile import TemporaryFile
+from typing import IO, Any, Callable, Iterable, Iterator
+
+from table import Row
+
+# default memory budget of the external sort in bytes
+DEFAULT_MEMORY_BUDGET = 64 * 1024 * 1024
+
+# length of an encoded row in bytes
+_ROW_LENGTH = Struct("<I")
+
+
+def encode_values(row: Row) -> bytes:
+    """
+
+    Encodes the values of a row into a compact binary format: each
+    value as a varint n followed by its bytes, with n = 0 for None,
+    n = 2 * length + 2 for strings (stored as UTF-8) and
+    n = 2 * length + 1 for integers like the codes of
+    dictionary-encoded columns (stored as decimal digits).
+
+    >>> encode_values(("ab", None, "", 7))
+    b'\\x06ab\\x00\\x02\\x037'
+    """
+    out = bytearray()
+    for val in row:
+        if val is None:
+            out.append(0)
+            continue
+
+        if isinstance(val, int):
+            data = str(val).encode("ascii")
+            n = 2 * len(data) + 1
+        else:
+            data = val.encode("utf8")
+            n = 2 * len(data) + 2
+        while n >= 0x80:
+            out.append((n & 0x7F) | 0x80)
+            n >>= 7
+        out.append(n)
+        out += data
+    return bytes(out)
+
+
+def encode_row(row: Row) -> bytes:
+    """
+
+    Encodes a row with encode_values, prefixed by the length
+    of the encoded values as 4 byte unsigned int.
+
+    >>> encode_row(("ab", None, ""))
+    b'\\x05\\x00\\x00\\x00\\x06ab\\x00\\x02'
+    """
+    out = encode_values(row)
+    return _ROW_LENGTH.pack(len(out)) + out
+
+
+def decode_row(data: bytes, num_columns: int) -> Row:
+    """
+
+    Decodes the values of a row encoded with encode_values
+    (or encode_row, without the leading length).
+
+    >>> decode_row(encode_row(("ab", None, "ü", 12))[4:], 4)
+    ('ab', None, 'ü', 12)
+    """
+    values: list[Any] = []
+    pos = 0
+    for _ in range(num_columns):
+        n, shift = 0, 0
+        while True:
+            b = data[pos]
+            pos += 1
+            n |= (b & 0x7F) << shift
+            if b < 0x80:
+                break
+            shift += 7
+        if n == 0:
+            values.append(None)
+            continue
+
+        length = (n - 1) // 2
+        if n & 1:
+            values.append(int(data[pos:pos + length]))
+        else:
+            values.append(data[pos:pos + length].decode("utf8"))
+        pos += length
+    return tuple(values)
+
+
+def write_rows(f: IO[bytes], rows: Iterable[Row]) -> None:
+    """
+
+    Writes the rows to the given binary file.
+
+    """
+    for row in rows:
+        f.write(encode_row(row))
+
+
+def read_rows(
+    f: IO[bytes],
+    num_columns: int,
+    block_size: int = 1 << 16
+) -> Iterator[Row]:
+    """
+
+    Lazily reads the rows written by write_rows from the given
+    binary file, block by block.
+
+    >>> from io import BytesIO
+    >>> f = BytesIO()
+    >>> write_rows(f, [("1", "a"), ("2", None)])
+    >>> _ = f.seek(0)
+    >>> list(read_rows(f, 2, block_size=3))
+    [('1', 'a'), ('2', None)]
+    """
+    buf = b""
+    pos = 0
+    while True:
+        block = f.read(block_size)
+        buf = buf[pos:] + block
+        pos = 0
+        while len(buf) - pos >= _ROW_LENGTH.size:
+            (length,) = _ROW_LENGTH.unpack_from(buf, pos)
+            end = pos + _ROW_LENGTH.size + length
+            if end > len(buf):
+                break
+            yield decode_row(buf[pos + _ROW_LENGTH.size:end], num_columns)
+            pos = end
+        if not block:
+            assert pos == len(buf), "truncated row at end of file"
+            return
+
+
+def _row_size(row: Row) -> int:
+    # rough estimate of the memory used by a row in bytes
+    return 56 + sum(
+        8 if val is None or isinstance(val, int) else 57 + len(val)
+        for val in row
+    )
+
+
+def external_sort(
+    rows: Iterable[Row],
+    num_columns: int,
+    key: Callable[[Row], Any],
+    reverse: bool = False,
+    memory_budget: int = DEFAULT_MEMORY_BUDGET
+) -> Iterator[Row]:
+    """
+
+    Sorts the rows like sorted(rows, key=key, reverse=reverse),
+    but keeps at most about memory_budget bytes of rows in memory.
+    The rows are read in chunks that fit into the budget, each chunk
+    is sorted and spilled as a run to a temporary file, and the
+    runs are lazily merged with a k-way merge while the output
+    is consumed. If all rows fit into the budget, nothing is spilled.
+    The rows can be any iterable, e.g. a generator reading a file.
+
+    >>> rows = [(str(i % 7), str(i)) for i in range(20)]
+    >>> key = lambda row: int(row[0])
+    >>> sorted_rows = external_sort(rows, 2, key, memory_budget=1000)
+    >>> list(sorted_rows) == sorted(rows, key=key)
+    True
+    """
+    assert memory_budget > 0, "memory budget must be positive"
+    runs: list[IO[bytes]] = []
+    try:
+        chunk: list[Row] = []
+        chunk_size = 0
+        for row in rows:
+            chunk.append(row)
+            chunk_size += _row_size(row)
+            if chunk_size >= memory_budget:
+                chunk.sort(key=key, reverse=reverse)
+                run = TemporaryFile()
+                runs.append(run)
+                write_rows(run, chunk)
+                chunk = []
+                chunk_size = 0
+
+        chunk.sort(key=key, reverse=reverse)
+        if not runs:
+            yield from chunk
+            return
+
+        # the last chunk takes part in the merge without being spilled;
+        # runs are merged in input order, which keeps the sort stable
+        for run in runs:
+            run.seek(0)
+        yield from merge(
+            *(read_rows(run, num_columns) for run in runs),
+            chunk,
+            key=key,
+            reverse=reverse
+        )
+    finally:
+        for run in runs:
+            run.close()
@@ -1,17 +1,30 @@
-from typing import Callable
+from array import array
+from bisect import bisect_left, bisect_right
+from hashlib import blake2b
+from heapq import nlargest, nsmallest
+from math import log
+from operator import itemgetter
+from typing import Any, Callable, Iterable, Iterator
 
-from table import Table, Value, Row
+from table import Table, Value, Row, HashIndex, SortedIndex, Dictionary
+from external_sort import DEFAULT_MEMORY_BUDGET, external_sort
+from external_hash import hybrid_hash, hash_distinct, encode_key, decode_key
 
 
 def project(
     table: Table,
     columns: list[int],
-    distinct: bool = False
+    distinct: bool = False,
+    memory_budget: int | None = None
 ) -> Table:
     """
 
     Selects the given columns by index from the table.
     If distinct is true, makes sure to return unique rows.
+    If a memory budget in bytes is given, the unique rows are
+    found with a hash table of compact encoded rows that spills
+    to temporary files if it does not fit into the budget
+    (see distinct), otherwise with a set of the rows.
 
     >>> t = Table.build_from_file("persons.example.tsv")
     >>> project(t, [1, 2]) # doctest: +NORMALIZE_WHITESPACE
@@ -48,20 +61,80 @@ def project(
     assert all(0 <= col < len(table.columns) for col in columns), \
         "at least one column out of range"
 
+    dictionaries = {
+        i: table.dictionaries[col] for i, col in enumerate(columns)
+        if col in table.dictionaries
+    }
+    # results of late_join only gather the projected columns
+    sub_rows: Iterable[Row] = (
+        table.iter_gather(columns) if isinstance(table, _JoinedTable)
+        else (tuple(row[col] for col in columns) for row in table.iter_rows())
+    )
+    if not distinct:
+        return Table(
+            table.name,
+            [table.columns[col] for col in columns],
+            list(sub_rows),
+            dictionaries
+        )
+
     rows = []
-    seen = set()
-    for row in table.rows:
-        sub_row = tuple(row[col] for col in columns)
-        if not distinct:
-            rows.append(sub_row)
-        elif sub_row not in seen:
-            seen.add(sub_row)
-            rows.append(sub_row)
+    if memory_budget is not None:
+        rows = list(hash_distinct(sub_rows, len(columns), memory_budget))
+    else:
+        seen = set()
+        for sub_row in sub_rows:
+            if sub_row not in seen:
+                seen.add(sub_row)
+                rows.append(sub_row)
 
     return Table(
         table.name,
         [table.columns[col] for col in columns],
-        rows
+        rows,
+        dictionaries
+    )
+
+
+def distinct(
+    table: Table,
+    memory_budget: int = DEFAULT_MEMORY_BUDGET
+) -> Table:
+    """
+
+    Returns the unique rows of the table. Only the rows encoded
+    into compact bytes are kept in a hash table, and if the table
+    does not fit into the memory budget in bytes, partitions of it
+    are spilled to temporary files and deduplicated one after
+    another (a hybrid hash distinct, see external_hash.py), so
+    large inputs with many unique rows are deduplicated in bounded
+    memory. The rows keep their order in the table if nothing
+    is spilled.
+
+    >>> t = Table.build_from_file("persons.example.tsv")
+    >>> distinct(project(t, [2])) # doctest: +NORMALIZE_WHITESPACE
+    table: persons.example
+    age
+    ---
+    29
+    18
+    38
+    ?
+    20
+    >>> spilled = distinct(project(t, [2]), memory_budget=200)
+    >>> sorted(spilled.rows, key=str) # doctest: +NORMALIZE_WHITESPACE
+    [('18',), ('20',), ('29',), ('38',), (None,)]
+    """
+    assert memory_budget > 0, "memory budget must be positive"
+    return Table(
+        table.name,
+        table.columns,
+        list(hash_distinct(
+            table.iter_rows(),
+            len(table.columns),
+            memory_budget
+        )),
+        table.dictionaries
     )
 
 
@@ -94,23 +167,308 @@ def select(
         table.columns,
         [
             row
-            for row in table.rows
+            for row in table.iter_rows()
             if predicate(row)
-        ]
+        ],
+        table.dictionaries
     )
 
 
+def select_values(
+    table: Table,
+    column: int,
+    predicate: Callable[[str], bool]
+) -> Table:
+    """
+
+    Selects the rows from the table whose value in the given column
+    satisfies the predicate, None values never match. The predicate
+    is evaluated only once per distinct value of the column (once
+    per value of the dictionary for dictionary-encoded columns),
+    the rows are then selected by looking up their values (or
+    integer codes) in the results. Unlike select, the predicate
+    sees the decoded values of encoded columns.
+    The rows keep their order in the table.
+
+    >>> t = Table.build_from_file("persons.example.tsv")
+    >>> t.encode_column(1, Dictionary(row[1] for row in t.rows))
+    >>> select_values(t, 1, lambda name: name.startswith("J")) \
+    # doctest: +NORMALIZE_WHITESPACE
+    table: persons.example
+    id | name | age | job_id
+    ------------------------
+    0  | John | 29  | 0
+    3  | Jane | ?   | 1
+    """
+    assert 0 <= column < len(table.columns), \
+        "column out of range"
+    dictionary = table.dictionaries.get(column)
+    if dictionary is not None:
+        codes = {
+            code for code, val in enumerate(dictionary.values)
+            if predicate(val)
+        }
+        rows = [row for row in table.iter_rows() if row[column] in codes]
+    else:
+        matches: dict[Value, bool] = {None: False}
+        rows = []
+        for row in table.iter_rows():
+            val = row[column]
+            match = matches.get(val)
+            if match is None:
+                match = matches[val] = predicate(val)  # type: ignore
+            if match:
+                rows.append(row)
+
+    return Table(table.name, table.columns, rows, table.dictionaries)
+
+
+def select_eq(
+    table: Table,
+    column: int,
+    value: Value
+) -> Table:
+    """
+
+    Selects the rows from the table where the given column
+    equals the given value. Uses the index on the column
+    if the table has one, otherwise scans the table. The value
+    of a dictionary-encoded column is encoded first.
+    The rows keep their order in the table.
+
+    >>> t = Table.build_from_file("persons.example.tsv")
+    >>> select_eq(t, 2, "38") # doctest: +NORMALIZE_WHITESPACE
+    table: persons.example
+    id | name  | age | job_id
+    -------------------------
+    2  | Peter | 38  | 1
+    4  | Mark  | 38  | 0
+    >>> _ = t.create_index(1)
+    >>> select_eq(t, 1, "Jane") # doctest: +NORMALIZE_WHITESPACE
+    table: persons.example
+    id | name | age | job_id
+    ------------------------
+    3  | Jane | ?   | 1
+    """
+    assert 0 <= column < len(table.columns), \
+        "column out of range"
+    dictionary = table.dictionaries.get(column)
+    if dictionary is not None and value is not None:
+        # values missing from the dictionary match no rows
+        value = dictionary.codes.get(value)  # type: ignore
+    index = _equality_index(table, column)
+    if index is None:
+        rows = [
+            row
+            for row in table.rows
+            if value is not None and row[column] == value
+        ]
+    else:
+        rows = [table.rows[i] for i in sorted(index.lookup(value))]
+
+    return Table(table.name, table.columns, rows, table.dictionaries)
+
+
+def select_range(
+    table: Table,
+    column: int,
+    low: Any = None,
+    high: Any = None,
+    key: Callable[[str], Any] | None = None
+) -> Table:
+    """
+
+    Selects the rows from the table where the given column
+    lies between low and high, both inclusive. A bound of None
+    means the range is open on that side. The values of the
+    column are converted by the key function before comparing,
+    None values never match. Uses the sorted index on the column
+    if the table has one with the same key function, otherwise
+    scans the table. The bounds of dictionary-encoded columns
+    (which do not support key functions) are encoded first.
+    The rows keep their order in the table.
+
+    >>> t = Table.build_from_file("persons.example.tsv")
+    >>> select_range(t, 2, 20, 30, key=int) \
+    # doctest: +NORMALIZE_WHITESPACE
+    table: persons.example
+    id | name | age | job_id
+    ------------------------
+    0  | John | 29  | 0
+    5  | Lisa | 20  | 5
+    >>> _ = t.create_index(2, kind="sorted", key=int)
+    >>> select_range(t, 2, low=30, key=int) \
+    # doctest: +NORMALIZE_WHITESPACE
+    table: persons.example
+    id | name  | age | job_id
+    -------------------------
+    2  | Peter | 38  | 1
+    4  | Mark  | 38  | 0
+    """
+    assert 0 <= column < len(table.columns), \
+        "column out of range"
+    dictionary = table.dictionaries.get(column)
+    if dictionary is not None:
+        assert key is None, \
+            "key functions are not supported on dictionary-encoded columns"
+        # the codes of the values between the bounds,
+        # the dictionary is sorted
+        if low is not None:
+            low = bisect_left(dictionary.values, low)
+        if high is not None:
+            high = bisect_right(dictionary.values, high) - 1
+    index = table.get_index(column)
+    if isinstance(index, SortedIndex) and index.key is key:
+        rows = [table.rows[i] for i in sorted(index.range(low, high))]
+    else:
+        rows = []
+        for row in table.rows:
+            val = row[column]
+            if val is None:
+                continue
+
+            k = val if key is None else key(val)
+            if (
+                (low is None or low <= k)
+                and (high is None or k <= high)
+            ):
+                rows.append(row)
+
+    return Table(table.name, table.columns, rows, table.dictionaries)
+
+
+class BloomFilter:
+    """
+
+    Bloom filter over string values, a bit array with k hash
+    functions derived from two hashes of each value. Membership
+    tests have no false negatives and a false positive rate of
+    about the given rate once num_values values are added.
+
+    >>> bloom = BloomFilter(100)
+    >>> for i in range(100):
+    ...     bloom.add(str(i))
+    >>> all(str(i) in bloom for i in range(100))
+    True
+    >>> sum(str(i) in bloom for i in range(100, 10100)) < 300
+    True
+    """
+
+    def __init__(
+        self,
+        num_values: int,
+        false_positive_rate: float = 0.01
+    ) -> None:
+        assert 0 < false_positive_rate < 1, \
+            "false positive rate must be between 0 and 1"
+        num_values = max(1, num_values)
+        self.num_bits = max(
+            64,
+            int(-num_values * log(false_positive_rate) / log(2) ** 2)
+        )
+        self.num_hashes = max(
+            1,
+            round(self.num_bits / num_values * log(2))
+        )
+        self.bits = bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, value: str) -> Iterator[int]:
+        h1 = hash(value)
+        h2 = hash((value, 1)) | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, value: str) -> None:
+        for pos in self._positions(value):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, value: str) -> bool:
+        return all(
+            self.bits[pos >> 3] & (1 << (pos & 7))
+            for pos in self._positions(value)
+        )
+
+
+def semi_join(
+    table: Table,
+    other: Table,
+    column: int,
+    other_column: int,
+    bloom: bool = False
+) -> Table:
+    """
+
+    Selects the rows from the table that have a join partner in the
+    other table on the given columns, without joining them. Used to
+    pass the keys of a selective join input sideways to the other
+    input, so its rows are filtered before they take part in
+    further joins. With bloom, the keys are kept in a Bloom filter
+    instead of a set, which needs much less memory for many keys,
+    but lets about 1% of the rows without a partner through
+    (which the following join drops anyway).
+    The rows keep their order in the table.
+
+    >>> p = Table.build_from_file("persons.example.tsv")
+    >>> j = Table.build_from_file("jobs.example.tsv")
+    >>> managers = select_eq(j, 1, "manager")
+    >>> semi_join(p, managers, 3, 0) # doctest: +NORMALIZE_WHITESPACE
+    table: persons.example
+    id | name | age | job_id
+    ------------------------
+    0  | John | 29  | 0
+    4  | Mark | 38  | 0
+    >>> bloomed = semi_join(p, managers, 3, 0, bloom=True)
+    >>> set(semi_join(p, managers, 3, 0).rows) <= set(bloomed.rows)
+    True
+    """
+    assert (
+        0 <= column < len(table.columns)
+        and 0 <= other_column < len(other.columns)
+    ), "at least one column out of range"
+    _check_encoding(table, column, other, other_column)
+    keys: BloomFilter | set[Value]
+    if bloom:
+        other_rows = other.rows
+        keys = BloomFilter(len(other_rows))
+        for row in other_rows:
+            if row[other_column] is not None:
+                keys.add(row[other_column])  # type: ignore
+    else:
+        keys = {row[other_column] for row in other.iter_rows()}
+        keys.discard(None)
+    rows = [
+        row for row in table.iter_rows()
+        if row[column] is not None and row[column] in keys
+    ]
+    return Table(table.name, table.columns, rows, table.dictionaries)
+
+
 def join(
     table: Table,
     other: Table,
     column: int,
     other_column: int,
-    join_type: str = "inner"
+    join_type: str = "inner",
+    algorithm: str = "auto",
+    index: HashIndex | SortedIndex | None = None
 ) -> Table:
     """
 
     Joins the two tables on the given column indices using
-    a hash-based equi-join.
+    an equi-join. The join algorithm can be chosen by the caller:
+
+    - "hash": builds a hash map over one of the tables and
+      probes it with the rows of the other one
+    - "sort_merge": sorts both tables on their join column and
+      merges them; cheap if the inputs are already sorted
+      (e.g. by order_by), because sorting a sorted list is linear
+    - "index": index nested-loop join, probes the given prebuilt
+      index (or the index stored with the other table) on the join
+      column of the other table with every row of the table; the
+      index is built once and can be reused across many joins
+    - "auto" (default): uses an index nested-loop join if one of the
+      tables has an index on its join column that can be probed, and
+      a hash join otherwise
 
     >>> p = Table.build_from_file("persons.example.tsv")
     >>> p.name = "persons" # overwrite name of the table for brevity
@@ -152,6 +510,48 @@ def join(
     3    | Jane  | None | 1      | 1  | secretary
     4    | Mark  | 38   | 0      | 0  | manager
     None | None  | None | None   | 3  | ceo
+    >>> X = join(p, j, 3, 0, algorithm="sort_merge")
+    >>> X.rows = sorted(X.rows) # sort for doctest
+    >>> X # doctest: +NORMALIZE_WHITESPACE
+    table: persons X jobs
+    id | name  | age | job_id | id | job_title
+    --------------------------------------------------
+    0  | John  | 29  | 0      | 0  | manager
+    1  | Mary  | 18  | 2      | 2  | software engineer
+    2  | Peter | 38  | 1      | 1  | secretary
+    3  | Jane  | ?   | 1      | 1  | secretary
+    4  | Mark  | 38  | 0      | 0  | manager
+    >>> X = join(p, j, 3, 0, "right_outer", algorithm="sort_merge")
+    >>> X.rows = sorted(tuple(str(c) for c in r) for r in X.rows)
+    >>> X.rows[-1]
+    ('None', 'None', 'None', 'None', '3', 'ceo')
+    >>> index = HashIndex(j, 0)
+    >>> X = join(p, j, 3, 0, "left_outer", algorithm="index", index=index)
+    >>> X # doctest: +NORMALIZE_WHITESPACE
+    table: persons X jobs
+    id | name  | age | job_id | id | job_title
+    --------------------------------------------------
+    0  | John  | 29  | 0      | 0  | manager
+    1  | Mary  | 18  | 2      | 2  | software engineer
+    2  | Peter | 38  | 1      | 1  | secretary
+    3  | Jane  | ?   | 1      | 1  | secretary
+    4  | Mark  | 38  | 0      | 0  | manager
+    5  | Lisa  | 20  | 5      | ?  | ?
+    >>> _ = p.create_index(2, "sorted", int) # not used, compares ints
+    >>> join(Table("ages", ["age"], [("038",), ("x",)]), p, 0, 2).rows
+    []
+    >>> _ = p.create_index(3)
+    >>> X = join(j, p, 0, 3) # probes the index on persons
+    >>> X.rows = sorted(X.rows) # sort for doctest
+    >>> X # doctest: +NORMALIZE_WHITESPACE
+    table: jobs X persons
+    id | job_title         | id | name  | age | job_id
+    --------------------------------------------------
+    0  | manager           | 0  | John  | 29  | 0
+    0  | manager           | 4  | Mark  | 38  | 0
+    1  | secretary         | 2  | Peter | 38  | 1
+    1  | secretary         | 3  | Jane  | ?   | 1
+    2  | software engineer | 1  | Mary  | 18  | 2
     """
     assert (
         0 <= column < len(table.columns)
@@ -159,15 +559,109 @@ def join(
     ),  "at least one column out of range"
     assert join_type in {"inner", "left_outer", "right_outer"}, \
         "unknown join type"
+    assert algorithm in {"auto", "hash", "sort_merge", "index"}, \
+        "unknown join algorithm"
+    _check_encoding(table, column, other, other_column)
+
+    # whether the index is on the table instead of the other table,
+    # only possible for inner joins
+    reversed = False
+    if algorithm in {"auto", "index"} and index is None:
+        if join_type != "right_outer":
+            index = _equality_index(other, other_column)
+        if index is None and join_type == "inner":
+            index = _equality_index(table, column)
+            reversed = index is not None
+    if algorithm == "auto":
+        algorithm = "index" if index is not None else "hash"
 
+    if algorithm == "index":
+        assert index is not None, \
+            "index nested-loop join requires an index"
+        probe, probe_column = (table, column) if reversed \
+            else (other, other_column)
+        assert index.rows is probe.rows and index.column == probe_column, \
+            "index must be built on the join column of the other table"
+        assert join_type != "right_outer", \
+            "index nested-loop join does not support right outer joins"
+        joined_rows = _index_join(
+            other.rows if reversed else table.rows,
+            other_column if reversed else column,
+            index,
+            len(table.columns if reversed else other.columns),
+            join_type == "left_outer",
+            reversed
+        )
+    elif algorithm == "sort_merge":
+        joined_rows = _sort_merge_join(
+            table.rows,
+            other.rows,
+            column,
+            other_column,
+            len(table.columns),
+            len(other.columns),
+            join_type
+        )
+    else:
+        joined_rows = _hash_join(
+            table.rows,
+            other.rows,
+            column,
+            other_column,
+            len(table.columns),
+            len(other.columns),
+            join_type
+        )
+
+    return Table(
+        f"{table.name} X {other.name}",
+        table.columns + other.columns,
+        joined_rows,
+        _joined_dictionaries(table, other)
+    )
+
+
+def _check_encoding(
+    table: Table,
+    column: int,
+    other: Table,
+    other_column: int
+) -> None:
+    # codes of different dictionaries (or codes and values)
+    # cannot be compared
+    assert (
+        table.dictionaries.get(column)
+        is other.dictionaries.get(other_column)
+    ), "join columns must be encoded with the same dictionary or not at all"
+
+
+def _joined_dictionaries(table: Table, other: Table) -> dict[int, Dictionary]:
+    # dictionaries of the columns of the join of the tables
+    offset = len(table.columns)
+    return {
+        **table.dictionaries,
+        **{
+            offset + col: dictionary
+            for col, dictionary in other.dictionaries.items()
+        }
+    }
+
+
+def _hash_join(
+    rows: list[Row],
+    other_rows: list[Row],
+    column: int,
+    other_column: int,
+    num_columns: int,
+    num_other_columns: int,
+    join_type: str
+) -> list[Row]:
     # optimization: decide
     # which table is hashed and which is iterated over,
     # in general it is faster to hash the smaller table
     # and iterate over the large one; this can only be
     # done for inner joins, for outer joins the order
     # of the tables matter
-    other_rows, rows = other.rows, table.rows
-    num_other_columns = len(other.columns)
     is_inner = join_type == "inner"
     reversed = (
         (is_inner and len(other_rows) > len(rows))
@@ -176,7 +670,7 @@ def join(
     if reversed:
         rows, other_rows = other_rows, rows
         column, other_column = other_column, column
-        num_other_columns = len(table.columns)
+        num_other_columns = num_columns
 
     other_hashed: dict[str, list[int]] = {}
     for i, row in enumerate(other_rows):
@@ -211,23 +705,369 @@ def join(
                 row + other_row
             )
 
-    return Table(
-        f"{table.name} X {other.name}",
-        table.columns + other.columns,
-        joined_rows
+    return joined_rows
+
+
+def _sort_merge_join(
+    rows: list[Row],
+    other_rows: list[Row],
+    column: int,
+    other_column: int,
+    num_columns: int,
+    num_other_columns: int,
+    join_type: str
+) -> list[Row]:
+    # sort the row ids of both tables on their join column,
+    # rows with a None key never match and are only
+    # needed for outer joins
+    ids = sorted(
+        (i for i, row in enumerate(rows) if row[column] is not None),
+        key=lambda i: rows[i][column]  # type: ignore
+    )
+    other_ids = sorted(
+        (i for i, row in enumerate(other_rows)
+         if row[other_column] is not None),
+        key=lambda i: other_rows[i][other_column]  # type: ignore
     )
+    nulls = tuple(None for _ in range(num_other_columns))
+    other_nulls = tuple(None for _ in range(num_columns))
+    keep_left = join_type == "left_outer"
+    keep_right = join_type == "right_outer"
+
+    joined_rows = []
+    i, j = 0, 0
+    while i < len(ids) and j < len(other_ids):
+        val = rows[ids[i]][column]
+        other_val = other_rows[other_ids[j]][other_column]
+        if val < other_val:  # type: ignore
+            if keep_left:
+                joined_rows.append(rows[ids[i]] + nulls)
+            i += 1
+        elif val > other_val:  # type: ignore
+            if keep_right:
+                joined_rows.append(other_nulls + other_rows[other_ids[j]])
+            j += 1
+        else:
+            # find the runs of equal keys on both sides
+            # and output their cross product
+            i_end = i + 1
+            while i_end < len(ids) and rows[ids[i_end]][column] == val:
+                i_end += 1
+            j_end = j + 1
+            while (
+                j_end < len(other_ids)
+                and other_rows[other_ids[j_end]][other_column] == val
+            ):
+                j_end += 1
+            for row_idx in ids[i:i_end]:
+                row = rows[row_idx]
+                for other_row_idx in other_ids[j:j_end]:
+                    joined_rows.append(row + other_rows[other_row_idx])
+            i, j = i_end, j_end
+
+    # add the unmatched rows for outer joins
+    if keep_left:
+        joined_rows.extend(rows[row_idx] + nulls for row_idx in ids[i:])
+        joined_rows.extend(
+            row + nulls for row in rows if row[column] is None
+        )
+    elif keep_right:
+        joined_rows.extend(
+            other_nulls + other_rows[row_idx] for row_idx in other_ids[j:]
+        )
+        joined_rows.extend(
+            other_nulls + row for row in other_rows
+            if row[other_column] is None
+        )
+
+    return joined_rows
+
+
+def _index_join(
+    rows: list[Row],
+    column: int,
+    index: HashIndex | SortedIndex,
+    num_other_columns: int,
+    keep_unmatched: bool,
+    reversed: bool = False
+) -> list[Row]:
+    # no hash map has to be built here, the index
+    # on the other table already exists
+    other_rows = index.rows
+    nulls = tuple(None for _ in range(num_other_columns))
+    joined_rows = []
+    for row in rows:
+        row_ids = index.lookup(row[column])
+        if not row_ids:
+            if keep_unmatched:
+                joined_rows.append(row + nulls)
+            continue
+
+        for row_idx in row_ids:
+            other_row = other_rows[row_idx]
+            joined_rows.append(
+                other_row + row if reversed else
+                row + other_row
+            )
+
+    return joined_rows
+
+
+def _equality_index(
+    table: Table,
+    column: int
+) -> HashIndex | SortedIndex | None:
+    # the index on the column that a join can probe with the values as
+    # they are, i.e. not a sorted index with a key
+    index = table.get_index(column)
+    if isinstance(index, SortedIndex) and index.key is not None:
+        return None
+    return index
+
+
+def late_join(
+    table: Table,
+    other: Table,
+    column: int,
+    other_column: int
+) -> Table:
+    """
+
+    Inner equi-join of the two tables on the given column indices
+    with late materialization: instead of concatenating the matching
+    rows, the result only holds the row ids of the matches in each
+    joined base table (as int64 arrays, joining results of late_join
+    extends them). Column values are gathered only when they are
+    needed: project and group_by gather just the columns they use,
+    other operations materialize all rows on first access. This
+    saves building and copying wide rows in chains of joins whose
+    results are mostly projected away.
+    Probes the index of the other table on its join column if it has
+    one that can be probed, hashes the smaller input otherwise.
+
+    >>> p = Table.build_from_file("persons.example.tsv")
+    >>> p.name = "persons" # overwrite name of the table for brevity
+    >>> j = Table.build_from_file("jobs.example.tsv")
+    >>> j.name = "jobs" # overwrite name of the table for brevity
+    >>> X = late_join(p, j, 3, 0)
+    >>> X.shape
+    (5, 6)
+    >>> sorted(project(X, [1, 5]).rows) # doctest: +NORMALIZE_WHITESPACE
+    [('Jane', 'secretary'), ('John', 'manager'), ('Mark', 'manager'),
+     ('Mary', 'software engineer'), ('Peter', 'secretary')]
+    >>> sorted(X.rows) == sorted(join(p, j, 3, 0).rows)
+    True
+    >>> Y = late_join(X, p, 4, 3)
+    >>> Y.name, Y.shape
+    ('persons X jobs X persons', (9, 10))
+    """
+    assert (
+        0 <= column < len(table.columns)
+        and 0 <= other_column < len(other.columns)
+    ), "at least one column out of range"
+    _check_encoding(table, column, other, other_column)
+    sources, ids = _late_inputs(table)
+    other_sources, other_ids = _late_inputs(other)
+    keys = _column_values(table, column)
+    # positions of the matching rows in both inputs
+    positions: list[int] = []
+    other_positions: list[int] = []
+
+    index = None
+    if not isinstance(other, _JoinedTable):
+        index = _equality_index(other, other_column)
+    if index is not None:
+        for i, key in enumerate(keys):
+            if key is None:
+                continue
+            for j in index.lookup(key):
+                positions.append(i)
+                other_positions.append(j)
+    else:
+        other_keys = _column_values(other, other_column)
+        # hash the smaller input
+        reversed = len(keys) < len(other_keys)
+        if reversed:
+            keys, other_keys = other_keys, keys
+            positions, other_positions = other_positions, positions
+        hashed: dict[Value, list[int]] = {}
+        for j, key in enumerate(other_keys):
+            if key is None:
+                continue
+            if key in hashed:
+                hashed[key].append(j)
+            else:
+                hashed[key] = [j]
+        for i, key in enumerate(keys):
+            matches = hashed.get(key)
+            if matches is None:
+                continue
+            for j in matches:
+                positions.append(i)
+                other_positions.append(j)
+        if reversed:
+            positions, other_positions = other_positions, positions
+
+    return _JoinedTable(
+        sources + other_sources,
+        [array("q", map(row_ids.__getitem__, positions)) for row_ids in ids]
+        + [
+            array("q", map(row_ids.__getitem__, other_positions))
+            for row_ids in other_ids
+        ]
+    )
+
+
+def _late_inputs(table: Table) -> tuple[list[Table], list[array]]:
+    # base tables and row ids of an input of late_join
+    if isinstance(table, _JoinedTable) and not table.is_materialized:
+        return table.sources, table.ids
+    return [table], [array("q", range(len(table.rows)))]
+
+
+def _column_values(table: Table, column: int) -> list[Value]:
+    if isinstance(table, _JoinedTable) and not table.is_materialized:
+        return table.column_values(column)
+    return list(map(itemgetter(column), table.rows))
+
+
+class _JoinedTable(Table):
+    # result of late_join, holds the base tables that were joined and
+    # the row ids of the joined rows in each of them, and gathers the
+    # values of the columns lazily
+
+    def __init__(self, sources: list[Table], ids: list[array]) -> None:
+        self.sources = sources
+        self.ids = ids
+        # source and column in the source of each column
+        self.locations = [
+            (s, col)
+            for s, source in enumerate(sources)
+            for col in range(len(source.columns))
+        ]
+        self._rows: list[Row] | None = None
+        super().__init__(  # type: ignore
+            " X ".join(source.name for source in sources),
+            [col for source in sources for col in source.columns],
+            None,
+            {
+                i: sources[s].dictionaries[col]
+                for i, (s, col) in enumerate(self.locations)
+                if col in sources[s].dictionaries
+            }
+        )
+
+    @property  # type: ignore
+    def rows(self) -> list[Row]:
+        if self._rows is None:
+            self._rows = self.gather(list(range(len(self.columns))))
+        return self._rows
+
+    @rows.setter
+    def rows(self, rows: list[Row] | None) -> None:
+        self._rows = rows
+
+    def iter_rows(self) -> Iterator[Row]:
+        return iter(self.rows)
+
+    @property
+    def is_materialized(self) -> bool:
+        return self._rows is not None
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        if self._rows is not None:
+            return len(self._rows), len(self.columns)
+        return len(self.ids[0]), len(self.columns)
+
+    def column_values(self, column: int) -> list[Value]:
+        """
+
+        Returns the values of the given column of all rows.
+
+        """
+        if self._rows is not None:
+            return list(map(itemgetter(column), self._rows))
+        source, col = self.locations[column]
+        rows = self.sources[source].rows
+        return list(map(itemgetter(col), map(rows.__getitem__,
+                                             self.ids[source])))
+
+    def gather(self, columns: list[int]) -> list[Row]:
+        """
+
+        Returns the rows with only the given columns.
+
+        """
+        return list(self.iter_gather(columns))
+
+    def iter_gather(self, columns: list[int]) -> Iterator[Row]:
+        """
+
+        Iterates over the rows with only the given columns, without
+        building all of them at once (only the lists of the values
+        of the given columns).
+
+        """
+        if self._rows is not None:
+            return (tuple(row[col] for col in columns) for row in self._rows)
+        return zip(*(self.column_values(col) for col in columns))
+
+
+def sort_key(
+    column: int,
+    cast: Callable[[str], Any] | None = None
+) -> Callable[[Row], tuple[bool, Any]]:
+    """
+
+    Returns a sort key function for rows on the given column.
+    Values are compared after converting them with the given cast
+    function, e.g. float for numeric columns, as strings if no
+    cast function is given. None values are smaller than all
+    other values, so they come first in ascending and last
+    in descending order.
+
+    >>> key = sort_key(0, float)
+    >>> sorted([("10",), (None,), ("9.5",)], key=key)
+    [(None,), ('9.5',), ('10',)]
+    """
+    def key(row: Row) -> tuple[bool, Any]:
+        val = row[column]
+        if val is None:
+            return (False, None)
+        return (True, val if cast is None else cast(val))
+
+    return key
 
 
 def order_by(
     table: Table,
     column: int,
-    ascending: bool = True
+    ascending: bool = True,
+    cast: Callable[[str], Any] | None = None,
+    memory_budget: int | None = None
 ) -> Table:
     """
 
     Order the table by the given column in the given order.
     None values should come first when ascending is true,
-    last if ascending is false.
+    last if ascending is false. Values are compared after
+    converting them with the given cast function, as strings
+    if no cast function is given.
+
+    The rows are only sorted when they are first accessed,
+    so that a limit directly on the result of order_by can
+    be computed with top_n instead of a full sort.
+
+    If a memory budget in bytes is given, the rows are sorted
+    with an external merge sort that spills sorted runs to
+    temporary files (see external_sort.py), and operations that
+    iterate over the result (like project and select) consume
+    the merged rows as a stream without materializing them.
+
+    Dictionary-encoded columns are ordered by their codes, which
+    compare like their values as strings, so they do not support
+    cast functions.
 
     >>> t = Table.build_from_file("persons.example.tsv")
     >>> order_by(t, 2) # doctest: +NORMALIZE_WHITESPACE
@@ -250,17 +1090,117 @@ def order_by(
     5  | Lisa  | 20  | 5
     1  | Mary  | 18  | 2
     3  | Jane  | ?   | 1
+    >>> t = order_by(t, 2, ascending=False, cast=int, memory_budget=500)
+    >>> project(t, [1]) # doctest: +NORMALIZE_WHITESPACE
+    table: persons.example
+    name
+    -----
+    Peter
+    Mark
+    John
+    Lisa
+    Mary
+    Jane
+    """
+    assert 0 <= column < len(table.columns), \
+        "column out of range"
+    assert memory_budget is None or memory_budget > 0, \
+        "memory budget must be positive"
+    assert cast is None or column not in table.dictionaries, \
+        "cast functions are not supported on dictionary-encoded columns"
+    return _OrderedTable(table, column, ascending, cast, memory_budget)
+
+
+class _OrderedTable(Table):
+    # result of order_by, sorts the rows of the input
+    # table lazily when they are first accessed
+
+    def __init__(
+        self,
+        table: Table,
+        column: int,
+        ascending: bool,
+        cast: Callable[[str], Any] | None,
+        memory_budget: int | None = None
+    ) -> None:
+        self.source = table
+        self.column = column
+        self.ascending = ascending
+        self.cast = cast
+        self.memory_budget = memory_budget
+        self._rows: list[Row] | None = None
+        super().__init__(  # type: ignore
+            table.name,
+            table.columns,
+            None,
+            table.dictionaries
+        )
+
+    @property  # type: ignore
+    def rows(self) -> list[Row]:
+        if self._rows is None and self.memory_budget is None:
+            self._rows = sorted(
+                self.source.iter_rows(),
+                key=sort_key(self.column, self.cast),
+                reverse=not self.ascending
+            )
+        elif self._rows is None:
+            self._rows = list(self.iter_rows())
+        return self._rows
+
+    @rows.setter
+    def rows(self, rows: list[Row] | None) -> None:
+        self._rows = rows
+
+    def iter_rows(self) -> Iterator[Row]:
+        if self._rows is not None or self.memory_budget is None:
+            return iter(self.rows)
+        return external_sort(
+            self.source.iter_rows(),
+            len(self.columns),
+            sort_key(self.column, self.cast),
+            not self.ascending,
+            self.memory_budget
+        )
+
+    @property
+    def is_sorted(self) -> bool:
+        return self._rows is not None
+
+
+def top_n(
+    table: Table,
+    column: int,
+    n: int,
+    ascending: bool = True,
+    cast: Callable[[str], Any] | None = None
+) -> Table:
+    """
+
+    Returns the first n rows of the table ordered by the given
+    column, with the same order and tie-breaking as order_by
+    followed by limit, but using a bounded heap in O(r * log(n))
+    time for r rows instead of sorting all rows.
+
+    >>> t = Table.build_from_file("persons.example.tsv")
+    >>> top_n(t, 2, 3, ascending=False, cast=int) \
+    # doctest: +NORMALIZE_WHITESPACE
+    table: persons.example
+    id | name  | age | job_id
+    -------------------------
+    2  | Peter | 38  | 1
+    4  | Mark  | 38  | 0
+    0  | John  | 29  | 0
     """
     assert 0 <= column < len(table.columns), \
         "column out of range"
+    assert n > 0, "n must be positive"
+    select_n = nsmallest if ascending else nlargest
     return Table(
         table.name,
         table.columns,
-        sorted(
-            table.rows,
-            key=lambda row: row[column] or "",
-            reverse=not ascending
-        )
+        select_n(n, table.rows, key=sort_key(column, cast)),
+        table.dictionaries
     )
 
 
@@ -271,6 +1211,8 @@ def limit(
     """
 
     Limits the number of rows of the table to the given limit.
+    If the table is the not yet sorted result of order_by,
+    the limit is computed with top_n instead.
 
     >>> t = Table.build_from_file("persons.example.tsv")
     >>> limit(t, 2) # doctest: +NORMALIZE_WHITESPACE
@@ -279,18 +1221,293 @@ def limit(
     ------------------------
     0  | John | 29  | 0
     1  | Mary | 18  | 2
+    >>> limit(order_by(t, 2, cast=int), 2) \
+    # doctest: +NORMALIZE_WHITESPACE
+    table: persons.example
+    id | name | age | job_id
+    ------------------------
+    3  | Jane | ?   | 1
+    1  | Mary | 18  | 2
     """
     assert limit > 0, "limit must be positive"
-    return Table(table.name, table.columns, table.rows[:limit])
+    if isinstance(table, _OrderedTable) and not table.is_sorted:
+        return top_n(
+            table.source,
+            table.column,
+            limit,
+            table.ascending,
+            table.cast
+        )
+    return Table(
+        table.name,
+        table.columns,
+        table.rows[:limit],
+        table.dictionaries
+    )
 
 
 AggregationFn = Callable[[list[Value]], Value]
 
 
+class Aggregate:
+    """
+
+    Base class of the built-in aggregates of group_by.
+    Instead of collecting all values of a group into a list,
+    a built-in aggregate keeps a running state of constant size
+    per group, which is updated with every value of the group
+    and turned into the aggregated value once all rows are seen.
+    None values are ignored, like in SQL.
+
+    Aggregates can also be called on a list of values,
+    so they can be used wherever an AggregationFn is expected.
+
+    Aggregates that compute on the values (like Sum) rather than
+    only count or compare them (like Count) set needs_values, so
+    that group_by decodes the values of dictionary-encoded columns
+    for them instead of passing the codes.
+
+    >>> Avg(digits=2)(["1", "2", None, "2"])
+    '1.67'
+    """
+
+    needs_values = False
+
+    def start(self) -> Any:
+        """
+
+        Returns the initial state of a group.
+
+        """
+        raise NotImplementedError
+
+    def update(self, state: Any, value: Value) -> Any:
+        """
+
+        Returns the state of a group after adding the given value.
+
+        """
+        raise NotImplementedError
+
+    def finish(self, state: Any) -> Value:
+        """
+
+        Returns the aggregated value for the final state of a group.
+
+        """
+        raise NotImplementedError
+
+    def __call__(self, values: list[Value]) -> Value:
+        state = self.start()
+        for value in values:
+            state = self.update(state, value)
+        return self.finish(state)
+
+
+class Count(Aggregate):
+    """
+
+    Counts the non-None values of a group.
+
+    >>> Count()(["a", None, "b"])
+    '2'
+    """
+
+    def start(self) -> int:
+        return 0
+
+    def update(self, state: int, value: Value) -> int:
+        return state if value is None else state + 1
+
+    def finish(self, state: int) -> Value:
+        return str(state)
+
+
+class Sum(Aggregate):
+    """
+
+    Sums up the values of a group, after converting them
+    with the given cast function (float by default).
+    The sum of a group without values is None.
+
+    >>> Sum(cast=int)(["1", "2", None])
+    '3'
+    >>> Sum()([None]) is None
+    True
+    """
+
+    needs_values = True
+
+    def __init__(self, cast: Callable[[str], Any] = float) -> None:
+        self.cast = cast
+
+    def start(self) -> Any:
+        return None
+
+    def update(self, state: Any, value: Value) -> Any:
+        if value is None:
+            return state
+        value = self.cast(value)
+        return value if state is None else state + value
+
+    def finish(self, state: Any) -> Value:
+        return None if state is None else str(state)
+
+
+class Avg(Aggregate):
+    """
+
+    Averages the values of a group, after converting them
+    with the given cast function (float by default), optionally
+    rounded to the given number of digits.
+    The average of a group without values is None.
+
+    >>> Avg()(["1", "2"])
+    '1.5'
+    """
+
+    needs_values = True
+
+    def __init__(
+        self,
+        digits: int | None = None,
+        cast: Callable[[str], Any] = float
+    ) -> None:
+        self.digits = digits
+        self.cast = cast
+
+    def start(self) -> list:
+        # running sum and count
+        return [0, 0]
+
+    def update(self, state: list, value: Value) -> list:
+        if value is not None:
+            state[0] += self.cast(value)
+            state[1] += 1
+        return state
+
+    def finish(self, state: list) -> Value:
+        if state[1] == 0:
+            return None
+        avg = state[0] / state[1]
+        return str(avg if self.digits is None else round(avg, self.digits))
+
+
+class Min(Aggregate):
+    """
+
+    Returns the smallest value of a group. Values are compared
+    after converting them with the given cast function,
+    as strings if no cast function is given.
+
+    >>> Min()(["9", "10"])
+    '10'
+    >>> Min(cast=int)(["9", "10"])
+    '9'
+    """
+
+    def __init__(self, cast: Callable[[str], Any] | None = None) -> None:
+        self.cast = cast
+        self.sign = 1
+        # the codes of encoded columns compare like their values,
+        # but the cast function needs the values
+        self.needs_values = cast is not None
+
+    def start(self) -> Any:
+        # the best key so far and its value
+        return None
+
+    def update(self, state: Any, value: Value) -> Any:
+        if value is None:
+            return state
+        key = value if self.cast is None else self.cast(value)
+        if state is None or (
+            key < state[0] if self.sign > 0 else key > state[0]
+        ):
+            return (key, value)
+        return state
+
+    def finish(self, state: Any) -> Value:
+        return None if state is None else state[1]
+
+
+class Max(Min):
+    """
+
+    Returns the largest value of a group. Values are compared
+    after converting them with the given cast function,
+    as strings if no cast function is given.
+
+    >>> Max(cast=float)(["9.5", "10", None])
+    '10'
+    """
+
+    def __init__(self, cast: Callable[[str], Any] | None = None) -> None:
+        super().__init__(cast)
+        self.sign = -1
+
+
+class ApproxCountDistinct(Aggregate):
+    """
+
+    Estimates the number of distinct non-None values of a group
+    with a HyperLogLog sketch of 2^precision one-byte registers,
+    independent of the number of values in the group. The standard
+    error of the estimate is about 1.04 / sqrt(2^precision),
+    i.e. about 3% for the default precision of 10.
+
+    >>> ApproxCountDistinct()(["a", "b", "a", None, "c"])
+    '3'
+    >>> values = [str(i % 5000) for i in range(20000)]
+    >>> abs(int(ApproxCountDistinct()(values)) - 5000) < 500
+    True
+    >>> ApproxCountDistinct()([0, 1, 1, 2])
+    '3'
+    """
+
+    def __init__(self, precision: int = 10) -> None:
+        assert 4 <= precision <= 16, "precision must be between 4 and 16"
+        self.precision = precision
+        self.num_registers = 1 << precision
+        self.alpha = 0.7213 / (1 + 1.079 / self.num_registers)
+
+    def start(self) -> bytearray:
+        return bytearray(self.num_registers)
+
+    def update(self, state: bytearray, value: Value) -> bytearray:
+        if value is None:
+            return state
+        # use a hash function that is stable across runs, unlike
+        # the built-in hash of strings, on the string of the value,
+        # which also works for the codes of encoded columns
+        h = int.from_bytes(
+            blake2b(str(value).encode("utf8"), digest_size=8).digest(),
+            "big"
+        )
+        register = h >> (64 - self.precision)
+        rest = h & ((1 << (64 - self.precision)) - 1)
+        # position of the first 1-bit in the remaining bits
+        rank = 64 - self.precision - rest.bit_length() + 1
+        if rank > state[register]:
+            state[register] = rank
+        return state
+
+    def finish(self, state: bytearray) -> Value:
+        m = self.num_registers
+        estimate = self.alpha * m * m / sum(2.0 ** -r for r in state)
+        zeros = state.count(0)
+        if estimate <= 2.5 * m and zeros > 0:
+            # linear counting for small cardinalities
+            estimate = m * log(m / zeros)
+        return str(round(estimate))
+
+
 def group_by(
     table: Table,
     columns: list[int],
-    aggregations: list[tuple[int, AggregationFn]]
+    aggregations: list[tuple[int, AggregationFn | Aggregate]],
+    having: Callable[[Row], bool] | None = None,
+    memory_budget: int | None = None
 ) -> Table:
     """
 
@@ -299,6 +1516,25 @@ def group_by(
     The aggregations should be given as a list of tuples
     of (column, aggregation_function).
 
+    Aggregation functions are either built-in aggregates
+    (Count, Sum, Avg, Min, Max, ApproxCountDistinct), which keep
+    a running state of constant size per group, or arbitrary
+    functions on the list of all values of a group, which
+    requires keeping these values in memory.
+    If a having predicate is given, only the result rows
+    for which it evaluates to true are returned.
+    If a memory budget in bytes is given, the groups are kept in a
+    hash table on the compact encoded keys that spills partitions of
+    the groups with their running states and rows to temporary files
+    if it does not fit into the budget (see external_hash.py), so
+    the states of the aggregates must be picklable.
+    Dictionary-encoded columns are grouped by their codes, which
+    stay encoded in the result, like the results of Min and Max
+    without cast function on encoded columns. Built-in aggregates
+    that compute on the values (see Aggregate.needs_values) get the
+    decoded values, custom aggregation functions (and the having
+    predicate) see the codes.
+
     >>> from math import prod
     >>> p = Table.build_from_file("persons.example.tsv")
     >>> g = group_by(
@@ -319,6 +1555,27 @@ def group_by(
     29   | John        | 0  | 0
     38   | Peter, Mark | 8  | 1
     None | Jane        | 3  | 1
+    >>> group_by(
+    ...     p,
+    ...     [3],
+    ...     [(0, Count()),
+    ...      (2, Avg(digits=1)),
+    ...      (2, Max(cast=int))],
+    ...     having=lambda row: int(row[1]) >= 2
+    ... ) # doctest: +NORMALIZE_WHITESPACE
+    table: persons.example
+    job_id | id | age  | age
+    ------------------------
+    0      | 2  | 33.5 | 38
+    1      | 2  | 38.0 | 38
+    >>> g = group_by(p, [3], [(0, Count())], memory_budget=200)
+    >>> sorted(g.rows)
+    [('0', '2'), ('1', '2'), ('2', '1'), ('5', '1')]
+    >>> p.encode_column(2, Dictionary(row[2] for row in p.rows))
+    >>> g = group_by(p, [3], [(2, Sum(cast=int)), (2, Max())])
+    >>> sorted(g.decode().rows) # doctest: +NORMALIZE_WHITESPACE
+    [('0', '67', '38'), ('1', '38', '38'),
+     ('2', '18', '18'), ('5', '20', '20')]
     """
     assert len(aggregations) > 0 and len(columns) > 0, \
         "zero columns or aggregations given"
@@ -333,29 +1590,118 @@ def group_by(
     assert column_set.isdisjoint(agg_set), \
         "none of the columns to aggregate should be in the columns grouped by"
 
-    # TODO: return a new table where the rows are grouped
-    # by the given columns and the columns to aggregate
-    # are aggregated by the given aggregation functions
+    # custom aggregation functions fall back to collecting
+    # all values of a group in a list
+    aggregates = [
+        func if isinstance(func, Aggregate) else _Collect(func)
+        for _, func in aggregations
+    ]
+    agg_columns = [col for col, _ in aggregations]
+    starts = [agg.start for agg in aggregates]
+    updates = list(enumerate(zip(agg_columns, (
+        _decoding(agg.update, table.dictionaries[col])
+        if agg.needs_values and col in table.dictionaries
+        else agg.update
+        for col, agg in zip(agg_columns, aggregates)
+    ))))
+
+    key_columns = columns
+    num_columns = len(table.columns)
+    rows: Iterable[Row]
+    if isinstance(table, _JoinedTable) and not table.is_materialized:
+        # results of late_join only gather the used columns
+        used = columns + sorted(set(agg_columns))
+        rows = table.iter_gather(used)
+        key_columns = list(range(len(columns)))
+        num_columns = len(used)
+        updates = [
+            (i, (used.index(col), update))
+            for i, (col, update) in updates
+        ]
+    else:
+        rows = table.rows
+
+    def update_states(states: list[Any], row: Row) -> list[Any]:
+        for i, (col, update) in updates:
+            states[i] = update(states[i], row[col])
+        return states
 
-    hash_map = {}
-    new_cols = [table.columns[i] for i in columns] + [table.columns[i[0]] for i in aggregations]
+    groups: Iterable[tuple[tuple[Value, ...], list[Any]]]
+    if memory_budget is not None:
+        groups = (
+            (decode_key(key, len(columns)), states)
+            for key, states in hybrid_hash(
+                rows,
+                num_columns,
+                lambda row: encode_key(tuple(row[i] for i in key_columns)),
+                lambda row: update_states(
+                    [start() for start in starts], row
+                ),
+                update_states,
+                64 * len(aggregates),
+                memory_budget
+            )
+        )
+    else:
+        hash_map: dict[tuple[Value, ...], list[Any]] = {}
+        for row in rows:
+            key = tuple(row[i] for i in key_columns)
+            states = hash_map.get(key)
+            if states is None:
+                states = [start() for start in starts]
+                hash_map[key] = states
+            for i, (col, update) in updates:
+                states[i] = update(states[i], row[col])
+        groups = hash_map.items()
+
+    new_cols = [table.columns[i] for i in columns] + \
+        [table.columns[col] for col in agg_columns]
+    dictionaries: dict[int, Dictionary] = {
+        i: table.dictionaries[col]
+        for i, col in enumerate(columns + agg_columns)
+        if col in table.dictionaries and (
+            i < len(columns) or (
+                isinstance(aggregates[i - len(columns)], Min)
+                and aggregates[i - len(columns)].cast is None  # type: ignore
+            )
+        )
+    }
     new_rows = []
+    for key, states in groups:
+        new_row = key + tuple(
+            agg.finish(state) for agg, state in zip(aggregates, states)
+        )
+        if having is None or having(new_row):
+            new_rows.append(new_row)
 
-    for row in table.rows:
-        key = tuple(row[i] for i in columns)
-        if key in hash_map:
-            hash_map[key].append(tuple(row[i[0]] for i in aggregations))
-        else:
-            hash_map[key] = [tuple(row[i[0]] for i in aggregations)]
+    return Table(table.name, new_cols, new_rows, dictionaries)
+
+
+def _decoding(
+    update: Callable[[Any, Value], Any],
+    dictionary: Dictionary
+) -> Callable[[Any, Value], Any]:
+    # the update function of an aggregate on the values
+    # of a column encoded with the given dictionary
+    values = dictionary.values
+    return lambda state, code: update(
+        state, None if code is None else values[code]  # type: ignore
+    )
+
+
+class _Collect(Aggregate):
+    # adapter for custom aggregation functions,
+    # collects all values of a group in a list
+
+    def __init__(self, func: AggregationFn) -> None:
+        self.func = func
 
-    for key in hash_map:
-        agg_list = []
-        val = hash_map[key]
-        for i, (col, func) in enumerate(aggregations):
-            result = func([item[i] for item in val])
-            agg_list.append(result)
-        new_rows.append(tuple(list(key) + agg_list))
+    def start(self) -> list[Value]:
+        return []
 
+    def update(self, state: list[Value], value: Value) -> list[Value]:
+        state.append(value)
+        return state
 
-    return Table(table.name, new_cols, new_rows)
-  
+    def finish(self, state: list[Value]) -> Value:
+        return self.func(state)
@@ -0,0 +1,305 @@
+import json
+import sys
+import tracemalloc
+import weakref
+from time import perf_counter
+from types import ModuleType
+from typing import Any, Callable
+
+from table import Table
+from execution import ResultCache, instrument
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None  # type: ignore
+
+
+def _max_rss() -> int | None:
+    # peak resident set size of the process in bytes
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def _num_rows(table: Any) -> int | None:
+    # number of rows of a table, without sorting the rows
+    # of a lazily ordered table (which would defeat top-N)
+    if not isinstance(table, Table) or getattr(table, "is_sorted", True) \
+            is False:
+        return None
+    # shape does not materialize the rows of results of late_join
+    return table.shape[0]
+
+
+def _describe(arg: Any) -> str:
+    # short description of an argument of an operator
+    if isinstance(arg, Table):
+        return arg.name
+    elif isinstance(arg, (list, tuple)):
+        parts = ", ".join(_describe(a) for a in arg)
+        return f"[{parts}]" if isinstance(arg, list) else f"({parts})"
+    elif callable(arg):
+        return getattr(arg, "__name__", None) or type(arg).__name__
+    return repr(arg)
+
+
+def _format_bytes(num_bytes: int) -> str:
+    for unit in ["B", "KB", "MB"]:
+        if num_bytes < 1024:
+            return f"{num_bytes:.0f} {unit}" if unit == "B" \
+                else f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024  # type: ignore
+    return f"{num_bytes:.1f} GB"
+
+
+class OperatorStats:
+    """
+
+    Statistics of a single operator call: the number of rows of its
+    input tables and of its output table (None if the output is
+    produced lazily, like the result of order_by), the elapsed
+    time in seconds and the peak memory of the call in bytes (see
+    Profile for how it is measured). The children are the operator
+    calls that produced the input tables. Cached tells whether the
+    result came from a result cache (None if no cache was used).
+
+    """
+
+    def __init__(
+        self,
+        description: str,
+        rows_in: list[int | None],
+        rows_out: int | None,
+        seconds: float,
+        peak_memory: int | None,
+        children: list["OperatorStats"],
+        cached: bool | None = None
+    ) -> None:
+        self.description = description
+        self.rows_in = rows_in
+        self.rows_out = rows_out
+        self.seconds = seconds
+        self.peak_memory = peak_memory
+        self.children = children
+        self.cached = cached
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "operator": self.description,
+            "rows_in": self.rows_in,
+            "rows_out": self.rows_out,
+            "seconds": self.seconds,
+            "peak_memory": self.peak_memory,
+            "cached": self.cached,
+            "children": [child.to_dict() for child in self.children]
+        }
+
+
+class Profile:
+    """
+
+    Records statistics of operator calls, like EXPLAIN ANALYZE.
+    Operators are called through call, which builds the plan tree
+    from the data flow: a call whose input table is the output of
+    an earlier call becomes the parent of that call.
+
+    The overhead is a few timer and len calls per operator, so the
+    profile can be left enabled. By default the peak memory of a
+    call is the growth of the peak resident set size of the
+    process, which is cheap but only shows new high water marks;
+    with trace_memory the peak of the memory allocated by the call
+    is traced with tracemalloc, which is exact but makes all
+    allocations considerably slower. Thus, format labels the
+    former as the growth of the high water mark, which is 0 B
+    for calls that stay below the peak of earlier calls.
+
+    Note that the rows of a lazily ordered table are sorted by the
+    operator consuming them, so the time of the sort is part of
+    the time of that operator.
+
+    If a result cache is given, the operators are called through
+    it, and the profile shows which results came from the cache
+    together with the statistics of the cache.
+
+    >>> from operations import join, select, project
+    >>> p = Table.build_from_file("persons.example.tsv")
+    >>> j = Table.build_from_file("jobs.example.tsv")
+    >>> profile = Profile()
+    >>> s = profile.call("select", select, p, lambda row: row[2] == "38")
+    >>> x = profile.call("join", join, s, j, 3, 0)
+    >>> r = profile.call("project", project, x, [1, 5])
+    >>> print(profile.format(times=False, memory=False))
+    project (rows: 2 -> 2)
+      join (rows: 2 x 4 -> 2)
+        select (rows: 6 -> 2)
+    >>> profile.to_dict()[0]["children"][0]["rows_in"]
+    [2, 4]
+    """
+
+    def __init__(
+        self,
+        trace_memory: bool = False,
+        cache: ResultCache | None = None
+    ) -> None:
+        self.trace_memory = trace_memory
+        self.cache = cache
+        # calls whose output has not been consumed by another call,
+        # by id of the output table, with a weak reference to the
+        # table to detect reuse of ids
+        self._open: dict[int, tuple[weakref.ref, OperatorStats]] = {}
+        self._roots: list[OperatorStats] = []
+
+    def call(
+        self,
+        description: str,
+        func: Callable[..., Any],
+        *args: Any,
+        **kwargs: Any
+    ) -> Any:
+        """
+
+        Calls the operator with the given arguments, records
+        its statistics and returns its result.
+
+        """
+        inputs = [
+            arg for arg in args if isinstance(arg, Table)
+        ] + [
+            table for arg in args if isinstance(arg, list)
+            for table in arg if isinstance(table, Table)
+        ]
+        children = []
+        for table in inputs:
+            entry = self._open.get(id(table))
+            if entry is not None and entry[0]() is table:
+                del self._open[id(table)]
+                children.append(entry[1])
+                self._roots.remove(entry[1])
+        rows_in = [_num_rows(table) for table in inputs]
+
+        if self.trace_memory:
+            started = tracemalloc.is_tracing()
+            if not started:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            memory_before = tracemalloc.get_traced_memory()[0]
+        else:
+            rss_before = _max_rss()
+        start = perf_counter()
+        if self.cache is None:
+            result = func(*args, **kwargs)
+        else:
+            result = self.cache.call(func, *args, **kwargs)
+        seconds = perf_counter() - start
+        if self.trace_memory:
+            peak_memory: int | None = \
+                tracemalloc.get_traced_memory()[1] - memory_before
+            if not started:
+                tracemalloc.stop()
+        else:
+            rss_after = _max_rss()
+            peak_memory = None if rss_before is None or rss_after is None \
+                else rss_after - rss_before
+
+        stats = OperatorStats(
+            description,
+            rows_in,
+            _num_rows(result),
+            seconds,
+            peak_memory,
+            children,
+            None if self.cache is None else self.cache.last_hit
+        )
+        self._roots.append(stats)
+        if isinstance(result, Table):
+            self._open[id(result)] = (weakref.ref(result), stats)
+        return result
+
+    def instrument(self, module: ModuleType) -> Any:
+        """
+
+        Temporarily replaces the operators imported into the given
+        module (e.g. the module of hand written sequences of
+        operations) by wrappers that call them through this profile.
+
+        """
+        def call(
+            name: str,
+            func: Callable[..., Any],
+            args: tuple,
+            kwargs: dict
+        ) -> Any:
+            params = [_describe(arg) for arg in args] + [
+                f"{key}={_describe(val)}" for key, val in kwargs.items()
+            ]
+            return self.call(
+                f"{name}({', '.join(params)})",
+                func,
+                *args,
+                **kwargs
+            )
+
+        return instrument(module, call)
+
+    @property
+    def roots(self) -> list[OperatorStats]:
+        return list(self._roots)
+
+    def format(self, times: bool = True, memory: bool = True) -> str:
+        """
+
+        Formats the profile as plan trees annotated with
+        the statistics of each operator.
+
+        """
+        lines = []
+
+        def add(stats: OperatorStats, depth: int) -> None:
+            rows_in = " x ".join(
+                "?" if rows is None else str(rows) for rows in stats.rows_in
+            )
+            rows_out = "lazy" if stats.rows_out is None \
+                else str(stats.rows_out)
+            notes = [
+                f"rows: {rows_in} -> {rows_out}" if rows_in
+                else f"rows: {rows_out}"
+            ]
+            if times:
+                notes.append(f"time: {1000 * stats.seconds:.2f} ms")
+            if memory and stats.peak_memory is not None:
+                label = "peak memory" if self.trace_memory \
+                    else "high water mark growth"
+                notes.append(
+                    f"{label}: {_format_bytes(stats.peak_memory)}"
+                )
+            if stats.cached:
+                notes.append("cached")
+            lines.append(
+                "  " * depth + f"{stats.description} ({', '.join(notes)})"
+            )
+            for child in stats.children:
+                add(child, depth + 1)
+
+        for root in self._roots:
+            add(root, 0)
+        if self.cache is not None:
+            stats = self.cache.stats()
+            lines.append(
+                f"Cache: {stats['hits']:,} hits, {stats['misses']:,} misses, "
+                f"{stats['evictions']:,} evictions, {stats['entries']:,} "
+                f"entries using {_format_bytes(stats['bytes'])} of "
+                f"{_format_bytes(self.cache.max_bytes)}"
+            )
+        return "\n".join(lines)
+
+    def to_dict(self) -> list[dict[str, Any]]:
+        return [root.to_dict() for root in self._roots]
+
+    def to_json(self, indent: int | None = 2) -> str:
+        return json.dumps(self.to_dict(), indent=indent)
+
+    def __repr__(self) -> str:
+        return self.format()
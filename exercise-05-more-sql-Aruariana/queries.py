@@ -1,16 +1,24 @@
 import argparse
+import os
 import re
+import sys
 from timeit import repeat
 from typing import Callable
 
-from table import Table
+from table import Table, Dictionary, Value, encode_domain
+from profiling import Profile
+from execution import ResultCache
 from operations import (
     join,
     select,
+    select_range,
+    select_values,
     project,
     group_by,
     order_by,
-    limit
+    limit,
+    Count,
+    Avg
 )
 
 
@@ -41,6 +49,104 @@ def timeit(
     return table, 1000.0 * runtime / n
 
 
+def with_cache(
+    f: Callable[[dict[str, Table]], Table],
+    cache: ResultCache | None
+) -> Callable[[dict[str, Table]], Table]:
+    """
+
+    Returns function f with the operations called by it routed
+    through the given result cache, so equal subplans of different
+    sequences and repetitions are computed only once.
+
+    """
+    if cache is None:
+        return f
+
+    def cached(tables: dict[str, Table]) -> Table:
+        with cache.instrument(sys.modules[__name__]):
+            return f(tables)
+    return cached
+
+
+def profile_sequence(
+    f: Callable[[dict[str, Table]], Table],
+    tables: dict[str, Table],
+    trace_memory: bool = False,
+    cache: ResultCache | None = None
+) -> Profile:
+    """
+
+    Runs function f on tables once and returns the profile
+    with the row counts, runtimes and peak memory of each
+    operation called by it (and the statistics of the
+    result cache, if given).
+
+    """
+    profile = Profile(trace_memory, cache)
+    with profile.instrument(sys.modules[__name__]):
+        f(tables)
+    return profile
+
+
+# columns of the tables holding values of the same domain, which are
+# dictionary-encoded with one shared dictionary per domain
+DOMAINS = {
+    "movie_id": [("movies", 0), ("awards", 0), ("directors", 0)],
+    "person_id": [("persons", 0), ("awards", 1), ("directors", 1)],
+    "award_id": [("awards", 2), ("award_names", 0)],
+    "award_name": [("award_names", 1)],
+}
+
+
+def encode_tables(tables: dict[str, Table]) -> dict[str, Dictionary]:
+    """
+
+    Dictionary-encodes the id and award name columns of the tables
+    (see DOMAINS), so the query sequences join and group on integer
+    codes. This is done once after loading and before creating the
+    indexes. Columns of binary tables that are already encoded (see
+    convert_tables.py --encode) are only translated into the shared
+    dictionaries. Returns the dictionary of each domain.
+
+    """
+    return {
+        domain: encode_domain([
+            (tables[name], column) for name, column in columns
+            if name in tables
+        ])
+        for domain, columns in DOMAINS.items()
+    }
+
+
+def create_indexes(tables: dict[str, Table]) -> None:
+    """
+
+    Creates the secondary indexes used by the query sequences
+    on the join and filter columns of the tables. This is done
+    once after loading, so the indexes are reused by all
+    repetitions of the sequences in timeit.
+
+    """
+    index_columns = {
+        "movies": [(0, "hash"), (2, "sorted")],
+        "awards": [(0, "hash"), (2, "hash")],
+        "award_names": [(0, "hash")],
+        "directors": [(0, "hash"), (1, "hash")],
+        "persons": [(0, "hash")],
+    }
+    for name, columns in index_columns.items():
+        if name not in tables:
+            continue
+
+        for column, kind in columns:
+            tables[name].create_index(
+                column,
+                kind,
+                int if kind == "sorted" else None
+            )
+
+
 def run_sequence_1(tables: dict[str, Table]) -> Table:
     """
 
@@ -73,7 +179,7 @@ def run_sequence_1(tables: dict[str, Table]) -> Table:
     m_a_an = join(m_a, award_names, m_a.shape[1] - 1, 0)
 
     # Select Academy Awards
-    m_a_an_academy = select(m_a_an, lambda row: bool(re.match(r"^Academy Award.*", row[-1])))
+    m_a_an_academy = select_values(m_a_an, m_a_an.shape[1] - 1, lambda name: bool(re.match(r"^Academy Award.*", name)))
 
     # Select movies between 2000 and 2003
     m_a_an_academy_year = select(m_a_an_academy, lambda row: 2000 <= int(row[2] or 0) <= 2003)
@@ -154,10 +260,10 @@ def run_sequence_2(tables: dict[str, Table]) -> Table:
     award_names = tables['award_names']
 
     # Select award_names
-    award_names = select(award_names, lambda row: bool(re.match(r"^Academy Award.*", row[1])))
+    award_names = select_values(award_names, 1, lambda name: bool(re.match(r"^Academy Award.*", name)))
 
-    # Select movies between 2000 and 2003
-    movies = select(movies, lambda row: 2000 <= (int(row[2] or 0)) <= 2003)
+    # Select movies between 2000 and 2003 (uses the sorted index on year)
+    movies = select_range(movies, 2, 2000, 2003, key=int)
 
     # Join movies and awards
     m_a = join(movies, awards, 0, 0)
@@ -287,11 +393,13 @@ def run_group_by_sequence(tables: dict[str, Table]) -> Table:
         grouped,
         lambda row: int(row[2] or 0) >= 10
     )
-    # order by avg_score
+    # order by avg_score (as a number), the limit below
+    # turns this into a top 10 selection with a heap
     ordered = order_by(
         grouped,
         3,
-        ascending=False
+        ascending=False,
+        cast=float
     )
     # limit to 10 rows
     limited = limit(
@@ -309,6 +417,14 @@ def run_group_by_sequence(tables: dict[str, Table]) -> Table:
     return limited
 
 
+class _AvgOrZero(Avg):
+    # like the average in run_group_by_sequence, counts
+    # movies without an imdb score with a score of 0.0
+
+    def update(self, state: list, value: Value) -> list:
+        return super().update(state, "0.0" if value is None else value)
+
+
 def run_improved_group_by_sequence(tables: dict[str, Table]) -> Table:
     """
 
@@ -352,7 +468,9 @@ def run_improved_group_by_sequence(tables: dict[str, Table]) -> Table:
         0
     )
 
-    # group by person_id
+    # group by person_id, using built-in aggregates that only
+    # keep a running count and sum per director, and select only
+    # directors with at least 10 movies while finalizing the groups
     grouped = group_by(
         movies_directors,
         # group by person id
@@ -361,31 +479,19 @@ def run_improved_group_by_sequence(tables: dict[str, Table]) -> Table:
         ],
         [
             # num movies
-            (
-                0,
-                lambda values: str(len(values))
-            ),
+            (0, Count()),
             # average imdb score
-            (
-                4,
-                lambda values: str(round(
-                    sum(float(v or 0.0) for v in values)
-                    / max(1, len(values)), 2
-                ))
-            )
-        ]
-    )
-
-    # select only directors with at least 10 movies
-    grouped = select(
-        grouped,
-        lambda row: int(row[1] or 0) >= 10
+            (4, _AvgOrZero(digits=2))
+        ],
+        having=lambda row: int(row[1] or 0) >= 10
     )
-    # order by avg_score
+    # order by avg_score (as a number), the limit below
+    # turns this into a top 10 selection with a heap
     ordered = order_by(
         grouped,
         2,
-        ascending=False
+        ascending=False,
+        cast=float
     )
     # limit to 10 rows
     limited = limit(
@@ -411,7 +517,8 @@ def run_improved_group_by_sequence(tables: dict[str, Table]) -> Table:
     limited = order_by(
         limited,
         2,
-        ascending=False
+        ascending=False,
+        cast=float
     )
 
     # rename columns (just for output purposes)
@@ -426,7 +533,8 @@ def parse_args() -> argparse.Namespace:
         "tables",
         nargs="+",
         type=str,
-        help="paths to the tsv-files that will be read as tables"
+        help="paths to the tsv-files (or binary .tbl-files) "
+        "that will be read as tables"
     )
     parser.add_argument(
         "-e",
@@ -444,6 +552,31 @@ def parse_args() -> argparse.Namespace:
         help="number of times each sequence will be executed "
         "to measure runtime"
     )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="whether to print the operations of each sequence annotated "
+        "with their row counts, runtimes and peak memory"
+    )
+    parser.add_argument(
+        "--cache-mb",
+        type=int,
+        default=None,
+        help="memory budget in MB of a result cache shared by all "
+        "sequences and repetitions, no cache by default"
+    )
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="whether to trace the memory allocated by each operation "
+        "exactly (slower), instead of the peak resident set size"
+    )
+    parser.add_argument(
+        "--encode",
+        action="store_true",
+        help="whether to dictionary-encode the id and award name columns, "
+        "so joins and grouping compare integers"
+    )
     parser.add_argument(
         "--verbose",
         action="store_true",
@@ -454,31 +587,55 @@ def parse_args() -> argparse.Namespace:
 
 def check_rows(first: Table, second: Table) -> None:
     assert (
-        sorted(tuple(c or "" for c in r) for r in first.rows)
-        == sorted(tuple(c or "" for c in r) for r in second.rows)
+        sorted(tuple(c or "" for c in r) for r in first.decode().rows)
+        == sorted(tuple(c or "" for c in r) for r in second.decode().rows)
     ), "rows of the tables must be equal"
 
 
 def main(args: argparse.Namespace) -> None:
     print("Loading tables from files...")
     tables = {}
+    # dictionaries of the binary tables, shared by equal blocks
+    shared: dict[tuple[int, bytes], Dictionary] = {}
     for file in args.tables:
-        table = Table.build_from_file(file)
+        # binary tables (see convert_tables.py) load much faster, the
+        # columns of the domains are kept encoded if they are encoded
+        # anyway, the sequences work on the values of all others
+        if file.endswith(".tbl"):
+            name, _ = os.path.splitext(os.path.basename(file))
+            table = Table.build_from_binary_file(file, shared, [
+                column for columns in DOMAINS.values()
+                for table_name, column in columns
+                if table_name == name and args.encode
+            ])
+        else:
+            table = Table.build_from_file(file)
         assert table.name not in tables, \
             f"table with name {table.name} already exists"
         tables[table.name] = table
 
+    if args.encode:
+        print("Encoding columns...")
+        encode_tables(tables)
+
+    print("Creating indexes...")
+    create_indexes(tables)
+
+    cache = None
+    if args.cache_mb is not None:
+        cache = ResultCache(args.cache_mb * 1024 * 1024)
+
     if args.exercise == 1:
         cost_1 = calc_cost_1(tables)
         cost_2 = calc_cost_2(tables)
 
         result_1, runtime_1 = timeit(
-            run_sequence_1,
+            with_cache(run_sequence_1, cache),
             tables,
             args.n_times
         )
         result_2, runtime_2 = timeit(
-            run_sequence_2,
+            with_cache(run_sequence_2, cache),
             tables,
             args.n_times
         )
@@ -495,15 +652,21 @@ def main(args: argparse.Namespace) -> None:
         print(f"Sequence 2 took {runtime_2:,.1f}ms")
         print(f"Runtime ratio: {runtime_1 / runtime_2:.2f}")
 
+        if args.profile:
+            for i, f in enumerate([run_sequence_1, run_sequence_2]):
+                profile = profile_sequence(
+                    f, tables, args.trace_memory, cache
+                )
+                print(f"\nProfile of sequence {i + 1}:\n{profile}")
         return
 
     result, runtime = timeit(
-        run_group_by_sequence,
+        with_cache(run_group_by_sequence, cache),
         tables,
         args.n_times
     )
     result_imp, runtime_imp = timeit(
-        run_improved_group_by_sequence,
+        with_cache(run_improved_group_by_sequence, cache),
         tables,
         args.n_times
     )
@@ -516,6 +679,14 @@ def main(args: argparse.Namespace) -> None:
     print(f"Improved sequence took {runtime_imp:,.1f}ms")
     print(f"Runtime ratio: {runtime / runtime_imp:.2f}")
 
+    if args.profile:
+        for name, f in [
+            ("sequence", run_group_by_sequence),
+            ("improved sequence", run_improved_group_by_sequence)
+        ]:
+            profile = profile_sequence(f, tables, args.trace_memory, cache)
+            print(f"\nProfile of {name}:\n{profile}")
+
 
 if __name__ == "__main__":
     main(parse_args())
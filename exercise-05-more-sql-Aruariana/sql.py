@@ -0,0 +1,1770 @@
+import argparse
+import math
+import re
+from typing import Any, Callable
+
+from table import Table, Row, Value, SortedIndex, Dictionary
+from profiling import Profile
+from execution import ResultCache
+from operations import (
+    join,
+    late_join,
+    select,
+    select_eq,
+    select_range,
+    semi_join,
+    project,
+    group_by,
+    order_by,
+    limit,
+    Aggregate,
+    Count,
+    Sum,
+    Avg,
+    Min,
+    Max
+)
+
+# expressions are nested tuples, the first element is the kind:
+# ("col", alias or None, name), ("lit", value), ("dq", text),
+# ("cast", expr, type), ("cmp", op, left, right),
+# ("arith", op, left, right), ("neg", expr),
+# ("between", expr, low, high, negated), ("like", expr, pattern, negated),
+# ("in", expr, [expr, ...], negated), ("isnull", expr, negated),
+# ("and", [expr, ...]), ("or", [expr, ...]), ("not", expr),
+# ("func", name, [expr, ...]), ("agg", name, expr or None, distinct)
+Expr = tuple
+
+_TOKEN = re.compile(
+    r"\s*(?:"
+    r"(?P<number>\d+(?:\.\d*)?|\.\d+)"
+    r"|(?P<string>'(?:[^']|'')*')"
+    r"|(?P<quoted>\"(?:[^\"]|\"\")*\")"
+    r"|(?P<name>[A-Za-z_][A-Za-z_0-9]*)"
+    r"|(?P<op><=|>=|<>|!=|==|\|\||[=<>(),.*;+\-/%])"
+    r")"
+)
+
+_KEYWORDS = {
+    "SELECT", "DISTINCT", "FROM", "WHERE", "GROUP", "BY", "HAVING",
+    "ORDER", "LIMIT", "ASC", "DESC", "AND", "OR", "NOT", "AS", "CAST",
+    "BETWEEN", "LIKE", "IN", "IS", "NULL", "JOIN", "INNER", "ON"
+}
+
+_AGGREGATES = {"COUNT", "SUM", "AVG", "MIN", "MAX"}
+
+_FUNCTIONS = {"ROUND", "FLOOR", "ABS", "LOWER", "UPPER", "LENGTH"}
+
+
+class Query:
+    """
+
+    A parsed SELECT-FROM-WHERE-GROUP BY-HAVING-ORDER BY-LIMIT query.
+
+    """
+
+    def __init__(self) -> None:
+        self.distinct = False
+        # (expression, alias or None)
+        self.select: list[tuple[Expr, str | None]] = []
+        # (table name, alias)
+        self.tables: list[tuple[str, str]] = []
+        self.where: Expr | None = None
+        self.group_by: list[Expr] = []
+        self.having: Expr | None = None
+        # (expression, ascending)
+        self.order_by: list[tuple[Expr, bool]] = []
+        self.limit: int | None = None
+
+
+def tokenize(sql: str) -> list[tuple[str, str]]:
+    """
+
+    Splits the SQL query into a list of (kind, text) tokens.
+    Keywords are upper cased, comments are skipped.
+
+    >>> tokenize("SELECT m.title FROM movies m WHERE m.year >= 2000;")
+    ... # doctest: +NORMALIZE_WHITESPACE
+    [('kw', 'SELECT'), ('name', 'm'), ('op', '.'), ('name', 'title'),
+     ('kw', 'FROM'), ('name', 'movies'), ('name', 'm'), ('kw', 'WHERE'),
+     ('name', 'm'), ('op', '.'), ('name', 'year'), ('op', '>='),
+     ('number', '2000'), ('op', ';')]
+    """
+    sql = re.sub(r"--[^\n]*", " ", sql)
+    tokens = []
+    pos = 0
+    while pos < len(sql):
+        if sql[pos:].strip() == "":
+            break
+        match = _TOKEN.match(sql, pos)
+        assert match is not None and match.lastgroup is not None, \
+            f"unexpected character at {sql[pos:pos + 20]!r}"
+        kind, text = match.lastgroup, match.group(match.lastgroup)
+        if kind == "name" and text.upper() in _KEYWORDS:
+            kind, text = "kw", text.upper()
+        tokens.append((kind, text))
+        pos = match.end()
+    return tokens
+
+
+class _Parser:
+    # recursive descent parser over the tokens of a query
+
+    def __init__(self, sql: str) -> None:
+        self.tokens = tokenize(sql)
+        self.pos = 0
+
+    def peek(self, offset: int = 0) -> tuple[str, str]:
+        if self.pos + offset < len(self.tokens):
+            return self.tokens[self.pos + offset]
+        return ("end", "")
+
+    def accept(self, *texts: str) -> str | None:
+        kind, text = self.peek()
+        if kind in {"kw", "op"} and text in texts:
+            self.pos += 1
+            return text
+        return None
+
+    def expect(self, text: str) -> None:
+        assert self.accept(text) is not None, \
+            f"expected {text} but got {self.peek()[1] or 'end of query'}"
+
+    def identifier(self) -> str:
+        kind, text = self.peek()
+        assert kind in {"name", "quoted"}, \
+            f"expected a name but got {text or 'end of query'}"
+        self.pos += 1
+        return text[1:-1].replace('""', '"') if kind == "quoted" else text
+
+    def query(self) -> Query:
+        query = Query()
+        self.expect("SELECT")
+        query.distinct = self.accept("DISTINCT") is not None
+        while True:
+            expr = self.expr()
+            alias = None
+            if self.accept("AS"):
+                alias = self.identifier()
+            elif self.peek()[0] in {"name", "quoted"}:
+                alias = self.identifier()
+            query.select.append((expr, alias))
+            if not self.accept(","):
+                break
+
+        self.expect("FROM")
+        conditions = []
+        query.tables.append(self.table())
+        while True:
+            if self.accept(","):
+                query.tables.append(self.table())
+            elif self.accept("JOIN") or (
+                self.accept("INNER") and self.accept("JOIN")
+            ):
+                query.tables.append(self.table())
+                self.expect("ON")
+                conditions.append(self.expr())
+            else:
+                break
+
+        if self.accept("WHERE"):
+            conditions.append(self.expr())
+        if conditions:
+            query.where = (
+                conditions[0] if len(conditions) == 1
+                else ("and", conditions)
+            )
+        if self.accept("GROUP"):
+            self.expect("BY")
+            query.group_by.append(self.expr())
+            while self.accept(","):
+                query.group_by.append(self.expr())
+        if self.accept("HAVING"):
+            query.having = self.expr()
+        if self.accept("ORDER"):
+            self.expect("BY")
+            while True:
+                expr = self.expr()
+                ascending = self.accept("DESC") is None
+                if ascending:
+                    self.accept("ASC")
+                query.order_by.append((expr, ascending))
+                if not self.accept(","):
+                    break
+        if self.accept("LIMIT"):
+            kind, text = self.peek()
+            assert kind == "number", f"expected a number but got {text}"
+            self.pos += 1
+            query.limit = int(text)
+        self.accept(";")
+        assert self.peek()[0] == "end", \
+            f"unexpected {self.peek()[1]} at end of query"
+        return query
+
+    def table(self) -> tuple[str, str]:
+        name = self.identifier()
+        alias = name
+        if self.accept("AS") or self.peek()[0] in {"name", "quoted"}:
+            alias = self.identifier()
+        return name, alias
+
+    def expr(self) -> Expr:
+        exprs = [self.and_expr()]
+        while self.accept("OR"):
+            exprs.append(self.and_expr())
+        return exprs[0] if len(exprs) == 1 else ("or", exprs)
+
+    def and_expr(self) -> Expr:
+        exprs = [self.not_expr()]
+        while self.accept("AND"):
+            exprs.append(self.not_expr())
+        return exprs[0] if len(exprs) == 1 else ("and", exprs)
+
+    def not_expr(self) -> Expr:
+        if self.accept("NOT"):
+            return ("not", self.not_expr())
+        return self.predicate()
+
+    def predicate(self) -> Expr:
+        left = self.additive()
+        op = self.accept("=", "==", "<>", "!=", "<", "<=", ">", ">=")
+        if op is not None:
+            op = {"==": "=", "!=": "<>"}.get(op, op)
+            return ("cmp", op, left, self.additive())
+        if self.accept("IS"):
+            negated = self.accept("NOT") is not None
+            self.expect("NULL")
+            return ("isnull", left, negated)
+        negated = self.accept("NOT") is not None
+        if self.accept("BETWEEN"):
+            low = self.additive()
+            self.expect("AND")
+            return ("between", left, low, self.additive(), negated)
+        elif self.accept("LIKE"):
+            return ("like", left, self.additive(), negated)
+        elif self.accept("IN"):
+            self.expect("(")
+            values = [self.additive()]
+            while self.accept(","):
+                values.append(self.additive())
+            self.expect(")")
+            return ("in", left, values, negated)
+        assert not negated, "expected BETWEEN, LIKE or IN after NOT"
+        return left
+
+    def additive(self) -> Expr:
+        expr = self.multiplicative()
+        while True:
+            op = self.accept("+", "-", "||")
+            if op is None:
+                return expr
+            expr = ("arith", op, expr, self.multiplicative())
+
+    def multiplicative(self) -> Expr:
+        expr = self.unary()
+        while True:
+            op = self.accept("*", "/", "%")
+            if op is None:
+                return expr
+            expr = ("arith", op, expr, self.unary())
+
+    def unary(self) -> Expr:
+        if self.accept("-"):
+            return ("neg", self.unary())
+        return self.primary()
+
+    def primary(self) -> Expr:
+        kind, text = self.peek()
+        if kind == "number":
+            self.pos += 1
+            return ("lit", float(text) if "." in text else int(text))
+        elif kind == "string":
+            self.pos += 1
+            return ("lit", text[1:-1].replace("''", "'"))
+        elif self.accept("("):
+            expr = self.expr()
+            self.expect(")")
+            return expr
+        elif self.accept("NULL"):
+            return ("lit", None)
+        elif self.accept("CAST"):
+            self.expect("(")
+            expr = self.expr()
+            self.expect("AS")
+            type_name = self.identifier().upper()
+            self.expect(")")
+            assert type_name in {"INT", "INTEGER", "REAL", "TEXT"}, \
+                f"unsupported type {type_name}"
+            return ("cast", expr, "INT" if type_name == "INTEGER"
+                    else type_name)
+        elif kind == "quoted" and self.peek(1) != ("op", "."):
+            # double quoted strings are identifiers if such a column
+            # exists, string literals otherwise (like in SQLite)
+            self.pos += 1
+            return ("dq", text[1:-1].replace('""', '"'))
+
+        name = self.identifier()
+        if self.accept("("):
+            func = name.upper()
+            assert func in _AGGREGATES or func in _FUNCTIONS, \
+                f"unknown function {name}"
+            if func in _AGGREGATES:
+                distinct = self.accept("DISTINCT") is not None
+                arg = None if self.accept("*") else self.expr()
+                self.expect(")")
+                return ("agg", func, arg, distinct)
+            args = [self.expr()]
+            while self.accept(","):
+                args.append(self.expr())
+            self.expect(")")
+            return ("func", func, args)
+        elif self.accept("."):
+            return ("col", name, self.identifier())
+        return ("col", None, name)
+
+
+def parse_sql(sql: str) -> Query:
+    """
+
+    Parses a SQL query of the SELECT-FROM-WHERE-GROUP BY-HAVING-
+    ORDER BY-LIMIT subset used in the exercises into a Query.
+    Tables can be joined with commas or JOIN ... ON.
+
+    >>> q = parse_sql(
+    ...     "SELECT p.name, COUNT(*) AS n FROM persons p, jobs j "
+    ...     "WHERE p.job_id = j.id AND j.job_title LIKE 'm%' "
+    ...     "GROUP BY p.name HAVING n > 1 ORDER BY n DESC LIMIT 3"
+    ... )
+    >>> q.select
+    [(('col', 'p', 'name'), None), (('agg', 'COUNT', None, False), 'n')]
+    >>> q.tables
+    [('persons', 'p'), ('jobs', 'j')]
+    >>> to_sql(q.where)
+    "p.job_id = j.id AND j.job_title LIKE 'm%'"
+    >>> q.order_by, q.limit
+    ([(('col', None, 'n'), False)], 3)
+    """
+    return _Parser(sql).query()
+
+
+def to_sql(expr: Expr) -> str:
+    """
+
+    Formats an expression as SQL, used to describe plans.
+
+    >>> to_sql(parse_sql(
+    ...     "SELECT ROUND(AVG(CAST(m.score AS REAL)), 2) FROM movies m"
+    ... ).select[0][0])
+    'ROUND(AVG(CAST(m.score AS REAL)), 2)'
+    """
+    kind = expr[0]
+    if kind == "col":
+        return expr[2] if expr[1] is None else f"{expr[1]}.{expr[2]}"
+    elif kind == "lit":
+        if expr[1] is None:
+            return "NULL"
+        elif isinstance(expr[1], str):
+            return "'" + expr[1].replace("'", "''") + "'"
+        return str(expr[1])
+    elif kind == "dq":
+        return '"' + expr[1].replace('"', '""') + '"'
+    elif kind == "cast":
+        return f"CAST({to_sql(expr[1])} AS {expr[2]})"
+    elif kind in {"cmp", "arith"}:
+        return f"{to_sql(expr[2])} {expr[1]} {to_sql(expr[3])}"
+    elif kind == "neg":
+        return f"-{to_sql(expr[1])}"
+    elif kind == "between":
+        return (
+            f"{to_sql(expr[1])} {'NOT ' if expr[4] else ''}BETWEEN "
+            f"{to_sql(expr[2])} AND {to_sql(expr[3])}"
+        )
+    elif kind == "like":
+        return (
+            f"{to_sql(expr[1])} {'NOT ' if expr[3] else ''}LIKE "
+            f"{to_sql(expr[2])}"
+        )
+    elif kind == "in":
+        return (
+            f"{to_sql(expr[1])} {'NOT ' if expr[3] else ''}IN "
+            f"({', '.join(to_sql(e) for e in expr[2])})"
+        )
+    elif kind == "isnull":
+        return f"{to_sql(expr[1])} IS {'NOT ' if expr[2] else ''}NULL"
+    elif kind in {"and", "or"}:
+        return f" {kind.upper()} ".join(
+            f"({to_sql(e)})" if e[0] in {"and", "or"} else to_sql(e)
+            for e in expr[1]
+        )
+    elif kind == "not":
+        return f"NOT ({to_sql(expr[1])})"
+    elif kind == "func":
+        return f"{expr[1]}({', '.join(to_sql(e) for e in expr[2])})"
+    elif kind == "agg":
+        arg = "*" if expr[2] is None else to_sql(expr[2])
+        return f"{expr[1]}({'DISTINCT ' if expr[3] else ''}{arg})"
+    raise AssertionError(f"unknown expression {expr}")
+
+
+_NUMBER_PREFIX = re.compile(r"\s*[+-]?(\d+(\.\d*)?|\.\d+)([eE][+-]?\d+)?")
+
+
+def _to_number(val: Any) -> Any:
+    # converts a value to a number like SQLite does,
+    # using the longest numeric prefix of strings
+    if val is None or isinstance(val, (int, float)):
+        return val
+    match = _NUMBER_PREFIX.match(val)
+    if match is None:
+        return 0
+    text = match.group(0)
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+
+def _to_int(val: Any) -> Any:
+    val = _to_number(val)
+    return None if val is None else int(val)
+
+
+def _to_real(val: Any) -> Any:
+    val = _to_number(val)
+    return None if val is None else float(val)
+
+
+def _to_value(val: Any) -> Value:
+    # converts the result of an expression to a table value
+    if val is None or isinstance(val, str):
+        return val
+    elif isinstance(val, bool):
+        return "1" if val else "0"
+    return str(val)
+
+
+def _compare(op: str, left: Any, right: Any) -> bool | None:
+    if left is None or right is None:
+        return None
+    # like SQLite, numbers compared to text
+    # columns are compared as text
+    if isinstance(left, str) != isinstance(right, str):
+        left, right = _to_value(left), _to_value(right)
+    if op == "=":
+        return left == right
+    elif op == "<>":
+        return left != right
+    elif op == "<":
+        return left < right
+    elif op == "<=":
+        return left <= right
+    elif op == ">":
+        return left > right
+    return left >= right
+
+
+def _like_pattern(pattern: str) -> re.Pattern:
+    # LIKE is case insensitive, % matches any
+    # sequence of characters and _ a single one
+    regex = "".join(
+        ".*" if c == "%" else "." if c == "_" else re.escape(c)
+        for c in pattern
+    )
+    return re.compile(regex, re.IGNORECASE | re.DOTALL)
+
+
+def _arith(op: str, left: Any, right: Any) -> Any:
+    if left is None or right is None:
+        return None
+    if op == "||":
+        return f"{_to_value(left)}{_to_value(right)}"
+    left, right = _to_number(left), _to_number(right)
+    if op == "+":
+        return left + right
+    elif op == "-":
+        return left - right
+    elif op == "*":
+        return left * right
+    elif right == 0:
+        return None
+    elif isinstance(left, int) and isinstance(right, int):
+        # integer division and modulo truncate towards zero
+        quotient = abs(left) // abs(right)
+        if (left < 0) != (right < 0):
+            quotient = -quotient
+        return quotient if op == "/" else left - right * quotient
+    return left / right if op == "/" else math.fmod(left, right)
+
+
+def _func(name: str, args: list[Any]) -> Any:
+    val = args[0]
+    if val is None:
+        return None
+    if name == "ROUND":
+        digits = int(_to_number(args[1])) if len(args) > 1 else 0
+        return float(round(_to_number(val), digits))
+    elif name == "FLOOR":
+        val = _to_number(val)
+        return val if isinstance(val, int) else float(math.floor(val))
+    elif name == "ABS":
+        return abs(_to_number(val))
+    elif name == "LOWER":
+        return _to_value(val).lower()  # type: ignore
+    elif name == "UPPER":
+        return _to_value(val).upper()  # type: ignore
+    return len(_to_value(val))  # type: ignore
+
+
+def _compile(
+    expr: Expr,
+    resolve: Callable[[Expr], int]
+) -> Callable[[Row], Any]:
+    # compiles an expression into a function on rows, columns
+    # and aggregates are resolved to column indices by resolve
+    kind = expr[0]
+    if kind == "col":
+        idx = resolve(expr)
+        return lambda row: row[idx]
+    elif kind == "agg":
+        # aggregates are stored as text, but numeric ones
+        # compare as numbers (like COUNT(*) > 10 in SQLite)
+        idx = resolve(expr)
+        if _is_numeric(expr):
+            return lambda row: _to_number(row[idx])
+        return lambda row: row[idx]
+    elif kind == "lit":
+        val = expr[1]
+        return lambda row: val
+    elif kind == "cast":
+        inner = _compile(expr[1], resolve)
+        cast = {"INT": _to_int, "REAL": _to_real, "TEXT": _to_value}[expr[2]]
+        return lambda row: cast(inner(row))
+    elif kind == "cmp":
+        op = expr[1]
+        left, right = _compile(expr[2], resolve), _compile(expr[3], resolve)
+        return lambda row: _compare(op, left(row), right(row))
+    elif kind == "arith":
+        op = expr[1]
+        left, right = _compile(expr[2], resolve), _compile(expr[3], resolve)
+        return lambda row: _arith(op, left(row), right(row))
+    elif kind == "neg":
+        inner = _compile(expr[1], resolve)
+        return lambda row: _arith("-", 0, inner(row))
+    elif kind == "between":
+        inner = _compile(expr[1], resolve)
+        low, high = _compile(expr[2], resolve), _compile(expr[3], resolve)
+        negated = expr[4]
+
+        def between(row: Row) -> bool | None:
+            val = inner(row)
+            result = (
+                _compare(">=", val, low(row))
+                and _compare("<=", val, high(row))
+            )
+            return None if result is None else result != negated
+        return between
+    elif kind == "like":
+        inner = _compile(expr[1], resolve)
+        assert expr[2][0] == "lit" and isinstance(expr[2][1], str), \
+            "LIKE patterns must be string literals"
+        pattern = _like_pattern(expr[2][1])
+        negated = expr[3]
+
+        def like(row: Row) -> bool | None:
+            val = inner(row)
+            if val is None:
+                return None
+            return (pattern.fullmatch(_to_value(val)) is not None) != negated
+        return like
+    elif kind == "in":
+        inner = _compile(expr[1], resolve)
+        negated = expr[3]
+        if all(e[0] == "lit" and isinstance(e[1], str) for e in expr[2]):
+            # text values only, look them up in a set
+            strings = {e[1] for e in expr[2]}
+
+            def in_strings(row: Row) -> bool | None:
+                val = inner(row)
+                if val is None:
+                    return None
+                return (_to_value(val) in strings) != negated
+            return in_strings
+        values = [_compile(e, resolve) for e in expr[2]]
+
+        def in_values(row: Row) -> bool | None:
+            # like in SQL, unknown if the value is NULL or
+            # if it is not found but the list contains a NULL
+            val = inner(row)
+            if val is None:
+                return None
+            unknown = False
+            for value in values:
+                result = _compare("=", val, value(row))
+                if result:
+                    return not negated
+                unknown = unknown or result is None
+            return None if unknown else negated
+        return in_values
+    elif kind == "isnull":
+        inner = _compile(expr[1], resolve)
+        negated = expr[2]
+        return lambda row: (inner(row) is None) != negated
+    elif kind == "and" or kind == "or":
+        parts = [_compile(e, resolve) for e in expr[1]]
+        # the value that decides the result on its own
+        decisive = kind == "or"
+
+        def and_or(row: Row) -> bool | None:
+            # three-valued logic, NULL (None) is unknown
+            unknown = False
+            for part in parts:
+                result = part(row)
+                if result is None:
+                    unknown = True
+                elif bool(result) == decisive:
+                    return decisive
+            return None if unknown else not decisive
+        return and_or
+    elif kind == "not":
+        inner = _compile(expr[1], resolve)
+
+        def not_(row: Row) -> bool | None:
+            result = inner(row)
+            return None if result is None else not result
+        return not_
+    elif kind == "func":
+        name = expr[1]
+        args = [_compile(e, resolve) for e in expr[2]]
+        return lambda row: _func(name, [arg(row) for arg in args])
+    raise AssertionError(f"cannot compile {to_sql(expr)}")
+
+
+def _is_numeric(expr: Expr) -> bool:
+    # whether an expression evaluates to numbers,
+    # which determines how its values are ordered
+    kind = expr[0]
+    if kind == "cast":
+        return expr[2] != "TEXT"
+    elif kind == "agg":
+        return expr[1] in {"COUNT", "SUM", "AVG"} or (
+            expr[2] is not None and _is_numeric(expr[2])
+        )
+    elif kind == "func":
+        return expr[1] in {"ROUND", "FLOOR", "ABS", "LENGTH"}
+    elif kind in {"arith", "neg"}:
+        return kind == "neg" or expr[1] != "||"
+    elif kind == "lit":
+        return isinstance(expr[1], (int, float))
+    return False
+
+
+def _walk(expr: Expr) -> list[Expr]:
+    # all sub-expressions of an expression, including itself
+    exprs = [expr]
+    for part in expr[1:]:
+        if isinstance(part, tuple) and part and isinstance(part[0], str):
+            exprs.extend(_walk(part))
+        elif isinstance(part, list):
+            for e in part:
+                exprs.extend(_walk(e))
+    return exprs
+
+
+class _CountAll(Aggregate):
+    # COUNT(*), counts all rows of a group
+
+    def start(self) -> int:
+        return 0
+
+    def update(self, state: int, value: Value) -> int:
+        return state + 1
+
+    def finish(self, state: int) -> Value:
+        return str(state)
+
+
+class _CountDistinct(Aggregate):
+    # COUNT(DISTINCT ...), keeps the distinct values of a group
+
+    def start(self) -> set[str]:
+        return set()
+
+    def update(self, state: set[str], value: Value) -> set[str]:
+        if value is not None:
+            state.add(value)
+        return state
+
+    def finish(self, state: set[str]) -> Value:
+        return str(len(state))
+
+
+def _aggregate(expr: Expr) -> Aggregate:
+    name, arg, distinct = expr[1], expr[2], expr[3]
+    if name == "COUNT":
+        return _CountAll() if arg is None else \
+            _CountDistinct() if distinct else Count()
+    assert not distinct, f"DISTINCT is not supported for {name}"
+    if name == "SUM":
+        return Sum(cast=_to_number)
+    elif name == "AVG":
+        return Avg(cast=_to_number)
+    numeric = _is_numeric(arg)
+    return (Min if name == "MIN" else Max)(
+        cast=_to_number if numeric else None
+    )
+
+
+class Plan:
+    """
+
+    A node of a query plan: an operation of operations.py (or a
+    computation of new columns) applied to the result tables of
+    the child plans. The parameters are passed to the operation,
+    the description is used when printing the plan.
+
+    """
+
+    def __init__(
+        self,
+        op: str,
+        children: list["Plan"],
+        params: dict[str, Any],
+        description: str
+    ) -> None:
+        self.op = op
+        self.children = children
+        self.params = params
+        self.description = description
+
+    def execute(
+        self,
+        tables: dict[str, Table],
+        profile: Profile | None = None,
+        cache: ResultCache | None = None
+    ) -> Table:
+        """
+
+        Executes the plan on the given tables and returns the result
+        table. If a profile is given, the statistics of each
+        operation are recorded in it. If a result cache is given,
+        the operations are called through it, so subplans equal to
+        subplans of earlier queries are not computed again (to
+        profile a cached execution, pass the cache to the profile).
+
+        """
+        return self._execute(tables, profile, cache, {})
+
+    def _execute(
+        self,
+        tables: dict[str, Table],
+        profile: Profile | None,
+        cache: ResultCache | None,
+        results: dict[int, Table]
+    ) -> Table:
+        # subplans used more than once in the plan (like the filtered
+        # input of a semi-join) are executed only once
+        if id(self) in results:
+            return results[id(self)]
+        inputs = [
+            child._execute(tables, profile, cache, results)
+            for child in self.children
+        ]
+        if profile is None and cache is not None:
+            result = cache.call(
+                _OPERATIONS[self.op],
+                tables,
+                inputs,
+                **self.params
+            )
+        elif profile is None:
+            result = _OPERATIONS[self.op](tables, inputs, **self.params)
+        else:
+            result = profile.call(
+                self.description,
+                _OPERATIONS[self.op],
+                tables,
+                inputs,
+                **self.params
+            )
+        results[id(self)] = result
+        return result
+
+    def __repr__(self) -> str:
+        lines = []
+
+        def add(plan: Plan, depth: int) -> None:
+            lines.append("  " * depth + plan.description)
+            for child in plan.children:
+                add(child, depth + 1)
+
+        add(self, 0)
+        return "\n".join(lines)
+
+
+def _scan(tables: dict[str, Table], inputs: list[Table], name: str) -> Table:
+    assert name in tables, f"unknown table {name}"
+    return tables[name]
+
+
+def _compute(
+    tables: dict[str, Table],
+    inputs: list[Table],
+    exprs: list[Callable[[Row], Any]],
+    names: list[str]
+) -> Table:
+    # computes new columns from expressions on the rows
+    table = inputs[0]
+    return Table(table.name, names, [
+        tuple(_to_value(expr(row)) for expr in exprs)
+        for row in table.iter_rows()
+    ])
+
+
+def _aggregate_all(
+    tables: dict[str, Table],
+    inputs: list[Table],
+    aggregations: list[tuple[int, Aggregate]],
+    names: list[str],
+    having: Callable[[Row], bool] | None
+) -> Table:
+    # aggregates all rows into a single one,
+    # for queries with aggregates but no GROUP BY
+    table = inputs[0]
+    states = [agg.start() for _, agg in aggregations]
+    for row in table.iter_rows():
+        for i, (col, agg) in enumerate(aggregations):
+            states[i] = agg.update(states[i], row[col])
+    new_row = tuple(
+        agg.finish(state) for (_, agg), state in zip(aggregations, states)
+    )
+    rows = [new_row] if having is None or having(new_row) else []
+    return Table(table.name, names, rows)
+
+
+def _rename(
+    tables: dict[str, Table],
+    inputs: list[Table],
+    columns: list[str]
+) -> Table:
+    return Table(inputs[0].name, columns, inputs[0].rows)
+
+
+_OPERATIONS: dict[str, Callable[..., Table]] = {
+    "scan": _scan,
+    "select": lambda tables, inputs, **kwargs: select(inputs[0], **kwargs),
+    "select_eq": lambda tables, inputs, **kwargs: select_eq(
+        inputs[0], **kwargs
+    ),
+    "select_range": lambda tables, inputs, **kwargs: select_range(
+        inputs[0], **kwargs
+    ),
+    "semi_join": lambda tables, inputs, **kwargs: semi_join(
+        inputs[0], inputs[1], **kwargs
+    ),
+    "join": lambda tables, inputs, **kwargs: join(
+        inputs[0], inputs[1], **kwargs
+    ),
+    "late_join": lambda tables, inputs, **kwargs: late_join(
+        inputs[0], inputs[1], **kwargs
+    ),
+    "project": lambda tables, inputs, **kwargs: project(inputs[0], **kwargs),
+    "group_by": lambda tables, inputs, **kwargs: group_by(
+        inputs[0], **kwargs
+    ),
+    "order_by": lambda tables, inputs, **kwargs: order_by(
+        inputs[0], **kwargs
+    ),
+    "limit": lambda tables, inputs, **kwargs: limit(inputs[0], **kwargs),
+    "compute": _compute,
+    "aggregate": _aggregate_all,
+    "rename": _rename,
+    "decode": lambda tables, inputs, **kwargs: inputs[0].decode(**kwargs),
+}
+
+
+# (alias, lower case column name) of each column of an intermediate table
+Layout = list[tuple[str, str]]
+
+# maximum estimated selectivity of the filters of a table
+# for passing its join keys sideways with a semi-join
+_SEMI_JOIN_SELECTIVITY = 0.1
+
+
+def _selectivity(expr: Expr) -> float:
+    # rough estimate of the fraction of rows a filter keeps
+    if expr[0] == "cmp" and expr[1] == "=" and (
+        expr[2][0] == "lit" or expr[3][0] == "lit"
+    ):
+        return 0.01
+    elif expr[0] == "in" and not expr[3]:
+        return min(0.5, 0.01 * len(expr[2]))
+    elif expr[0] == "like" and not expr[3]:
+        return 0.1
+    elif expr[0] == "and":
+        result = 1.0
+        for e in expr[1]:
+            result *= _selectivity(e)
+        return result
+    elif expr[0] == "or":
+        return min(1.0, sum(_selectivity(e) for e in expr[1]))
+    return 0.25
+
+
+class _Planner:
+    # compiles a query into a plan
+
+    def __init__(
+        self,
+        query: Query,
+        tables: dict[str, Table],
+        memory_budget: int | None = None
+    ) -> None:
+        self.query = query
+        self.tables = tables
+        # memory budget of the operations that can spill to disk
+        self.memory_budget = memory_budget
+        self.aliases = {alias: name for name, alias in query.tables}
+        assert len(self.aliases) == len(query.tables), \
+            "table aliases must be unique"
+        for name, _ in query.tables:
+            assert name in tables, f"unknown table {name}"
+
+    def resolve(self, layout: Layout, expr: Expr) -> int:
+        # index of the column referenced by the expression
+        if expr[0] == "agg":
+            key = ("", to_sql(expr))
+            assert key in layout, \
+                f"aggregate {to_sql(expr)} is not allowed here"
+            return layout.index(key)
+        alias, name = expr[1], expr[2].lower()
+        matches = [
+            i for i, (a, n) in enumerate(layout)
+            if n == name and (alias is None or a == alias)
+        ]
+        assert len(matches) > 0, f"unknown column {to_sql(expr)}"
+        assert len(matches) == 1, f"ambiguous column {to_sql(expr)}"
+        return matches[0]
+
+    def bind(self, expr: Expr, layout: Layout) -> Expr:
+        # resolves double quoted names to columns or string literals
+        if expr[0] == "dq":
+            if any(n == expr[1].lower() for _, n in layout):
+                return ("col", None, expr[1])
+            return ("lit", expr[1])
+        return tuple(
+            self.bind(part, layout)
+            if isinstance(part, tuple) and part and isinstance(part[0], str)
+            else [self.bind(e, layout) for e in part]
+            if isinstance(part, list)
+            else part
+            for part in expr
+        )
+
+    def aliases_of(self, expr: Expr, layout: Layout) -> set[str]:
+        return {
+            layout[self.resolve(layout, e)][0]
+            for e in _walk(expr)
+            if e[0] == "col"
+        }
+
+    def predicate(self, expr: Expr, layout: Layout) -> Callable[[Row], bool]:
+        func = _compile(expr, lambda e: self.resolve(layout, e))
+        return lambda row: bool(func(row))
+
+    def scan(
+        self,
+        name: str,
+        alias: str,
+        filters: list[Expr],
+        decode: set[tuple[str, str]]
+    ) -> tuple[Plan, float]:
+        # plan for a table with its filters pushed down,
+        # together with an estimate of its size
+        table = self.tables[name]
+        layout = [(alias, col.lower()) for col in table.columns]
+        plan = Plan("scan", [], {"name": name}, f"scan {name} {alias}")
+        size = float(len(table.rows))
+        rest = []
+        # use the indexes of the table for equality and range
+        # filters on its columns
+        for expr in filters:
+            if (
+                expr[0] == "cmp" and expr[1] == "=" and plan.op == "scan"
+                and {expr[2][0], expr[3][0]} == {"col", "lit"}
+            ):
+                col_expr, lit = (
+                    (expr[2], expr[3]) if expr[2][0] == "col"
+                    else (expr[3], expr[2])
+                )
+                column = self.resolve(layout, col_expr)
+                if table.get_index(column) is not None and \
+                        isinstance(lit[1], str):
+                    plan = Plan(
+                        "select_eq",
+                        [plan],
+                        {"column": column, "value": lit[1]},
+                        f"select_eq {to_sql(expr)}"
+                    )
+                    size *= _selectivity(expr)
+                    continue
+            elif (
+                expr[0] == "between" and not expr[4] and plan.op == "scan"
+                and expr[1][0] == "cast" and expr[1][1][0] == "col"
+                and expr[2][0] == "lit" and expr[3][0] == "lit"
+            ):
+                column = self.resolve(layout, expr[1][1])
+                index = table.get_index(column)
+                key = {"INT": int, "REAL": float}.get(expr[1][2])
+                if isinstance(index, SortedIndex) and index.key is key \
+                        and key is not None:
+                    plan = Plan(
+                        "select_range",
+                        [plan],
+                        {
+                            "column": column,
+                            "low": expr[2][1],
+                            "high": expr[3][1],
+                            "key": key
+                        },
+                        f"select_range {to_sql(expr)}"
+                    )
+                    size *= _selectivity(expr)
+                    continue
+            rest.append(expr)
+
+        # decode the used dictionary-encoded columns after the index
+        # lookups (select_eq encodes its value), the compiled
+        # expressions work on values
+        decoded = [
+            col for col in sorted(table.dictionaries)
+            if layout[col] in decode
+        ]
+        if decoded:
+            plan = Plan(
+                "decode",
+                [plan],
+                {"columns": decoded},
+                f"decode {name} {alias}"
+            )
+        if rest:
+            condition = rest[0] if len(rest) == 1 else ("and", rest)
+            plan = Plan(
+                "select",
+                [plan],
+                {"predicate": self.predicate(condition, layout)},
+                f"select {to_sql(condition)}"
+            )
+            for expr in rest:
+                size *= _selectivity(expr)
+        return plan, size
+
+    def plan(self) -> Plan:
+        query = self.query
+        full_layout: Layout = [
+            (alias, col.lower())
+            for name, alias in query.tables
+            for col in self.tables[name].columns
+        ]
+
+        # split the WHERE clause into its conjuncts and classify them
+        # into filters of single tables, join conditions and the rest
+        conjuncts: list[Expr] = []
+        if query.where is not None:
+            where = self.bind(query.where, full_layout)
+            conjuncts = list(where[1]) if where[0] == "and" else [where]
+        filters: dict[str, list[Expr]] = {
+            alias: [] for _, alias in query.tables
+        }
+        join_conditions: list[tuple[Expr, str, str]] = []
+        residuals: list[tuple[Expr, set[str]]] = []
+        for expr in conjuncts:
+            assert not any(e[0] == "agg" for e in _walk(expr)), \
+                "aggregates are not allowed in WHERE"
+            aliases = self.aliases_of(expr, full_layout)
+            if len(aliases) == 1:
+                filters[next(iter(aliases))].append(expr)
+            elif (
+                len(aliases) == 2 and expr[0] == "cmp" and expr[1] == "="
+                and expr[2][0] == "col" and expr[3][0] == "col"
+            ):
+                left, right = (
+                    full_layout[self.resolve(full_layout, expr[2])][0],
+                    full_layout[self.resolve(full_layout, expr[3])][0]
+                )
+                join_conditions.append((expr, left, right))
+            else:
+                residuals.append((expr, aliases))
+
+        decode = self.decoded_columns(
+            join_conditions,
+            [e for exprs in filters.values() for e in exprs]
+            + [e for e, _ in residuals],
+            full_layout
+        )
+        scans = {
+            alias: self.scan(name, alias, filters[alias], decode)
+            for name, alias in query.tables
+        }
+        scans = self.reduce_scans(scans, join_conditions, full_layout)
+
+        # greedily join the tables, starting with the smallest one and
+        # then always joining the smallest table connected to the
+        # tables joined so far
+        start = min(scans, key=lambda alias: scans[alias][1])
+        plan = scans[start][0]
+        layout = self.layout(start)
+        joined = {start}
+        while len(joined) < len(scans):
+            candidates = {
+                right if left in joined else left
+                for _, left, right in join_conditions
+                if (left in joined) != (right in joined)
+            }
+            assert len(candidates) > 0, \
+                "cross products are not supported, " \
+                "add a join condition for every table"
+            alias = min(candidates, key=lambda alias: scans[alias][1])
+            other_layout = self.layout(alias)
+            conditions = [
+                expr for expr, left, right in join_conditions
+                if {left, right} == {alias} | ({left, right} - {alias})
+                and ({left, right} - {alias}) <= joined
+                and alias in {left, right}
+            ]
+            expr = conditions[0]
+            left_expr, right_expr = expr[2], expr[3]
+            if self.aliases_of(left_expr, full_layout) == {alias}:
+                left_expr, right_expr = right_expr, left_expr
+            column = self.resolve(layout, left_expr)
+            other_column = self.resolve(other_layout, right_expr)
+            # in chains of joins, the joins only keep the row ids of
+            # the matches, and the projection or grouping at the end
+            # gathers the columns it needs (for a single join, copying
+            # the rows right away is as fast)
+            plan = Plan(
+                "late_join" if len(scans) > 2 else "join",
+                [plan, scans[alias][0]],
+                {"column": column, "other_column": other_column},
+                f"join {to_sql(left_expr)} = {to_sql(right_expr)}"
+            )
+            layout = layout + other_layout
+            joined.add(alias)
+            # further join conditions between the tables become filters
+            for expr in conditions[1:]:
+                residuals.append((expr, self.aliases_of(expr, full_layout)))
+            join_conditions = [
+                (e, left, right) for e, left, right in join_conditions
+                if e not in conditions
+            ]
+            plan, residuals = self.apply_residuals(
+                plan, layout, residuals, joined
+            )
+        plan, residuals = self.apply_residuals(
+            plan, layout, residuals, joined
+        )
+        assert not residuals and not join_conditions, "should not happen"
+
+        return self.plan_output(plan, layout)
+
+    def decoded_columns(
+        self,
+        join_conditions: list[tuple[Expr, str, str]],
+        conjuncts: list[Expr],
+        full_layout: Layout
+    ) -> set[tuple[str, str]]:
+        # dictionary-encoded columns used by the query that have to be
+        # decoded: all but the columns only used in join conditions with
+        # columns encoded by the same dictionary, which are joined on
+        # their codes (unused columns are never looked at)
+        query = self.query
+        exprs = conjuncts + [e for e, _ in query.select] + query.group_by \
+            + [e for e, _ in query.order_by] \
+            + ([] if query.having is None else [query.having])
+        # names of the columns used elsewhere, without resolving them
+        # (ORDER BY may refer to aliases of the select list)
+        used = {
+            e[2].lower() if e[0] == "col" else e[1].lower()
+            for expr in exprs for e in _walk(expr) if e[0] in {"col", "dq"}
+        }
+
+        def dictionary(column: tuple[str, str]) -> Dictionary | None:
+            table = self.tables[self.aliases[column[0]]]
+            index = self.layout(column[0]).index(column)
+            return table.dictionaries.get(index)
+
+        pairs = [
+            (
+                full_layout[self.resolve(full_layout, expr[2])],
+                full_layout[self.resolve(full_layout, expr[3])]
+            )
+            for expr, _, _ in join_conditions
+        ]
+        keys = {
+            column for pair in pairs for column in pair
+            if column[1] not in used and dictionary(column) is not None
+        }
+        # both sides of a join condition are either joined on
+        # their codes or decoded
+        changed = True
+        while changed:
+            changed = False
+            for left, right in pairs:
+                if (left in keys or right in keys) and not (
+                    left in keys and right in keys
+                    and dictionary(left) is dictionary(right)
+                ):
+                    keys -= {left, right}
+                    changed = True
+        return {
+            column for column in full_layout
+            if dictionary(column) is not None and column not in keys and (
+                column[1] in used
+                or any(column in pair for pair in pairs)
+            )
+        }
+
+    def reduce_scans(
+        self,
+        scans: dict[str, tuple[Plan, float]],
+        join_conditions: list[tuple[Expr, str, str]],
+        full_layout: Layout
+    ) -> dict[str, tuple[Plan, float]]:
+        # sideways information passing: a table joined with a table
+        # that has selective filters is reduced to the rows with a
+        # join partner by a semi-join, before it takes part in any
+        # join, so selective filters shrink all join inputs early
+        # (like the fact table of a star join with one filtered
+        # dimension). The filtered plans are shared with the joins.
+        reduced = dict(scans)
+        for expr, left, right in join_conditions:
+            for alias, other in [(left, right), (right, left)]:
+                other_plan, other_size = scans[other]
+                base_size = len(self.tables[self.aliases[other]].rows)
+                selectivity = other_size / max(1, base_size)
+                plan, size = reduced[alias]
+                if selectivity > _SEMI_JOIN_SELECTIVITY or \
+                        other_size >= size:
+                    continue
+
+                column_expr, other_expr = expr[2], expr[3]
+                if self.aliases_of(column_expr, full_layout) == {other}:
+                    column_expr, other_expr = other_expr, column_expr
+                reduced[alias] = (
+                    Plan(
+                        "semi_join",
+                        [plan, other_plan],
+                        {
+                            "column": self.resolve(
+                                self.layout(alias), column_expr
+                            ),
+                            "other_column": self.resolve(
+                                self.layout(other), other_expr
+                            )
+                        },
+                        f"semi_join {to_sql(column_expr)} "
+                        f"in {to_sql(other_expr)}"
+                    ),
+                    size * selectivity
+                )
+        return reduced
+
+    def layout(self, alias: str) -> Layout:
+        return [
+            (alias, col.lower())
+            for col in self.tables[self.aliases[alias]].columns
+        ]
+
+    def apply_residuals(
+        self,
+        plan: Plan,
+        layout: Layout,
+        residuals: list[tuple[Expr, set[str]]],
+        joined: set[str]
+    ) -> tuple[Plan, list[tuple[Expr, set[str]]]]:
+        # applies the conditions whose tables are all joined already
+        ready = [expr for expr, aliases in residuals if aliases <= joined]
+        if not ready:
+            return plan, residuals
+        condition = ready[0] if len(ready) == 1 else ("and", ready)
+        plan = Plan(
+            "select",
+            [plan],
+            {"predicate": self.predicate(condition, layout)},
+            f"select {to_sql(condition)}"
+        )
+        return plan, [
+            (expr, aliases) for expr, aliases in residuals
+            if not aliases <= joined
+        ]
+
+    def plan_output(self, plan: Plan, layout: Layout) -> Plan:
+        # plans grouping, the select list, ordering and the limit
+        query = self.query
+        select_items = [
+            (self.bind(expr, layout), alias) for expr, alias in query.select
+        ]
+        star = ("col", None, "*")
+        if len(select_items) == 1 and select_items[0][0] == star:
+            select_items = [
+                (("col", alias, name), None) for alias, name in layout
+            ]
+        having = None if query.having is None \
+            else self.bind(query.having, layout)
+        select_aliases = {
+            alias.lower(): expr for expr, alias in select_items
+            if alias is not None
+        }
+
+        def substitute(expr: Expr) -> Expr:
+            # replaces references to aliases of the select list
+            if expr[0] == "col" and expr[1] is None and \
+                    expr[2].lower() in select_aliases and not any(
+                        n == expr[2].lower() for _, n in layout):
+                return select_aliases[expr[2].lower()]
+            return tuple(
+                substitute(part)
+                if isinstance(part, tuple) and part
+                and isinstance(part[0], str)
+                else [substitute(e) for e in part]
+                if isinstance(part, list)
+                else part
+                for part in expr
+            )
+
+        if having is not None:
+            having = substitute(having)
+        order_items = []
+        for expr, ascending in query.order_by:
+            expr = self.bind(expr, layout)
+            if expr[0] == "lit" and isinstance(expr[1], int):
+                assert 1 <= expr[1] <= len(select_items), \
+                    f"ORDER BY position {expr[1]} out of range"
+                expr = select_items[expr[1] - 1][0]
+            order_items.append((substitute(expr), ascending))
+
+        # group and aggregate
+        aggregates: list[Expr] = []
+        for expr in (
+            [expr for expr, _ in select_items]
+            + ([having] if having is not None else [])
+            + [expr for expr, _ in order_items]
+        ):
+            for e in _walk(expr):
+                if e[0] == "agg" and e not in aggregates:
+                    aggregates.append(e)
+
+        if query.group_by or aggregates:
+            group_columns = [
+                self.resolve(layout, self.bind(expr, layout))
+                for expr in query.group_by
+            ]
+            # bare columns of the select list are grouped by as well,
+            # they are assumed to be functionally dependent on the
+            # columns grouped by (like p.name on p.person_id)
+            for expr, _ in select_items:
+                for e in _walk(expr):
+                    if e[0] == "agg":
+                        break
+                else:
+                    for e in _walk(expr):
+                        if e[0] == "col":
+                            column = self.resolve(layout, e)
+                            if column not in group_columns:
+                                group_columns.append(column)
+            # expressions to aggregate and columns that are grouped by
+            # as well are computed as additional columns first, since
+            # group_by aggregates columns not grouped by only
+            computed = []
+            for expr in aggregates:
+                arg = expr[2]
+                if arg is not None and arg not in computed and (
+                    arg[0] != "col"
+                    or self.resolve(layout, arg) in group_columns
+                ):
+                    computed.append(arg)
+            if computed:
+                plan = Plan(
+                    "compute",
+                    [plan],
+                    {
+                        "exprs": [
+                            (lambda i: lambda row: row[i])(i)
+                            for i in range(len(layout))
+                        ] + [
+                            _compile(e, lambda e: self.resolve(layout, e))
+                            for e in computed
+                        ],
+                        "names": [n for _, n in layout]
+                        + [to_sql(e) for e in computed]
+                    },
+                    "compute *, " + ", ".join(to_sql(e) for e in computed)
+                )
+                layout = layout + [("", to_sql(e)) for e in computed]
+
+            aggregations: list[tuple[int, Aggregate]] = []
+            for expr in aggregates:
+                if expr[2] is None:
+                    free = [
+                        i for i in range(len(layout))
+                        if i not in group_columns
+                    ]
+                    assert free, "COUNT(*) needs a column not grouped by"
+                    column = free[0]
+                elif expr[2] in computed:
+                    column = layout.index(("", to_sql(expr[2])))
+                else:
+                    column = self.resolve(layout, expr[2])
+                aggregations.append((column, _aggregate(expr)))
+            new_layout = [layout[col] for col in group_columns] + [
+                ("", to_sql(expr)) for expr in aggregates
+            ]
+            having_fn = None if having is None \
+                else self.predicate(having, new_layout)
+            description = ", ".join(
+                [to_sql(("col",) + layout[col]) for col in group_columns]
+                + [to_sql(expr) for expr in aggregates]
+            )
+            if group_columns:
+                plan = Plan(
+                    "group_by",
+                    [plan],
+                    {
+                        "columns": group_columns,
+                        "aggregations": aggregations,
+                        "having": having_fn,
+                        "memory_budget": self.memory_budget
+                    },
+                    f"group_by {description}"
+                    + ("" if having is None else f" having {to_sql(having)}")
+                )
+            else:
+                plan = Plan(
+                    "aggregate",
+                    [plan],
+                    {
+                        "aggregations": aggregations,
+                        "names": [n for _, n in new_layout],
+                        "having": having_fn
+                    },
+                    f"aggregate {description}"
+                    + ("" if having is None else f" having {to_sql(having)}")
+                )
+            layout = new_layout
+        else:
+            assert having is None, "HAVING requires GROUP BY or aggregates"
+
+        # compute the select list and hidden columns to order by
+        names = []
+        for expr, alias in select_items:
+            if alias is not None:
+                names.append(alias)
+            elif expr[0] == "col":
+                names.append(expr[2])
+            else:
+                names.append(to_sql(expr))
+        select_exprs = [expr for expr, _ in select_items]
+        order_columns = []
+        hidden = []
+        for expr, ascending in order_items:
+            if expr in select_exprs:
+                order_columns.append(
+                    (select_exprs.index(expr), ascending, _is_numeric(expr))
+                )
+            else:
+                assert not query.distinct, \
+                    "ORDER BY terms must be in the select list for DISTINCT"
+                order_columns.append((
+                    len(select_exprs) + len(hidden),
+                    ascending,
+                    _is_numeric(expr)
+                ))
+                hidden.append(expr)
+
+        exprs = select_exprs + hidden
+        if all(expr[0] in {"col", "agg"} for expr in exprs):
+            plan = Plan(
+                "project",
+                [plan],
+                {
+                    "columns": [self.resolve(layout, e) for e in exprs],
+                    "distinct": query.distinct,
+                    "memory_budget": self.memory_budget
+                },
+                ("project distinct " if query.distinct else "project ")
+                + ", ".join(to_sql(e) for e in exprs)
+            )
+        else:
+            plan = Plan(
+                "compute",
+                [plan],
+                {
+                    "exprs": [
+                        _compile(e, lambda e: self.resolve(layout, e))
+                        for e in exprs
+                    ],
+                    "names": names + [to_sql(e) for e in hidden]
+                },
+                "compute " + ", ".join(to_sql(e) for e in exprs)
+            )
+            if query.distinct:
+                plan = Plan(
+                    "project",
+                    [plan],
+                    {
+                        "columns": list(range(len(exprs))),
+                        "distinct": True,
+                        "memory_budget": self.memory_budget
+                    },
+                    "distinct"
+                )
+
+        # order by the last key first, the sorts are stable
+        for column, ascending, numeric in reversed(order_columns):
+            plan = Plan(
+                "order_by",
+                [plan],
+                {
+                    "column": column,
+                    "ascending": ascending,
+                    "cast": _to_number if numeric else None,
+                    "memory_budget": self.memory_budget
+                },
+                f"order_by {(names + [to_sql(e) for e in hidden])[column]}"
+                + ("" if ascending else " DESC")
+            )
+        if query.limit is not None:
+            plan = Plan(
+                "limit",
+                [plan],
+                {"limit": query.limit},
+                f"limit {query.limit}"
+            )
+        if hidden:
+            plan = Plan(
+                "project",
+                [plan],
+                {"columns": list(range(len(select_exprs)))},
+                "project " + ", ".join(names)
+            )
+        return Plan("rename", [plan], {"columns": names}, "rename")
+
+
+def plan_sql(
+    sql: str,
+    tables: dict[str, Table],
+    memory_budget: int | None = None
+) -> Plan:
+    """
+
+    Parses the SQL query and compiles it into a plan over the given
+    tables. Filters on single tables are pushed down to the table
+    scans (using the indexes of the tables for equality and range
+    filters where possible), the tables are joined greedily starting
+    with the smallest one, and conditions on several tables are
+    applied as soon as all their tables are joined. If a memory
+    budget in bytes is given, DISTINCT, GROUP BY and ORDER BY
+    spill to temporary files when they exceed it.
+
+    >>> p = Table.build_from_file("persons.example.tsv")
+    >>> j = Table.build_from_file("jobs.example.tsv")
+    >>> tables = {"persons": p, "jobs": j}
+    >>> plan_sql(
+    ...     "SELECT j.job_title, COUNT(p.id) AS n FROM persons p, jobs j "
+    ...     "WHERE p.job_id = j.id AND CAST(p.age AS INT) > 20 "
+    ...     "GROUP BY j.id HAVING n >= 1 ORDER BY n DESC LIMIT 2",
+    ...     tables
+    ... ) # doctest: +NORMALIZE_WHITESPACE
+    rename
+      limit 2
+        order_by n DESC
+          project j.job_title, COUNT(p.id)
+            group_by j.id, j.job_title, COUNT(p.id) having COUNT(p.id) >= 1
+              join p.job_id = j.id
+                select CAST(p.age AS INT) > 20
+                  scan persons p
+                scan jobs j
+    """
+    return _Planner(parse_sql(sql), tables, memory_budget).plan()
+
+
+def run_sql(
+    sql: str,
+    tables: dict[str, Table],
+    profile: Profile | None = None,
+    cache: ResultCache | None = None,
+    memory_budget: int | None = None
+) -> Table:
+    """
+
+    Runs the SQL query on the given tables and returns the result.
+    If a profile is given, the statistics of each operation are
+    recorded in it, like with EXPLAIN ANALYZE. If a result cache
+    is given, results of equal subplans are reused across queries.
+    If a memory budget in bytes is given, the operations that can
+    spill to temporary files stay within it (see plan_sql).
+
+    >>> p = Table.build_from_file("persons.example.tsv")
+    >>> j = Table.build_from_file("jobs.example.tsv")
+    >>> tables = {"persons": p, "jobs": j}
+    >>> run_sql(
+    ...     "SELECT p.name, j.job_title FROM persons p, jobs j "
+    ...     "WHERE p.job_id = j.id AND j.job_title LIKE '%er' "
+    ...     "ORDER BY p.name", tables
+    ... ) # doctest: +NORMALIZE_WHITESPACE
+    table: jobs.example X persons.example
+    name | job_title
+    ------------------------
+    John | manager
+    Mark | manager
+    Mary | software engineer
+    >>> run_sql(
+    ...     "SELECT j.job_title, COUNT(*) AS n, "
+    ...     "ROUND(AVG(CAST(p.age AS INT)), 1) AS avg_age "
+    ...     "FROM persons p JOIN jobs j ON p.job_id = j.id "
+    ...     "GROUP BY j.id ORDER BY avg_age DESC", tables
+    ... ) # doctest: +NORMALIZE_WHITESPACE
+    table: jobs.example X persons.example
+    job_title         | n | avg_age
+    -------------------------------
+    secretary         | 2 | 38.0
+    manager           | 2 | 33.5
+    software engineer | 1 | 18.0
+    >>> run_sql(
+    ...     "SELECT DISTINCT age FROM persons WHERE age IS NOT NULL "
+    ...     "ORDER BY age DESC LIMIT 3", tables, memory_budget=200
+    ... ) # doctest: +NORMALIZE_WHITESPACE
+    table: persons.example
+    age
+    ---
+    38
+    29
+    20
+    >>> # NULL compares as unknown, also when negated
+    ... for where in [
+    ...     "NOT age = '38'",
+    ...     "NOT (CAST(age AS INT) > 30)",
+    ...     "age NOT IN (38, 29)"
+    ... ]:
+    ...     print(run_sql(
+    ...         f"SELECT name FROM persons WHERE {where}", tables
+    ...     ).rows)
+    [('John',), ('Mary',), ('Lisa',)]
+    [('John',), ('Mary',), ('Lisa',)]
+    [('Mary',), ('Lisa',)]
+    >>> cache = ResultCache()
+    >>> query = (
+    ...     "SELECT j.job_title, COUNT(*) AS n FROM persons p, jobs j "
+    ...     "WHERE p.job_id = j.id GROUP BY j.id ORDER BY n DESC"
+    ... )
+    >>> first = run_sql(query, tables, cache=cache).rows
+    >>> run_sql(query, tables, cache=cache).rows == first
+    True
+    >>> cache.hits > 0, cache.evictions
+    (True, 0)
+    >>> profile = Profile()
+    >>> _ = run_sql(
+    ...     "SELECT j.job_title, COUNT(*) AS n FROM persons p, jobs j "
+    ...     "WHERE p.job_id = j.id GROUP BY j.id ORDER BY n DESC LIMIT 1",
+    ...     tables,
+    ...     profile
+    ... )
+    >>> print(profile.format(times=False, memory=False))
+    ... # doctest: +NORMALIZE_WHITESPACE
+    rename (rows: 1 -> 1)
+      limit 1 (rows: ? -> 1)
+        order_by n DESC (rows: 3 -> lazy)
+          project j.job_title, COUNT(*) (rows: 3 -> 3)
+            group_by j.id, j.job_title, COUNT(*) (rows: 5 -> 3)
+              join j.id = p.job_id (rows: 4 x 6 -> 5)
+                scan jobs j (rows: 4)
+                scan persons p (rows: 6)
+    """
+    return plan_sql(sql, tables, memory_budget).execute(
+        tables,
+        profile,
+        cache
+    )
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "tables",
+        nargs="+",
+        type=str,
+        help="paths to the tsv-files (or binary .tbl-files) "
+        "that will be read as tables"
+    )
+    parser.add_argument(
+        "-q",
+        "--query",
+        type=str,
+        required=True,
+        help="the SQL query to run"
+    )
+    parser.add_argument(
+        "--analyze",
+        action="store_true",
+        help="whether to print the plan annotated with the row counts, "
+        "runtimes and peak memory of each operation"
+    )
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="whether to trace the memory allocated by each operation "
+        "exactly (slower), instead of the peak resident set size"
+    )
+    parser.add_argument(
+        "--profile-json",
+        type=str,
+        default=None,
+        help="path to a file the profile is written to as JSON"
+    )
+    parser.add_argument(
+        "--memory-mb",
+        type=int,
+        default=None,
+        help="memory budget in MB of DISTINCT, GROUP BY and ORDER BY, "
+        "which spill to temporary files beyond it, unlimited by default"
+    )
+    parser.add_argument(
+        "--verbose",
+        action="store_true",
+        help="whether to print the full untruncated table"
+    )
+    return parser.parse_args()
+
+
+def main(args: argparse.Namespace) -> None:
+    tables = {}
+    # dictionaries of the binary tables, shared by equal blocks
+    shared: dict[tuple[int, bytes], Dictionary] = {}
+    for file in args.tables:
+        if file.endswith(".tbl"):
+            table = Table.build_from_binary_file(file, shared)
+        else:
+            table = Table.build_from_file(file)
+        tables[table.name] = table
+
+    plan = plan_sql(
+        args.query,
+        tables,
+        None if args.memory_mb is None else args.memory_mb * 1024 * 1024
+    )
+    profile = None
+    if args.analyze or args.profile_json is not None:
+        profile = Profile(args.trace_memory)
+    else:
+        print(f"Plan:\n{plan}\n")
+    result = plan.execute(tables, profile)
+    if profile is not None:
+        print(f"Plan:\n{profile}\n")
+    if args.profile_json is not None:
+        with open(args.profile_json, "w", encoding="utf8") as of:
+            of.write(profile.to_json())  # type: ignore
+    result.verbose = args.verbose
+    print(result)
+
+
+if __name__ == "__main__":
+    main(parse_args())
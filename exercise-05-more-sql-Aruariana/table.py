@@ -1,15 +1,26 @@
+import json
+import mmap
 import os
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import chain
+from typing import Any, Callable, Iterable, Iterator
 
 Value = str | None
 Row = tuple[Value, ...]
 
+# canonical integers, without leading zeros or plus signs
+_INT_PATTERN = re.compile(r"0|-?[1-9][0-9]*")
+
 
 class Table:
     def __init__(
         self,
         name: str,
         columns: list[str],
-        rows: list[Row]
+        rows: list[Row],
+        dictionaries: dict[int, "Dictionary"] | None = None
     ) -> None:
         self.name = name
         self.columns = columns
@@ -17,6 +28,14 @@ class Table:
         # whether to print the full value of a column
         # or truncate it to 32 characters, internal use only
         self.verbose = False
+        # secondary indexes on columns of the table,
+        # see create_index and get_index
+        self.indexes: dict[int, "HashIndex | SortedIndex"] = {}
+        # dictionaries of the dictionary-encoded columns of the
+        # table, by column, see encode_column
+        self.dictionaries: dict[int, Dictionary] = (
+            {} if dictionaries is None else dictionaries
+        )
 
     @staticmethod
     def build_from_file(file_name: str) -> "Table":
@@ -72,6 +91,391 @@ class Table:
             rows
         )
 
+    def save_binary(self, file_name: str) -> None:
+        """
+
+        Writes the table to a file in a binary columnar format that
+        is much faster to load than TSV (see build_from_binary_file).
+
+        The file starts with the magic bytes TBL1, the length of the
+        header as 8 byte little-endian unsigned int and a JSON header
+        with the name, the column names, the number of rows and the
+        type and offsets of the block of each column. Each column is
+        stored as one typed block, aligned to 8 bytes:
+
+        - "int": unencoded columns whose values are all canonical
+          integers, stored as int64 values, None as the smallest
+          int64 value
+        - "dict": dictionary-encoded columns and all other columns,
+          stored as int32 codes into a newline-separated dictionary of
+          sorted distinct values (the whole dictionary of an encoded
+          column, which may be shared with other tables), code 0
+          stands for None, so they are loaded as encoded columns again
+
+        >>> import tempfile
+        >>> t = Table.build_from_file("persons.example.tsv")
+        >>> j = Table.build_from_file("jobs.example.tsv")
+        >>> _ = encode_domain([(t, 3), (j, 0)])
+        >>> shared = {}
+        >>> with tempfile.TemporaryDirectory() as tmp:
+        ...     for table in [t, j]:
+        ...         file_name = os.path.join(tmp, table.name + ".tbl")
+        ...         table.save_binary(file_name)
+        ...     b = Table.build_from_binary_file(
+        ...         os.path.join(tmp, "persons.example.tbl"), shared
+        ...     )
+        ...     c = Table.build_from_binary_file(
+        ...         os.path.join(tmp, "jobs.example.tbl"), shared
+        ...     )
+        ...     d = Table.build_from_binary_file(
+        ...         os.path.join(tmp, "jobs.example.tbl"), encoded=[]
+        ...     )
+        >>> b.name, b.columns == t.columns, list(b.dictionaries)
+        ('persons.example', True, [1, 3])
+        >>> b.decode([1]).rows == t.rows
+        True
+        >>> b.dictionaries[3] is c.dictionaries[0]
+        True
+        >>> d.rows == j.decode().rows, d.dictionaries
+        (True, {})
+        """
+        rows = self.rows
+        num_rows = len(rows)
+        blocks = []
+        data = bytearray()
+        for col in range(len(self.columns)):
+            values = [row[col] for row in rows]
+            data += bytes(-len(data) % 8)
+            dictionary = self.dictionaries.get(col)
+            if dictionary is None and _is_int_column(values):
+                ints = array("q", (
+                    _NULL_INT if val is None else int(val)
+                    for val in values
+                ))
+                blocks.append({
+                    "type": "int",
+                    "offset": len(data),
+                    "nulls": any(val is None for val in values)
+                })
+                data += ints.tobytes()
+                continue
+
+            column_codes: list[Any] = values
+            if dictionary is None:
+                dictionary = Dictionary(values)
+                column_codes = [
+                    None if val is None else dictionary.codes[val]
+                    for val in values
+                ]
+            codes = array("i", (
+                0 if code is None else code + 1 for code in column_codes
+            ))
+            assert not any("\n" in val for val in dictionary.values), \
+                "values must not contain newlines"
+            text = "\n".join(dictionary.values).encode("utf8")
+            blocks.append({
+                "type": "dict",
+                "offset": len(data),
+                "dict_offset": len(data) + 4 * num_rows,
+                "dict_length": len(text),
+                "dict_size": len(dictionary)
+            })
+            data += codes.tobytes()
+            data += text
+
+        header = json.dumps({
+            "name": self.name,
+            "columns": self.columns,
+            "num_rows": num_rows,
+            "blocks": blocks
+        }).encode("utf8")
+        # pad the header, so the data is 8 byte aligned
+        header += b" " * (-(len(_MAGIC) + 8 + len(header)) % 8)
+        with open(file_name, "wb") as of:
+            of.write(_MAGIC)
+            of.write(len(header).to_bytes(8, "little"))
+            of.write(header)
+            of.write(data)
+
+    @staticmethod
+    def build_from_binary_file(
+        file_name: str,
+        shared: dict[tuple[int, bytes], "Dictionary"] | None = None,
+        encoded: Iterable[int] | None = None
+    ) -> "Table":
+        """
+
+        Reads a table from a file written by save_binary. The file
+        is memory mapped, and the column blocks are read through
+        zero-copy views on the mapped file, so no text has to
+        be split and parsed. The dictionary blocks of the given
+        encoded columns (by default all) are loaded as dictionary-
+        encoded columns, without decoding their codes, only the
+        dictionaries themselves are decoded. The other dictionary
+        blocks are decoded while loading, which is cheaper than
+        decoding the loaded table. Tables loaded with the same shared
+        dict (from the contents of dictionary blocks to their
+        dictionaries) share the dictionaries of equal blocks, so the
+        columns of a domain encoded with one dictionary (see
+        encode_domain) can be joined on their codes again.
+
+        """
+        with open(file_name, "rb") as inf, \
+                mmap.mmap(inf.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            assert mm[:len(_MAGIC)] == _MAGIC, \
+                f"{file_name} is not a binary table file"
+            header_length = int.from_bytes(
+                mm[len(_MAGIC):len(_MAGIC) + 8], "little"
+            )
+            data_start = len(_MAGIC) + 8 + header_length
+            header = json.loads(mm[len(_MAGIC) + 8:data_start])
+            num_rows = header["num_rows"]
+
+            view = memoryview(mm)
+            columns: list[list[Any]] = []
+            dictionaries: dict[int, Dictionary] = {}
+            if shared is None:
+                shared = {}
+            if encoded is not None:
+                encoded = set(encoded)
+            try:
+                for block in header["blocks"]:
+                    start = data_start + block["offset"]
+                    if block["type"] == "int":
+                        ints = view[start:start + 8 * num_rows].cast("q")
+                        if block["nulls"]:
+                            columns.append([
+                                None if val == _NULL_INT else str(val)
+                                for val in ints
+                            ])
+                        else:
+                            columns.append(list(map(str, ints)))
+                        ints.release()
+                        continue
+
+                    dict_start = data_start + block["dict_offset"]
+                    key = (block["dict_size"], bytes(
+                        view[dict_start:dict_start + block["dict_length"]]
+                    ))
+                    # the value or code of each code of the file,
+                    # which are shifted by one to make room for None
+                    lookup: list[Any] = [None]
+                    if encoded is None or len(columns) in encoded:
+                        dictionary = shared.get(key)
+                        if dictionary is None:
+                            dictionary = Dictionary.from_sorted(
+                                _dictionary_values(*key)
+                            )
+                            shared[key] = dictionary
+                        dictionaries[len(columns)] = dictionary
+                        lookup.extend(range(len(dictionary)))
+                    else:
+                        lookup.extend(_dictionary_values(*key))
+                    codes = view[start:start + 4 * num_rows].cast("i")
+                    columns.append(list(map(lookup.__getitem__, codes)))
+                    codes.release()
+            finally:
+                view.release()
+
+        rows: list[Row] = (
+            list(zip(*columns)) if columns
+            else [() for _ in range(num_rows)]
+        )
+        return Table(header["name"], header["columns"], rows, dictionaries)
+
+    def create_index(
+        self,
+        column: int,
+        kind: str = "hash",
+        key: Callable[[str], Any] | None = None
+    ) -> "HashIndex | SortedIndex":
+        """
+
+        Creates a secondary index of the given kind ("hash" or "sorted")
+        on the given column and stores it alongside the table, replacing
+        any existing index on that column. Hash indexes support point
+        lookups only, sorted indexes also range lookups. The key
+        function is only supported for sorted indexes.
+        The index is built once and used by select_eq, select_range and
+        join until the table changes.
+
+        >>> t = Table.build_from_file("persons.example.tsv")
+        >>> index = t.create_index(2, kind="sorted", key=int)
+        >>> t.get_index(2) is index
+        True
+        >>> t.get_index(0) is None
+        True
+        """
+        assert kind in {"hash", "sorted"}, "unknown index kind"
+        assert kind == "sorted" or key is None, \
+            "key functions are only supported for sorted indexes"
+        assert key is None or column not in self.dictionaries, \
+            "key functions are not supported on dictionary-encoded columns"
+        index: HashIndex | SortedIndex = (
+            HashIndex(self, column) if kind == "hash"
+            else SortedIndex(self, column, key)
+        )
+        self.indexes[column] = index
+        return index
+
+    def get_index(self, column: int) -> "HashIndex | SortedIndex | None":
+        """
+
+        Returns the index on the given column or None if there is
+        no such index. If the list of rows of the table was replaced,
+        or rows were added or removed without going through add_row
+        in the meantime, the index is rebuilt first. A row that is
+        replaced in place (e.g. t.rows[0] = row) is not detected, the
+        index is then stale until create_index is called again.
+
+        >>> t = Table.build_from_file("persons.example.tsv")
+        >>> index = t.create_index(0)
+        >>> t.rows = t.rows[:2]
+        >>> t.get_index(0).lookup("3")
+        []
+        >>> t.get_index(0) is index
+        False
+        """
+        index = self.indexes.get(column)
+        if index is None:
+            return None
+        elif index.rows is not self.rows or index.size != len(self.rows):
+            index = self.create_index(
+                column,
+                "hash" if isinstance(index, HashIndex) else "sorted",
+                index.key if isinstance(index, SortedIndex) else None
+            )
+        return index
+
+    def add_row(self, row: Row) -> None:
+        """
+
+        Appends a row to the table and updates all indexes.
+
+        >>> t = Table.build_from_file("persons.example.tsv")
+        >>> _ = t.create_index(3)
+        >>> _ = t.create_index(2, kind="sorted", key=int)
+        >>> t.add_row(("6", "Anna", "25", "3"))
+        >>> t.get_index(3).lookup("3")
+        [6]
+        >>> t.get_index(2).range(21, 30)
+        [6, 0]
+        """
+        assert len(row) == len(self.columns), \
+            f"expected row to contain {len(self.columns)} columns"
+        self.rows.append(row)
+        for index in self.indexes.values():
+            if index.rows is self.rows:
+                index.add(len(self.rows) - 1, row)
+
+    def encode_column(self, column: int, dictionary: "Dictionary") -> None:
+        """
+
+        Replaces the values of the given column by their integer codes
+        in the given dictionary, which must contain all values of the
+        column. Joins, grouping and sorting then compare and hash
+        integers instead of strings, and the column takes less memory,
+        because all rows share one code object per distinct value
+        instead of holding their own strings. Operations pass the
+        dictionaries on with the columns, the values are only decoded
+        when the table is printed or decoded (see decode).
+        Note that predicates of select and custom aggregation
+        functions see the codes, see operations.select_values
+        for filters on the values of encoded columns.
+        A column that is already encoded with another dictionary
+        (like the columns of a binary table file) has its codes
+        translated, with one lookup per value of the old dictionary
+        instead of one per row.
+
+        >>> t = Table.build_from_file("persons.example.tsv")
+        >>> t.encode_column(2, Dictionary(row[2] for row in t.rows))
+        >>> t.rows[:2]
+        [('0', 'John', 2, '0'), ('1', 'Mary', 0, '2')]
+        >>> t.decode().rows[:2]
+        [('0', 'John', '29', '0'), ('1', 'Mary', '18', '2')]
+        >>> t.encode_column(2, Dictionary(["1", "18", "20", "29", "38"]))
+        >>> t.rows[:2]
+        [('0', 'John', 3, '0'), ('1', 'Mary', 1, '2')]
+        """
+        assert 0 <= column < len(self.columns), \
+            "column out of range"
+        index = self.indexes.get(column)
+        assert not isinstance(index, SortedIndex) or index.key is None, \
+            "key functions are not supported on dictionary-encoded columns"
+        old = self.dictionaries.get(column)
+        if old is dictionary:
+            return
+        codes: dict[str, int] | list[int] = dictionary.codes
+        if old is not None:
+            # the new code of each old code
+            codes = [dictionary.codes[val] for val in old.values]
+        self.rows = [
+            row[:column]
+            + (None if row[column] is None
+               else codes[row[column]],)  # type: ignore
+            + row[column + 1:]
+            for row in self.rows
+        ]
+        # replace instead of update the dictionaries, they
+        # may be shared with tables derived from this one
+        self.dictionaries = {**self.dictionaries, column: dictionary}
+
+    def decode(self, columns: list[int] | None = None) -> "Table":
+        """
+
+        Returns the table with the values of the given (by default
+        all) dictionary-encoded columns decoded, or the table itself
+        if there is nothing to decode.
+
+        >>> t = Table.build_from_file("jobs.example.tsv")
+        >>> t.encode_column(0, Dictionary(row[0] for row in t.rows))
+        >>> t.encode_column(1, Dictionary(row[1] for row in t.rows))
+        >>> d = t.decode([1])
+        >>> d.rows[0], list(d.dictionaries)
+        ((0, 'manager'), [0])
+        """
+        if columns is None:
+            columns = list(self.dictionaries)
+        columns = [col for col in columns if col in self.dictionaries]
+        if not columns:
+            return self
+        decoders = [
+            self.dictionaries[col].values.__getitem__
+            if col in columns else None
+            for col in range(len(self.columns))
+        ]
+        return Table(
+            self.name,
+            self.columns,
+            [
+                tuple(
+                    val if val is None or decode is None
+                    else decode(val)  # type: ignore
+                    for val, decode in zip(row, decoders)
+                )
+                for row in self.iter_rows()
+            ],
+            {
+                col: dictionary
+                for col, dictionary in self.dictionaries.items()
+                if col not in columns
+            }
+        )
+
+    def iter_rows(self) -> Iterator[Row]:
+        """
+
+        Iterates over the rows of the table. Operations that only
+        need to see each row once should use this instead of rows,
+        so tables that produce their rows lazily (like the result
+        of an external order_by) can stream them.
+
+        >>> t = Table.build_from_file("jobs.example.tsv")
+        >>> next(t.iter_rows())
+        ('0', 'manager')
+        """
+        return iter(self.rows)
+
     @property
     def shape(self) -> tuple[int, int]:
         """
@@ -97,7 +501,7 @@ class Table:
         """
         str_rows = [self.columns] + [
             tuple("?" if val is None else str(val) for val in row)
-            for row in self.rows
+            for row in self.decode().rows
         ]
         max_col_lengths = [
             max(
@@ -123,4 +527,275 @@ class Table:
             + "\n"
             + "\n".join(str_rows[1:])
         )
-  
+
+
+class Dictionary:
+    """
+
+    Order-preserving dictionary of a domain of values, like the ids
+    of all movies. Each value is encoded as its position among the
+    sorted distinct values, so the codes compare like the values they
+    stand for (as strings), and equality, range and sort operations
+    give the same results on the codes as on the values. One
+    dictionary is shared by all columns of a domain, also across
+    tables (see encode_domain), so joins on encoded columns
+    compare codes.
+
+    >>> d = Dictionary(["b", "a", None, "c", "a"])
+    >>> len(d), d.encode("a"), d.encode("c"), d.encode(None)
+    (3, 0, 2, None)
+    >>> d.decode(1)
+    'b'
+    """
+
+    def __init__(self, values: Iterable[Value]) -> None:
+        self.values: list[str] = sorted(
+            set(val for val in values if val is not None)
+        )
+        self.codes: dict[str, int] = {
+            val: code for code, val in enumerate(self.values)
+        }
+
+    @staticmethod
+    def from_sorted(values: list[str]) -> "Dictionary":
+        """
+
+        Returns the dictionary of the given sorted distinct values,
+        without sorting them again (see build_from_binary_file).
+
+        >>> Dictionary.from_sorted(["a", "b"]).encode("b")
+        1
+        """
+        dictionary = Dictionary([])
+        dictionary.values = values
+        dictionary.codes = dict(zip(values, range(len(values))))
+        return dictionary
+
+    def encode(self, value: Value) -> int | None:
+        if value is None:
+            return None
+        return self.codes[value]
+
+    def decode(self, code: int | None) -> Value:
+        if code is None:
+            return None
+        return self.values[code]
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+
+def encode_domain(columns: list[tuple[Table, int]]) -> Dictionary:
+    """
+
+    Builds one dictionary of the values of the given columns
+    of tables, which hold values of the same domain (like the
+    ids of movies in a movies and an awards table), and encodes
+    all of the columns with it, so they can be joined on
+    their codes. Columns that are already encoded contribute
+    the values of their dictionaries instead of their rows, and
+    if they are all encoded with the same dictionary, it is
+    returned as it is.
+
+    >>> p = Table.build_from_file("persons.example.tsv")
+    >>> j = Table.build_from_file("jobs.example.tsv")
+    >>> d = encode_domain([(p, 3), (j, 0)])
+    >>> len(d), p.dictionaries[3] is j.dictionaries[0]
+    (5, True)
+    """
+    first = columns[0][0].dictionaries.get(columns[0][1]) if columns else None
+    if first is not None and all(
+        table.dictionaries.get(column) is first for table, column in columns
+    ):
+        return first
+    dictionary = Dictionary(chain.from_iterable(
+        table.dictionaries[column].values
+        if column in table.dictionaries
+        else (row[column] for row in table.rows)
+        for table, column in columns
+    ))
+    for table, column in columns:
+        table.encode_column(column, dictionary)
+    return dictionary
+
+
+# magic bytes at the start of binary table files
+_MAGIC = b"TBL1"
+# None in int columns of binary table files
+_NULL_INT = -(1 << 63)
+
+
+def _dictionary_values(size: int, text: bytes) -> list[str]:
+    # the values of a dictionary block of a binary table file, the
+    # size tells an empty dictionary from one with the empty string
+    return text.decode("utf8").split("\n") if size > 0 else []
+
+
+def _is_int_column(values: list[Value]) -> bool:
+    # whether all values are integers that survive
+    # a round trip through int64 unchanged
+    has_value = False
+    for val in values:
+        if val is None:
+            continue
+        if not _INT_PATTERN.fullmatch(val):
+            return False
+        if not _NULL_INT < int(val) < (1 << 63):
+            return False
+        has_value = True
+    return has_value
+
+
+class HashIndex:
+    """
+
+    A hash index on a column of a table, mapping each value
+    of the column to the ids (positions) of the rows that
+    contain it. None values are not indexed.
+    The index is built once and can then be reused by
+    any number of lookups and joins.
+
+    >>> t = Table.build_from_file("persons.example.tsv")
+    >>> index = HashIndex(t, 2)
+    >>> index.lookup("38")
+    [2, 4]
+    >>> index.lookup("99")
+    []
+    >>> index.lookup(None)
+    []
+    """
+
+    def __init__(self, table: Table, column: int) -> None:
+        assert 0 <= column < len(table.columns), \
+            "column out of range"
+        self.rows = table.rows
+        self.column = column
+        self.ids: dict[str, list[int]] = {}
+        for i, row in enumerate(self.rows):
+            val = row[column]
+            if val is None:
+                continue
+
+            if val not in self.ids:
+                self.ids[val] = [i]
+            else:
+                self.ids[val].append(i)
+        # number of rows covered by the index
+        self.size = len(self.rows)
+
+    def add(self, row_id: int, row: Row) -> None:
+        """
+
+        Adds a row with the given id to the index.
+
+        """
+        val = row[self.column]
+        self.size += 1
+        if val is None:
+            return
+
+        if val not in self.ids:
+            self.ids[val] = [row_id]
+        else:
+            self.ids[val].append(row_id)
+
+    def lookup(self, value: Value) -> list[int]:
+        """
+
+        Returns the ids of all rows whose column equals the
+        given value. The returned list must not be modified.
+
+        """
+        if value is None:
+            return []
+        return self.ids.get(value, [])
+
+
+class SortedIndex:
+    """
+
+    A sorted index on a column of a table, the in-memory
+    equivalent of a B-tree: the non-None values of the column
+    are kept in sorted order together with their row ids, so that
+    both point and range lookups only need a binary search.
+    An optional key function converts the values before
+    they are compared, e.g. int for numeric columns.
+
+    >>> t = Table.build_from_file("persons.example.tsv")
+    >>> index = SortedIndex(t, 2, key=int)
+    >>> index.lookup("38")
+    [2, 4]
+    >>> index.range(18, 29)
+    [1, 5, 0]
+    >>> index.range(low=30)
+    [2, 4]
+    >>> index.range(high=19)
+    [1]
+    """
+
+    def __init__(
+        self,
+        table: Table,
+        column: int,
+        key: Callable[[str], Any] | None = None
+    ) -> None:
+        assert 0 <= column < len(table.columns), \
+            "column out of range"
+        self.rows = table.rows
+        self.column = column
+        self.key = key
+        entries = sorted(
+            (val if key is None else key(val), i)
+            for i, row in enumerate(self.rows)
+            if (val := row[column]) is not None
+        )
+        self.keys = [k for k, _ in entries]
+        self.ids = [i for _, i in entries]
+        # number of rows covered by the index
+        self.size = len(self.rows)
+
+    def add(self, row_id: int, row: Row) -> None:
+        """
+
+        Adds a row with the given id to the index, keeping
+        the index sorted.
+
+        """
+        val = row[self.column]
+        self.size += 1
+        if val is None:
+            return
+
+        k = val if self.key is None else self.key(val)
+        pos = bisect_right(self.keys, k)
+        self.keys.insert(pos, k)
+        self.ids.insert(pos, row_id)
+
+    def lookup(self, value: Value) -> list[int]:
+        """
+
+        Returns the ids of all rows whose column equals the
+        given value.
+
+        """
+        if value is None:
+            return []
+        k = value if self.key is None else self.key(value)
+        start = bisect_left(self.keys, k)
+        end = bisect_right(self.keys, k, start)
+        return self.ids[start:end]
+
+    def range(self, low: Any = None, high: Any = None) -> list[int]:
+        """
+
+        Returns the ids of all rows whose (converted) column value
+        lies between low and high, both inclusive, in sorted order.
+        A bound of None means the range is open on that side.
+
+        """
+        start = 0 if low is None else bisect_left(self.keys, low)
+        end = (
+            len(self.keys) if high is None
+            else bisect_right(self.keys, high, start)
+        )
+        return self.ids[start:end]
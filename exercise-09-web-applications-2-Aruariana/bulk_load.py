@@ -0,0 +1,219 @@
+"""
+Copyright 2023, University of Freiburg,
+Chair of Algorithms and Data Structures.
+"""
+
+import argparse
+import sqlite3
+import time
+from itertools import islice
+from typing import Iterable, Iterator
+
+from sparql_to_sql import ENCODED_INDEXES, INDEXES, SPARQL, Triple
+
+
+def read_tsv(file_name: str) -> Iterator[Triple]:
+    """
+
+    Reads the triples of the given TSV file with one triple per line,
+    in the format subject\\tpredicate\\tobject, one line at a time, so
+    that the file is never in memory as a whole. Empty lines are
+    skipped. Raises a ValueError for a line that is not a triple.
+
+    >>> import os, tempfile
+    >>> tsv = os.path.join(tempfile.mkdtemp(), "triples.tsv")
+    >>> with open(tsv, "w", encoding="utf8") as f:
+    ...     _ = f.write("Brad_Pitt\\tspouse\\tAngelina_Jolie\\r\\n\\n"
+    ...                 "Brad_Pitt\\tname\\tWilliam Bradley Pitt\\n")
+    >>> list(read_tsv(tsv)) # doctest: +NORMALIZE_WHITESPACE
+    [('Brad_Pitt', 'spouse', 'Angelina_Jolie'),
+     ('Brad_Pitt', 'name', 'William Bradley Pitt')]
+    """
+    with open(file_name, "r", encoding="utf8") as f:
+        for line_number, line in enumerate(f, start=1):
+            terms = line.rstrip("\r\n").split("\t", 2)
+            if len(terms) == 3:
+                yield terms[0], terms[1], terms[2]
+            elif line.strip() != "":
+                raise ValueError(
+                    f"expected a triple in line {line_number} "
+                    f"of {file_name}, got {line!r}"
+                )
+
+
+def bulk_load(
+    db_name: str,
+    file_name: str,
+    encode: bool = False,
+    batch_size: int = 1_000_000
+) -> int:
+    """
+
+    Loads the triples of the given TSV file (see read_tsv) into the
+    given SQLite3 database, and prepares it for the SPARQL engine (see
+    SPARQL.prepare_database). Returns the number of loaded triples.
+
+    The triples are inserted into the wikidata table, or with encode,
+    into the integer-encoded schema: the terms table maps each term
+    to an integer id, and the triples table has the ids of the terms.
+    Tables that exist already are appended to.
+
+    For speed, the file is streamed and inserted in batches of the
+    given size with executemany, one transaction per batch, without
+    a rollback journal and without waiting for the disk. The indexes
+    are dropped before and created after the load, as one sort of all
+    triples is much faster than inserting them into the indexes one
+    at a time. Thus, if the load fails, the database may be corrupt.
+
+    >>> import os, sqlite3, tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> tsv = os.path.join(directory, "example.tsv")
+    >>> connection = sqlite3.connect("example.db")
+    >>> with open(tsv, "w", encoding="utf8") as f:
+    ...     for triple in connection.execute("SELECT * FROM wikidata"):
+    ...         _ = f.write("\\t".join(triple) + "\\n")
+    >>> connection.close()
+    >>> db = os.path.join(directory, "example.db")
+    >>> bulk_load(db, tsv, batch_size=100)
+    919
+    >>> encoded_db = os.path.join(directory, "encoded.db")
+    >>> bulk_load(encoded_db, tsv, encode=True, batch_size=100)
+    919
+    >>> connection = sqlite3.connect(encoded_db)
+    >>> connection.execute(
+    ...     "SELECT s.text, o.text FROM triples "
+    ...     "JOIN terms AS s ON s.id = subject "
+    ...     "JOIN terms AS p ON p.id = predicate "
+    ...     "JOIN terms AS o ON o.id = object "
+    ...     "WHERE p.text = 'spouse' ORDER BY s.text LIMIT 1"
+    ... ).fetchall()
+    [('Angelina_Jolie', 'Brad_Pitt')]
+    >>> connection.close()
+    >>> SPARQL().process_sparql_query(
+    ...     db, "SELECT ?x WHERE { Brad_Pitt spouse ?x }"
+    ... )
+    [('Angelina_Jolie',)]
+    """
+    connection = sqlite3.connect(db_name)
+    try:
+        # no rollback journal and no syncs, only for this connection
+        connection.execute("PRAGMA journal_mode = OFF")
+        connection.execute("PRAGMA synchronous = OFF")
+        connection.execute(f"PRAGMA cache_size = {-256 * 1024}")
+        if encode:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS terms"
+                "(id INTEGER PRIMARY KEY, text TEXT)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS triples"
+                "(subject INTEGER, predicate INTEGER, object INTEGER)"
+            )
+            indexes = ["terms_text", *ENCODED_INDEXES]
+            insert = "INSERT INTO triples VALUES (?, ?, ?)"
+            ids = dict(connection.execute("SELECT text, id FROM terms"))
+        else:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS wikidata"
+                "(subject TEXT, predicate TEXT, object TEXT)"
+            )
+            indexes = list(INDEXES)
+            insert = "INSERT INTO wikidata VALUES (?, ?, ?)"
+        for name in indexes:
+            connection.execute(f"DROP INDEX IF EXISTS {name}")
+
+        triples = read_tsv(file_name)
+        num_triples = 0
+        while True:
+            batch = list(islice(triples, batch_size))
+            if not batch:
+                break
+            if encode:
+                rows, terms = _encode(batch, ids)
+                connection.executemany(
+                    "INSERT INTO terms VALUES (?, ?)",
+                    terms
+                )
+                connection.executemany(insert, rows)
+            else:
+                connection.executemany(insert, batch)
+            connection.commit()
+            num_triples += len(batch)
+    finally:
+        connection.close()
+
+    SPARQL().prepare_database(db_name)
+    return num_triples
+
+
+def _encode(
+    triples: Iterable[Triple],
+    ids: dict[str, int]
+) -> tuple[list[tuple[int, int, int]], list[tuple[int, str]]]:
+    # the triples of the ids of their terms, and the (id, term) pairs
+    # of the terms that were not in ids yet, which are added to it
+    encoded = []
+    terms = []
+    for triple in triples:
+        row = []
+        for term in triple:
+            term_id = ids.get(term)
+            if term_id is None:
+                term_id = ids[term] = len(ids)
+                terms.append((term_id, term))
+            row.append(term_id)
+        encoded.append((row[0], row[1], row[2]))
+    return encoded, terms
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "triples",
+        type=str,
+        help="path to a TSV file with triples"
+    )
+    parser.add_argument(
+        "db",
+        type=str,
+        help="path to the sqlite3 database to load the triples into"
+    )
+    parser.add_argument(
+        "-e",
+        "--encode",
+        action="store_true",
+        help="whether to load the triples into the integer-encoded schema"
+    )
+    parser.add_argument(
+        "-b",
+        "--batch-size",
+        type=int,
+        default=1_000_000,
+        help="number of triples to insert per transaction"
+    )
+    return parser.parse_args()
+
+
+def main(args: argparse.Namespace) -> None:
+    """
+
+    Loads the triples of a TSV file into a database.
+
+    """
+    print(f"Loading triples from {args.triples} into {args.db}.")
+    start = time.perf_counter()
+    num_triples = bulk_load(
+        args.db,
+        args.triples,
+        args.encode,
+        args.batch_size
+    )
+    seconds = time.perf_counter() - start
+    print(
+        f"Done, {num_triples:,} triples, took {seconds:.1f}s "
+        f"({num_triples / max(seconds, 1e-9):,.0f} triples/s)."
+    )
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -11,9 +11,11 @@ import argparse
 import os
 # import readline  # noqa
 import socket
+import sqlite3
 import time
+from typing import Generator
 
-from sparql_to_sql import SPARQL
+from sparql_to_sql import SPARQL, ResultCache
 try:
     # try to import the ad_freiburg_qgram_utils package,
     # which contains a faster Rust-based implementation of a q-gram index;
@@ -220,18 +222,34 @@ class Server:
         port: int,
         qi: QGramIndex,
         db: str,
-        party_pooper: bool = False
+        party_pooper: bool = False,
+        encoded: bool = False
     ) -> None:
         """
 
         Initializes a simple HTTP server with
         the given q-gram index, database and port.
-
+        If encoded, the database has the integer-encoded
+        schema (see bulk_load.py). If the database has
+        statistics of the predicates (see --prepare-db),
+        the SPARQL engine plans the queries with them.
+
+        >>> import os, shutil, tempfile
+        >>> Server(0, None, "example.db").engine.statistics is None
+        True
+        >>> db = os.path.join(tempfile.mkdtemp(), "example.db")
+        >>> _ = shutil.copy("example.db", db)
+        >>> SPARQL().prepare_database(db)
+        >>> Server(0, None, db).engine.statistics["spouse"]
+        (18, 16, 17)
         """
         self.port = port
         self.qi = qi
         self.db = db
-        self.engine = SPARQL()
+        # dashboards repeat the same queries, so cache their results
+        self.engine = SPARQL(result_cache=ResultCache(), encoded=encoded)
+        if _has_statistics(db):
+            self.engine.load_statistics(db)
         self.party_pooper = party_pooper
 
     def run(self) -> None:
@@ -266,6 +284,12 @@ class Server:
             request = request.split(" ")[1]
             request = request[1:]
 
+            if request.startswith("api/sparql?query="):
+                # stream the results, chunk by chunk
+                query = request[len("api/sparql?query="):]
+                self.send_sparql_response(connection, query)
+                continue
+
             response = self.handle_request(request)
 
             print(response)
@@ -291,7 +315,17 @@ class Server:
         server_root = os.getcwd()
         requested_path = os.path.abspath(filename)
 
-        if filename == "api/search":
+        if filename == "api/stats":
+            # statistics of the result cache of the SPARQL engine
+            assert self.engine.result_cache is not None
+            stats = self.engine.result_cache.stats()
+            response = "{ " + ", ".join(
+                f"{self.json_string(key)} : {value}"
+                for key, value in stats.items()
+            ) + " }"
+            media_type = "application/json"
+
+        elif filename == "api/search":
             if query == "":
                 response = "API called with empty query."
             else:
@@ -364,6 +398,169 @@ class Server:
 
         return headers + response
 
+    def send_sparql_response(
+        self,
+        connection: socket.socket,
+        query: str
+    ) -> None:
+        """
+
+        Streams the response to a SPARQL request (see
+        handle_sparql_request) to the given connection and closes it.
+        If the client disconnects or the query fails after the header
+        has been sent, the response is aborted, but the server keeps
+        serving.
+
+        >>> class Disconnected:
+        ...     def sendall(self, data: bytes) -> None:
+        ...         raise BrokenPipeError(32, "Broken pipe")
+        ...     def close(self) -> None:
+        ...         print("closed")
+        >>> Server(0, None, "example.db").send_sparql_response(
+        ...     Disconnected(), "SELECT+%3Fx+WHERE+%7B+%3Fx+spouse+%3Fy+%7D"
+        ... )
+        Aborted the response: [Errno 32] Broken pipe
+        closed
+        """
+        chunks = self.handle_sparql_request(query)
+        try:
+            for chunk in chunks:
+                connection.sendall(chunk)
+        except Exception as e:
+            # the status was sent already, so the response can only
+            # be cut off (like for a client that disconnected)
+            print(f"Aborted the response: {e}")
+        finally:
+            # also closes the cursor of the query
+            chunks.close()
+            connection.close()
+
+    def handle_sparql_request(
+        self,
+        query: str,
+        batch_size: int = 1000
+    ) -> Generator[bytes, None, None]:
+        """
+
+        Handles a request of the form /api/sparql?query=<query> for the
+        given URL-encoded SPARQL query. The response is streamed: the
+        result rows are fetched in batches and each batch is sent as a
+        chunk of a chunked HTTP response as soon as it is available, so
+        neither the server nor the client has to wait for (or hold) the
+        whole result. Pagination is possible with LIMIT and OFFSET.
+        Yields the response as a sequence of byte strings.
+
+        >>> s = Server(0, None, "example.db")
+        >>> response = b"".join(s.handle_sparql_request(
+        ...     "SELECT+%3Fx+%3Fy+WHERE+%7B+%3Fx+spouse+%3Fy+%7D+"
+        ...     "ORDER+BY+ASC(%3Fx)+LIMIT+2",
+        ...     batch_size=1
+        ... ))
+        >>> text = response.decode("utf8").replace("\\r", "")
+        >>> print(text) # doctest: +NORMALIZE_WHITESPACE
+        HTTP/1.1 200 OK
+        Content-Type: application/json
+        Transfer-Encoding: chunked
+        <BLANKLINE>
+        2B
+        { "variables" : ["?x", "?y"], "results" : [
+        1F
+        ["Angelina_Jolie", "Brad_Pitt"]
+        29
+        , ["Auguste_Adenauer", "Konrad_Adenauer"]
+        3
+        ] }
+        0
+        <BLANKLINE>
+        <BLANKLINE>
+        >>> response = b"".join(s.handle_sparql_request(
+        ...     "SELECT+(COUNT(*)+AS+%3Fn)+WHERE+%7B+%3Fx+spouse+%3Fy+%7D"
+        ... ))
+        >>> print(response.decode("utf8").split("\\r\\n")[5])
+        { "variables" : ["?n"], "results" : [
+        >>> print(response.decode("utf8").split("\\r\\n")[7])
+        [18]
+        >>> print(b"".join(s.handle_sparql_request("SELECT")).decode("utf8"))
+        ... # doctest: +ELLIPSIS
+        HTTP/1.1 400 BAD REQUEST...Invalid SPARQL query...
+        """
+        try:
+            sparql = self.url_decode(query)
+            variables = self.engine.parse_sparql(sparql).result_variables()
+            batches = self.engine.stream_sparql_query(
+                self.db,
+                sparql,
+                batch_size
+            )
+        except Exception as e:
+            response = f"Invalid SPARQL query: {e}".encode("utf-8")
+            yield (
+                f"HTTP/1.1 400 BAD REQUEST\r\n"
+                f"Content-Length: {len(response)}\r\n"
+                f"Content-Type: text/plain\r\n"
+                f"\r\n"
+            ).encode("utf-8") + response
+            return
+
+        def chunk(text: str) -> bytes:
+            data = text.encode("utf-8")
+            return f"{len(data):X}\r\n".encode("utf-8") + data + b"\r\n"
+
+        yield (
+            "HTTP/1.1 200 OK\r\n"
+            "Content-Type: application/json\r\n"
+            "Transfer-Encoding: chunked\r\n"
+            "\r\n"
+        ).encode("utf-8")
+        yield chunk(
+            f"{{ \"variables\" : ["
+            f"{', '.join(self.json_string(var) for var in variables)}], "
+            f"\"results\" : ["
+        )
+        separator = ""
+        for batch in batches:
+            rows = []
+            for row in batch:
+                # the value of a COUNT is a number
+                values = ", ".join(
+                    self.json_string(value) if isinstance(value, str)
+                    else str(value)
+                    for value in row
+                )
+                rows.append(f"{separator}[{values}]")
+                separator = ", "
+            yield chunk("".join(rows))
+        yield chunk("] }")
+        yield b"0\r\n\r\n"
+
+    def json_string(self, string: str) -> str:
+        """
+
+        Encodes the given string as a JSON string literal, with quotes,
+        backslashes and control characters escaped.
+
+        >>> s = Server(0, None, "")
+        >>> print(s.json_string('Say "Hi"\\n\\t\\\\'))
+        "Say \\"Hi\\"\\n\\t\\\\"
+        >>> print(s.json_string("Rhöndorf"))
+        "Rhöndorf"
+        """
+        result = []
+        for ch in string:
+            if ch == "\"" or ch == "\\":
+                result.append("\\" + ch)
+            elif ch == "\n":
+                result.append("\\n")
+            elif ch == "\t":
+                result.append("\\t")
+            elif ch == "\r":
+                result.append("\\r")
+            elif ord(ch) < 0x20:
+                result.append(f"\\u{ord(ch):04x}")
+            else:
+                result.append(ch)
+        return "\"" + "".join(result) + "\""
+
     def url_decode(self, string: str) -> str:
         """
 
@@ -401,6 +598,21 @@ class Server:
         return result.decode("utf8")
 
 
+def _has_statistics(db_name: str) -> bool:
+    # whether the database exists and has the predicate_statistics
+    # table written by SPARQL.prepare_database
+    if not os.path.exists(db_name):
+        return False
+    connection = sqlite3.connect(db_name)
+    try:
+        return connection.execute(
+            "SELECT 1 FROM sqlite_master "
+            "WHERE type = 'table' AND name = 'predicate_statistics'"
+        ).fetchone() is not None
+    finally:
+        connection.close()
+
+
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -437,6 +649,19 @@ def parse_args() -> argparse.Namespace:
         action="store_true",
         help="whether to prevent code injection"
     )
+    parser.add_argument(
+        "-e",
+        "--encoded",
+        action="store_true",
+        help="whether the database has the integer-encoded schema "
+        "(see bulk_load.py)"
+    )
+    parser.add_argument(
+        "--prepare-db",
+        action="store_true",
+        help="whether to create the indexes of the database for the SPARQL "
+        "engine and analyze it before starting the server"
+    )
     return parser.parse_args()
 
 
@@ -448,11 +673,18 @@ def main(args: argparse.Namespace) -> None:
     q.build_from_file(args.entities)
     print(f"Done, took {(time.perf_counter() - start) * 1000:.1f}ms.")
 
+    if args.prepare_db:
+        print(f"Preparing database {args.db}.")
+        start = time.perf_counter()
+        SPARQL().prepare_database(args.db)
+        print(f"Done, took {(time.perf_counter() - start) * 1000:.1f}ms.")
+
     server = Server(
         args.port,
         q,
         args.db,
-        args.party_pooper
+        args.party_pooper,
+        args.encoded
     )
     print(
         f"Starting server on port {args.port}, go to "
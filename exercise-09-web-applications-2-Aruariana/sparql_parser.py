@@ -0,0 +1,581 @@
+"""
+Copyright 2023, University of Freiburg,
+Chair of Algorithms and Data Structures.
+"""
+
+import argparse
+import re
+import time
+from itertools import chain
+from typing import Any
+
+Triple = tuple[str, str, str]
+# a comparison of a FILTER, as (left operand, operator, right operand),
+# where each operand is a variable or a constant
+Filter = tuple[str, str, str]
+# a COUNT in the SELECT clause, as (variable it is bound to, counted
+# variable or None for COUNT(*), whether only distinct values count)
+Count = tuple[str, str | None, bool]
+
+COMPARISONS = {"=", "!=", "<", "<=", ">", ">="}
+
+# the tokens of a SPARQL query: variables, IRIs (which cannot contain
+# ? or &, so that comparisons like ?y<Z&&?x>A are not an IRI), string
+# literals, comparison operators, punctuation and words (names, numbers
+# and keywords, which may contain dots, but not start or end with one,
+# matched as runs of word characters, not one character at a time),
+# and any other single character, which is invalid everywhere
+_TOKEN = re.compile(r"""
+    \s*(
+        \?[^\s{}()<>=!",.&*]+
+      | <[^\s<>?&]*>
+      | "(?:[^"\\]|\\.)*"
+      | [<>!]=? | = | &&
+      | [{}().,*]
+      | [^\s{}()<>=!",.&*]+(?:\.[^\s{}()<>=!",.&*]+)*
+      | \S
+    )""", re.VERBOSE)
+# an IRI token, as matched by _TOKEN
+_IRI = re.compile(r"<[^\s<>?&]*>")
+# the characters that a WHERE clause with only triples of words,
+# variables and IRIs, separated by dots, does not contain
+_NOT_IN_TRIPLES = '"=!&{}(),*'
+# the tokens that are not terms
+_NOT_TERM = set("{}(),*.=!<>") | {"!=", "&&", "<=", ">="}
+
+
+class Literal(str):
+    """
+
+    A string literal of a query, as its unquoted text. Literals are
+    constants like words and IRIs, and compare equal to them, but
+    never to a variable, even if their text starts with a question
+    mark, so check for variables with is_variable.
+
+    >>> Literal("St. Louis") == "St. Louis", Literal("?y") == "?y"
+    (True, False)
+    """
+
+    def __eq__(self, other: object) -> bool:
+        return str.__eq__(self, other) is True \
+            and not is_variable(other)  # type: ignore
+
+    def __ne__(self, other: object) -> bool:
+        return not self == other
+
+    # equal to strings of the same text, so it must hash like them
+    __hash__ = str.__hash__
+
+    def __repr__(self) -> str:
+        return f"Literal({str.__repr__(self)})"
+
+
+def is_variable(term: str) -> bool:
+    """
+
+    Returns whether the given term of a query is a variable,
+    i.e. it starts with a question mark and is not a literal.
+
+    >>> is_variable("?x"), is_variable(Literal("?x")), is_variable("")
+    (True, False, False)
+    """
+    return term[:1] == "?" and not isinstance(term, Literal)
+
+
+class Query:
+    """
+
+    The abstract syntax tree of a SPARQL query, as produced by parse:
+    the selected variables (including the variable of a COUNT), the
+    triples and the comparisons of the FILTERs of the WHERE clause,
+    the variables of GROUP BY, and the (variable, ascending) keys
+    of ORDER BY, besides DISTINCT, COUNT, LIMIT and OFFSET.
+
+    """
+
+    def __init__(
+        self,
+        variables: list[str],
+        triples: list[Triple],
+        filters: list[Filter] | None = None,
+        distinct: bool = False,
+        count: Count | None = None,
+        group_by: list[str] | None = None,
+        order_by: list[tuple[str, bool]] | None = None,
+        limit: int | None = None,
+        offset: int | None = None
+    ) -> None:
+        self.variables = variables
+        self.triples = triples
+        self.filters = filters or []
+        self.distinct = distinct
+        self.count = count
+        self.group_by = group_by or []
+        self.order_by = order_by or []
+        self.limit = limit
+        self.offset = offset
+
+    def result_variables(self) -> list[str]:
+        """
+
+        Returns the selected variables that are part of the result,
+        i.e. those that occur in a triple and the variable of a COUNT.
+
+        >>> parse("SELECT ?x ?z WHERE { ?x p ?y }").result_variables()
+        ['?x']
+        """
+        variables = {
+            term for triple in self.triples for term in triple
+            if is_variable(term)
+        }
+        if self.count is not None:
+            variables.add(self.count[0])
+        return [var for var in self.variables if var in variables]
+
+    def _fields(self) -> dict[str, Any]:
+        return {
+            "variables": self.variables,
+            "triples": self.triples,
+            "filters": self.filters,
+            "distinct": self.distinct,
+            "count": self.count,
+            "group_by": self.group_by,
+            "order_by": self.order_by,
+            "limit": self.limit,
+            "offset": self.offset
+        }
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, Query) and self._fields() == other._fields()
+
+    def __repr__(self) -> str:
+        # only the fields that differ from their defaults
+        defaults = Query([], [])._fields()
+        fields = ", ".join(
+            f"{name}={value!r}" for name, value in self._fields().items()
+            if name in ("variables", "triples") or value != defaults[name]
+        )
+        return f"Query({fields})"
+
+
+def tokenize(sparql: str) -> list[str]:
+    """
+
+    Splits the given SPARQL query into its tokens, in a single pass.
+
+    >>> tokenize('SELECT ?x WHERE{?x name "St. Louis, MO".?x p <a_b>}')
+    ... # doctest: +NORMALIZE_WHITESPACE
+    ['SELECT', '?x', 'WHERE', '{', '?x', 'name', '"St. Louis, MO"', '.',
+     '?x', 'p', '<a_b>', '}']
+    >>> tokenize("FILTER(?y>=1.5 && ?z != St._Louis.)")
+    ... # doctest: +NORMALIZE_WHITESPACE
+    ['FILTER', '(', '?y', '>=', '1.5', '&&', '?z', '!=', 'St._Louis', '.',
+     ')']
+    >>> tokenize("SELECT ?x WHERE {?x p ?y.?y q o} ORDER BY DESC(?x)")
+    ... # doctest: +NORMALIZE_WHITESPACE
+    ['SELECT', '?x', 'WHERE', '{', '?x', 'p', '?y', '.', '?y', 'q', 'o',
+     '}', 'ORDER', 'BY', 'DESC', '(', '?x', ')']
+    """
+    return _TOKEN.findall(sparql)
+
+
+def parse(sparql: str) -> Query:
+    """
+
+    Parses the given SPARQL query into its abstract syntax tree, with a
+    recursive descent parser over the tokens of the query. Supports
+    queries of the form
+
+        SELECT [DISTINCT] ?var ... [(COUNT([DISTINCT] ?var | *) AS ?var)]
+        [WHERE] { triple . triple . FILTER(?var op term && ...) ... }
+        [GROUP BY ?var ...] [ORDER BY ASC(?var) | DESC(?var) | ?var ...]
+        [LIMIT n] [OFFSET n]
+
+    where keywords are case-insensitive, the terms of a triple are
+    variables, IRIs in angle brackets, string literals in double quotes
+    (which may contain spaces and dots, and are parsed into a Literal
+    of their unquoted text) or bare words, and op is one of =, !=, <,
+    <=, > or >=. Raises a ValueError if the query is invalid.
+
+    As a separate optimization, a WHERE clause with only triples of
+    variables, words and IRIs, separated by dots, is split into its
+    triples with str.split instead of tokenize, which is several times
+    faster for large generated queries (see benchmark). It only takes
+    clauses whose terms tokenize splits the same way, and any other
+    clause falls back to the tokens, so both give the same query:
+
+    >>> from_tokens = lambda sparql: _Parser(tokenize(sparql)).parse_query()
+    >>> all(parse(sparql) == from_tokens(sparql) for sparql in [
+    ...     generate_query(3),
+    ...     "SELECT ?x WHERE { ?x <p> <o> . ?x q ?y . }",
+    ...     'SELECT ?x WHERE { ?x <p> "o" . ?x q ?y FILTER(?y > 2) }',
+    ...     "SELECT ?x WHERE { ?x <a_b> o }"
+    ... ])
+    True
+    >>> parse("SELECT ?x WHERE { ?x <a b> o }")
+    Traceback (most recent call last):
+     ...
+    ValueError: expected a term at token 5, got '<'
+
+    >>> parse(
+    ...     "SELECT ?x ?y WHERE {"
+    ...     "?x pred_1 some_obj . "
+    ...     "?y pred_2 ?z "
+    ...     "} ORDER BY DESC(?x) ?y LIMIT 25 OFFSET 50"
+    ... ) # doctest: +NORMALIZE_WHITESPACE
+    Query(variables=['?x', '?y'], triples=[('?x', 'pred_1', 'some_obj'),
+     ('?y', 'pred_2', '?z')], order_by=[('?x', False), ('?y', True)],
+     limit=25, offset=50)
+    >>> parse(
+    ...     'select distinct ?x { ?x name "St. Louis" . '
+    ...     '?x born ?y FILTER(?y >= 1900 && ?y < 2000) }'
+    ... ) # doctest: +NORMALIZE_WHITESPACE
+    Query(variables=['?x'], triples=[('?x', 'name',
+     Literal('St. Louis')), ('?x', 'born', '?y')],
+     filters=[('?y', '>=', '1900'), ('?y', '<', '2000')], distinct=True)
+    >>> parse('SELECT ?x WHERE { ?x name "" . ?x p ?y FILTER(?y != "?y") }')
+    ... # doctest: +NORMALIZE_WHITESPACE
+    Query(variables=['?x'], triples=[('?x', 'name', Literal('')),
+     ('?x', 'p', '?y')], filters=[('?y', '!=', Literal('?y'))])
+    >>> parse('SELECT ?x WHERE { ?x p ?y FILTER(?y<Z&&?y>A) }').filters
+    [('?y', '<', 'Z'), ('?y', '>', 'A')]
+    >>> parse(
+    ...     "SELECT ?p (COUNT(?x) AS ?n) WHERE { ?x ?p ?y } "
+    ...     "GROUP BY ?p ORDER BY DESC(?n)"
+    ... ) # doctest: +NORMALIZE_WHITESPACE
+    Query(variables=['?p', '?n'], triples=[('?x', '?p', '?y')],
+     count=('?n', '?x', False), group_by=['?p'], order_by=[('?n', False)])
+    >>> parse("SELECT ?x WHERE { ?x p }")
+    Traceback (most recent call last):
+     ...
+    ValueError: expected a term at token 6, got '}'
+    """
+    # fast path for a WHERE clause with only triples of words, variables
+    # and IRIs, separated by dots, which is split as a whole
+    start = sparql.find("{")
+    end = sparql.find("}", start)
+    block = sparql[start + 1:end]
+    if 0 <= start < end \
+            and not any(char in block for char in _NOT_IN_TRIPLES):
+        terms = block.split()
+        dots = terms[3::4]
+        if len(terms) % 4 in (0, 3) \
+                and dots.count(".") == block.count(".") == len(dots) \
+                and ("<" not in block and ">" not in block
+                     or _only_iris(terms)):
+            triples = list(zip(terms[0::4], terms[1::4], terms[2::4]))
+            tokens = tokenize(sparql[:start + 1]) + tokenize(sparql[end:])
+            return _Parser(tokens, triples).parse_query()
+    return _Parser(tokenize(sparql)).parse_query()
+
+
+def _only_iris(terms: list[str]) -> bool:
+    # whether each of the terms with a < or > is a single IRI token,
+    # with the same pattern as tokenize, so that an IRI with a space
+    # like <a b>, which tokenize does not take as one, is not split
+    return all(
+        _IRI.fullmatch(term) for term in terms if "<" in term or ">" in term
+    )
+
+
+class _Parser:
+    # recursive descent parser over the tokens of a query,
+    # with one method per rule of the grammar in parse
+
+    def __init__(
+        self,
+        tokens: list[str],
+        triples: list[Triple] | None = None
+    ) -> None:
+        self.tokens = tokens
+        self.pos = 0
+        # the triples of the WHERE clause, if already split off by parse
+        self.triples = triples or []
+
+    def peek(self) -> str:
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else ""
+
+    def error(self, expected: str) -> ValueError:
+        token = self.peek()
+        got = repr(token) if token else "the end of the query"
+        return ValueError(
+            f"expected {expected} at token {self.pos}, got {got}"
+        )
+
+    def accept(self, token: str) -> bool:
+        # consumes the next token if it is the given
+        # token (keywords in any case)
+        if self.peek().upper() == token:
+            self.pos += 1
+            return True
+        return False
+
+    def expect(self, token: str) -> None:
+        if not self.accept(token):
+            raise self.error(repr(token))
+
+    def variable(self) -> str:
+        token = self.peek()
+        if len(token) < 2 or token[0] != "?":
+            raise self.error("a variable")
+        self.pos += 1
+        return token
+
+    def term(self) -> str:
+        token = self.peek()
+        if not token or token in _NOT_TERM:
+            raise self.error("a term")
+        self.pos += 1
+        if token[0] == "\"":
+            return Literal(re.sub(r"\\(.)", r"\1", token[1:-1]))
+        return token
+
+    def integer(self) -> int:
+        token = self.peek()
+        if not token.isdigit():
+            raise self.error("a non-negative integer")
+        self.pos += 1
+        return int(token)
+
+    def parse_query(self) -> Query:
+        self.expect("SELECT")
+        query = Query([], [])
+        query.distinct = self.accept("DISTINCT")
+        self.parse_select(query)
+        self.accept("WHERE")
+        self.parse_where(query)
+        if self.accept("GROUP"):
+            self.expect("BY")
+            query.group_by.append(self.variable())
+            while self.peek().startswith("?"):
+                query.group_by.append(self.variable())
+        if self.accept("ORDER"):
+            self.expect("BY")
+            query.order_by.append(self.parse_order_key())
+            while self.peek().upper() in ("ASC", "DESC") \
+                    or self.peek().startswith("?"):
+                query.order_by.append(self.parse_order_key())
+        # LIMIT and OFFSET in any order
+        for _ in range(2):
+            if query.limit is None and self.accept("LIMIT"):
+                query.limit = self.integer()
+            elif query.offset is None and self.accept("OFFSET"):
+                query.offset = self.integer()
+        if self.pos < len(self.tokens):
+            raise self.error("the end of the query")
+        _check(query)
+        return query
+
+    def parse_select(self, query: Query) -> None:
+        while True:
+            if self.peek().startswith("?"):
+                query.variables.append(self.variable())
+            elif self.accept("("):
+                if query.count is not None:
+                    raise self.error("only one COUNT")
+                self.expect("COUNT")
+                self.expect("(")
+                distinct = self.accept("DISTINCT")
+                counted = None if self.accept("*") else self.variable()
+                self.expect(")")
+                self.expect("AS")
+                variable = self.variable()
+                self.expect(")")
+                query.count = (variable, counted, distinct)
+                query.variables.append(variable)
+            else:
+                break
+        if not query.variables:
+            raise self.error("a variable")
+
+    def parse_where(self, query: Query) -> None:
+        self.expect("{")
+        query.triples = self.triples
+        while not self.accept("}"):
+            if self.peek().upper() == "FILTER" \
+                    and self.tokens[self.pos + 1:self.pos + 2] == ["("]:
+                self.pos += 1
+                self.expect("(")
+                query.filters.append(self.parse_comparison())
+                while self.accept("&&"):
+                    query.filters.append(self.parse_comparison())
+                self.expect(")")
+            else:
+                query.triples.append((self.term(), self.term(), self.term()))
+            self.accept(".")
+        if not query.triples:
+            raise ValueError("expected at least one triple")
+
+    def parse_comparison(self) -> Filter:
+        left = self.term()
+        op = self.peek()
+        if op not in COMPARISONS:
+            raise self.error("a comparison operator")
+        self.pos += 1
+        return left, op, self.term()
+
+    def parse_order_key(self) -> tuple[str, bool]:
+        if self.peek().startswith("?"):
+            return self.variable(), True
+        asc = self.accept("ASC")
+        if not asc:
+            self.expect("DESC")
+        self.expect("(")
+        variable = self.variable()
+        self.expect(")")
+        return variable, asc
+
+
+def _check(query: Query) -> None:
+    # checks the variables of a parsed query
+    if query.count is not None:
+        if _occurs(query.count[0], query.triples):
+            raise ValueError(f"cannot count as {query.count[0]}, in triples")
+        counted = query.count[1]
+        if counted is not None and not _occurs(counted, query.triples):
+            raise ValueError(f"cannot count {counted}, not in triples")
+        for var in query.variables:
+            if var != query.count[0] and var not in query.group_by:
+                raise ValueError(f"{var} must be grouped by to be selected")
+    elif query.group_by:
+        raise ValueError("GROUP BY needs a COUNT")
+    for var in query.group_by:
+        if not _occurs(var, query.triples):
+            raise ValueError(f"cannot group by {var}, not in triples")
+    for var, _ in query.order_by:
+        if not (query.count is not None and var == query.count[0]
+                or _occurs(var, query.triples)):
+            raise ValueError(f"cannot order by {var}, not in triples")
+    for left, _, right in query.filters:
+        for term in (left, right):
+            if is_variable(term) and not _occurs(term, query.triples):
+                raise ValueError(f"cannot filter by {term}, not in triples")
+
+
+def _occurs(variable: str, triples: list[Triple]) -> bool:
+    # whether the variable occurs in one of the triples, without
+    # a set of all their terms, as there are only few to check
+    # (literals never compare equal to a variable)
+    return variable in chain.from_iterable(triples)
+
+
+def parse_sparql_by_search(
+    sparql: str
+) -> tuple[list[str], list[Triple], tuple[str, bool] | None, int | None]:
+    """
+
+    The previous parser of SPARQL.parse_sparql, which finds the parts
+    of a query by searching its lowercased text and splitting it, kept
+    as the baseline of the benchmark. Returns a tuple of (variables,
+    triples, order by, limit).
+
+    """
+    sparql = " ".join(line.strip() for line in sparql.splitlines())
+    sparqll = sparql.lower()
+    select_start = sparqll.find("select ") + 7
+    select_end = sparqll.find(" where", select_start)
+    variables = sparql[select_start:select_end].split()
+    where_start = sparqll.find("{", select_end) + 1
+    where_end = sparqll.rfind("}", where_start)
+    triples = []
+    for triple_text in sparql[where_start:where_end].split("."):
+        subj, pred, obj = triple_text.strip().split(" ", 2)
+        triples.append((subj, pred, obj))
+    order_by_start = sparqll.find(" order by ", where_end)
+    if order_by_start > 0:
+        search = sparqll[order_by_start + 10:]
+        match = re.search(r"^(asc|desc)\((\?[^\s]+)\)", search)
+        assert match is not None, \
+            f"could not find order by direction or variable in {search}"
+        order_by = (match.group(2).strip(), match.group(1) == "asc")
+        order_by_end = order_by_start + 10 + len(match.group(0))
+    else:
+        order_by = None
+        order_by_end = where_end
+    limit_start = sparqll.find(" limit ", order_by_end)
+    limit = int(sparql[limit_start + 7:].split()[0]) \
+        if limit_start > 0 else None
+    return variables, triples, order_by, limit
+
+
+def generate_query(num_triples: int) -> str:
+    """
+
+    Generates a query with the given number of triples, for benchmarks.
+
+    >>> generate_query(2) # doctest: +NORMALIZE_WHITESPACE
+    'SELECT ?x0 ?y1 WHERE {\\n?x0 predicate_0 ?y0 .\\n?y0 predicate_1 ?y1\\n}
+     ORDER BY ASC(?y1) LIMIT 10'
+    """
+    triples = [
+        f"?{'x' if i == 0 else 'y'}{max(i - 1, 0)} predicate_{i} ?y{i}"
+        for i in range(num_triples)
+    ]
+    return (
+        f"SELECT ?x0 ?y{num_triples - 1} WHERE {{\n"
+        + " .\n".join(triples)
+        + f"\n}} ORDER BY ASC(?y{num_triples - 1}) LIMIT 10"
+    )
+
+
+def benchmark(num_triples: int, repeats: int) -> dict[str, float]:
+    """
+
+    Returns the average time in milliseconds to parse a generated query
+    with the given number of triples (see generate_query), with parse
+    (which splits its WHERE clause with str.split), with
+    parse_sparql_by_search, and with parse for the same query with a
+    string literal, which goes through tokenize.
+
+    """
+    sparql = generate_query(num_triples)
+    assert parse(sparql).triples == parse_sparql_by_search(sparql)[1]
+    times = {}
+    for name, func, query in [
+        ("parse", parse, sparql),
+        ("parse_sparql_by_search", parse_sparql_by_search, sparql),
+        ("parse by tokens", parse, sparql.replace("{\n?x0", '{\n"x0"'))
+    ]:
+        start = time.perf_counter()
+        for _ in range(repeats):
+            func(query)
+        times[name] = 1000 * (time.perf_counter() - start) / repeats
+    return times
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-t",
+        "--triples",
+        type=int,
+        nargs="+",
+        default=[10, 100, 1000, 10000],
+        help="numbers of triples of the generated queries"
+    )
+    parser.add_argument(
+        "-r",
+        "--repeats",
+        type=int,
+        default=20,
+        help="number of times to parse each query"
+    )
+    return parser.parse_args()
+
+
+def main(args: argparse.Namespace) -> None:
+    """
+
+    Benchmarks the parser on generated queries of different sizes.
+
+    """
+    for num_triples in args.triples:
+        times = benchmark(num_triples, args.repeats)
+        print(
+            f"{num_triples:>6} triples: "
+            + ", ".join(f"{name} {ms:.3f}ms" for name, ms in times.items())
+        )
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -8,27 +8,346 @@ Natalie Prange <prange@cs.uni-freiburg.de>,
 Sebastian Walter <swalter@cs.uni-freiburg.de>
 """
 
-import re
+import os
 import sqlite3
+import threading
+import time
+import warnings
+from collections import OrderedDict
+from typing import Collection, Iterator
+from urllib.parse import quote
 
+from sparql_parser import Query, Triple, is_variable, parse
 
-Triple = tuple[str, str, str]
+
+# the values of the ? placeholders of an SQL query
+Params = tuple[str, ...]
+# statistics of the triples with a predicate (or of all triples): the
+# number of triples and of distinct subjects and objects
+PredicateStatistics = tuple[int, int, int]
+
+# covering indexes of the wikidata table, for triple patterns with a
+# bound predicate and object, predicate and subject, subject, or object
+INDEXES = {
+    "wikidata_pos": ("predicate", "object", "subject"),
+    "wikidata_pso": ("predicate", "subject", "object"),
+    "wikidata_spo": ("subject", "predicate", "object"),
+    "wikidata_osp": ("object", "subject", "predicate")
+}
+# the same indexes of the triples table of the integer-encoded schema,
+# where the terms table maps the ids of the terms to their text
+ENCODED_INDEXES = {
+    name.replace("wikidata", "triples"): columns
+    for name, columns in INDEXES.items()
+}
+
+
+class ConnectionPool:
+    """
+
+    A pool of read-only SQLite3 connections, with one connection per
+    thread and database, which is opened on first use and then reused
+    for all queries of the thread, so that connecting, reading the
+    schema and compiling statements is not repeated for every query.
+
+    The connections are tuned for reading: the database file is
+    memory mapped (up to mmap_size bytes) and each connection caches
+    up to cache_size bytes of pages and the compiled statements of the
+    last cached_statements distinct SQL texts (sqlite3 keeps them in
+    an LRU cache per connection).
+
+    >>> pool = ConnectionPool()
+    >>> connection = pool.connection("example.db")
+    >>> connection is pool.connection("example.db")
+    True
+    >>> connection.execute("SELECT COUNT(*) FROM wikidata").fetchone()
+    (919,)
+    >>> connection.execute("DELETE FROM wikidata")
+    Traceback (most recent call last):
+     ...
+    sqlite3.OperationalError: attempt to write a readonly database
+    >>> pool.close()
+    """
+
+    def __init__(
+        self,
+        mmap_size: int = 256 * 1024 * 1024,
+        cache_size: int = 64 * 1024 * 1024,
+        cached_statements: int = 256
+    ) -> None:
+        self.mmap_size = mmap_size
+        self.cache_size = cache_size
+        self.cached_statements = cached_statements
+        # the connections of the current thread, by database
+        self._local = threading.local()
+        # all connections of all threads, for close
+        self._connections: list[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+
+    def connection(self, db_name: str) -> sqlite3.Connection:
+        """
+
+        Returns the connection of the current thread to
+        the given database, opens it if necessary.
+
+        """
+        connections = getattr(self._local, "connections", None)
+        if connections is None:
+            connections = self._local.connections = {}
+        connection = connections.get(db_name)
+        if connection is not None:
+            return connection
+
+        # read-only mode needs the database to exist, unlike connect
+        if not os.path.exists(db_name):
+            raise FileNotFoundError(f"database {db_name} does not exist")
+        connection = sqlite3.connect(
+            f"file:{quote(os.path.abspath(db_name))}?mode=ro",
+            uri=True,
+            cached_statements=self.cached_statements,
+            # close may be called from another thread
+            check_same_thread=False
+        )
+        connection.execute(f"PRAGMA mmap_size = {self.mmap_size}")
+        # a negative cache size is in kibibytes instead of pages
+        connection.execute(f"PRAGMA cache_size = -{self.cache_size // 1024}")
+        connection.execute("PRAGMA query_only = ON")
+        connections[db_name] = connection
+        with self._lock:
+            self._connections.append(connection)
+        return connection
+
+    def close(self) -> None:
+        """
+
+        Closes all connections of all threads. Must not be
+        called while other threads are still using them.
+
+        """
+        with self._lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections = []
+        # connections of other threads are replaced on their next use
+        self._local = threading.local()
+
+
+class ResultCache:
+    """
+
+    A cache of the result rows of SPARQL queries by database and
+    (canonical) query, with LRU eviction beyond max_entries entries or
+    max_bytes estimated bytes of rows. Entries expire ttl seconds after
+    they were added, and all entries of a database are invalidated when
+    the modification time of its file changes. Also records the number
+    of hits and misses and their latencies, for stats.
+
+    >>> cache = ResultCache(max_entries=2)
+    >>> cache.get("example.db", "q1") is None
+    True
+    >>> cache.put("example.db", "q1", [("a", "b")])
+    >>> cache.put("example.db", "q2", [])
+    >>> cache.get("example.db", "q1")
+    [('a', 'b')]
+    >>> cache.put("example.db", "q3", [])
+    >>> cache.get("example.db", "q2") is None
+    True
+    >>> stats = cache.stats()
+    >>> stats["hits"], stats["misses"], stats["evictions"], stats["entries"]
+    (1, 2, 1, 2)
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        max_bytes: int = 64 * 1024 * 1024,
+        ttl: float = 600.0
+    ) -> None:
+        assert max_entries > 0, "max entries must be positive"
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # map from (database, query) to (expiry time, size, rows),
+        # from least to most recently used
+        self._entries: OrderedDict[
+            tuple[str, str],
+            tuple[float, int, list[tuple[str, ...]]]
+        ] = OrderedDict()
+        # the last seen modification time of each database file
+        self._mtimes: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.hit_seconds = 0.0
+        self.miss_seconds = 0.0
+
+    def get(
+        self,
+        db_name: str,
+        query: str
+    ) -> list[tuple[str, ...]] | None:
+        """
+
+        Returns the cached rows of the given query on the given
+        database, or None (and counts a miss) if there are none.
+
+        """
+        mtime = os.stat(db_name).st_mtime_ns
+        with self._lock:
+            if self._mtimes.get(db_name, mtime) != mtime:
+                for key in [
+                    key for key in self._entries if key[0] == db_name
+                ]:
+                    self._remove(key)
+                    self.invalidations += 1
+            self._mtimes[db_name] = mtime
+
+            entry = self._entries.get((db_name, query))
+            if entry is not None and entry[0] < time.monotonic():
+                self._remove((db_name, query))
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end((db_name, query))
+            self.hits += 1
+            return entry[2]
+
+    def put(
+        self,
+        db_name: str,
+        query: str,
+        rows: list[tuple[str, ...]]
+    ) -> None:
+        """
+
+        Caches the rows of the given query on the given database, unless
+        they are larger than max_bytes, evicts the least recently used
+        entries if necessary.
+
+        """
+        size = _rows_size(rows)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if (db_name, query) in self._entries:
+                self._remove((db_name, query))
+            self._entries[(db_name, query)] = \
+                (time.monotonic() + self.ttl, size, rows)
+            self.bytes += size
+            while len(self._entries) > self.max_entries \
+                    or self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def record(self, hit: bool, seconds: float) -> None:
+        """
+
+        Records the latency of a query answered from
+        the cache (hit) or from the database.
+
+        """
+        with self._lock:
+            if hit:
+                self.hit_seconds += seconds
+            else:
+                self.miss_seconds += seconds
+
+    def _remove(self, key: tuple[str, str]) -> None:
+        _, size, _ = self._entries.pop(key)
+        self.bytes -= size
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict[str, int | float]:
+        """
+
+        Returns the statistics of the cache: the number of hits,
+        misses, evictions, expirations and invalidations, the hit rate,
+        the number of entries and their estimated bytes, and the
+        average latencies of hits and misses in milliseconds.
+
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "avg_hit_ms": 1000 * self.hit_seconds / self.hits
+                if self.hits else 0.0,
+                "avg_miss_ms": 1000 * self.miss_seconds / self.misses
+                if self.misses else 0.0
+            }
 
 
 class SPARQL:
     """ A simple SPARQL engine for a SQL backend. """
 
-    def parse_sparql(
+    def __init__(
         self,
-        sparql: str
-    ) -> tuple[list[str], list[Triple], tuple[str, bool] | None, int | None]:
+        on_full_scan: str = "ignore",
+        translation_cache_size: int = 256,
+        result_cache: ResultCache | None = None,
+        encoded: bool = False
+    ) -> None:
         """
 
-        Parses a SPARQL query into its components, a tuple of
-        (variables, triples, order by, limit).
+        Creates a SPARQL engine. If on_full_scan is "warn" or "fail",
+        process_sql_query checks the plan of each query and warns or
+        raises a ValueError if it would scan a whole table of triples
+        (see check_query_plan).
+
+        Queries run on the read-only connections of a ConnectionPool,
+        and the translations of the last translation_cache_size
+        distinct SPARQL queries are kept in an LRU cache. If a result
+        cache is given, process_sparql_query and stream_sparql_query
+        cache the results of the queries in it.
 
-        ORDER BY and LIMIT clauses are optional, but LIMIT
-        should always come after ORDER BY if both are specified.
+        If encoded, the queries are translated for the integer-encoded
+        schema (see bulk_load.py) instead of the wikidata table: the
+        triples table with the ids of the terms, which are the joined
+        columns, and the terms table with the text of each id. The
+        constants are translated to their ids once per query, and only
+        the terms of the selected variables are looked up, so the joins
+        compare integers, which is faster than comparing strings, and
+        the database is about half the size.
+
+        """
+        assert on_full_scan in {"ignore", "warn", "fail"}, \
+            f"invalid value {on_full_scan} for on_full_scan"
+        self.on_full_scan = on_full_scan
+        self.pool = ConnectionPool()
+        self.translation_cache_size = translation_cache_size
+        self._translations: OrderedDict[str, tuple[str, Params]] = \
+            OrderedDict()
+        self._translations_lock = threading.Lock()
+        self.result_cache = result_cache
+        self.encoded = encoded
+        # statistics by predicate (None for all triples), if loaded,
+        # used to order the triple patterns in sparql_to_sql
+        self.statistics: dict[str | None, PredicateStatistics] | None = None
+
+    def parse_sparql(self, sparql: str) -> Query:
+        """
+
+        Parses a SPARQL query into its abstract syntax tree, see
+        sparql_parser.parse for the supported syntax. Raises a
+        ValueError if the query is invalid.
 
         >>> engine = SPARQL()
         >>> engine.parse_sparql(
@@ -37,80 +356,91 @@ class SPARQL:
         ...     "?y pred_2 ?z "
         ...     "}"
         ... ) # doctest: +NORMALIZE_WHITESPACE
-        (['?x', '?y'], [('?x', 'pred_1', 'some_obj'),
-        ('?y', 'pred_2', '?z')], None, None)
-        >>> engine.parse_sparql(
-        ...     "SELECT ?x ?y WHERE {"
-        ...     "?x pred_1 some_obj . "
-        ...     "?y pred_2 ?z "
-        ...     "} ORDER BY DESC(?x)"
-        ... ) # doctest: +NORMALIZE_WHITESPACE
-        (['?x', '?y'], [('?x', 'pred_1', 'some_obj'),
-        ('?y', 'pred_2', '?z')], ('?x', False), None)
+        Query(variables=['?x', '?y'], triples=[('?x', 'pred_1', 'some_obj'),
+         ('?y', 'pred_2', '?z')])
         >>> engine.parse_sparql(
         ...     "SELECT ?x ?y WHERE {"
         ...     "?x pred_1 some_obj . "
         ...     "?y pred_2 ?z "
-        ...     "} ORDER BY ASC(?x)"
+        ...     "} ORDER BY ASC(?x) DESC(?y) LIMIT 25 OFFSET 50"
         ... ) # doctest: +NORMALIZE_WHITESPACE
-        (['?x', '?y'], [('?x', 'pred_1', 'some_obj'),
-        ('?y', 'pred_2', '?z')], ('?x', True), None)
-        >>> engine.parse_sparql(
-        ...     "SELECT ?x ?y WHERE {"
-        ...     "?x pred_1 some_obj . "
-        ...     "?y pred_2 ?z "
-        ...     "} ORDER BY ASC(?x) LIMIT 25"
+        Query(variables=['?x', '?y'], triples=[('?x', 'pred_1', 'some_obj'),
+         ('?y', 'pred_2', '?z')], order_by=[('?x', True), ('?y', False)],
+         limit=25, offset=50)
+        """
+        return parse(sparql)
+
+    def canonicalize(self, sparql: str) -> str:
+        """
+
+        Returns a canonical form of the given SPARQL query, which is the
+        same for queries that differ only in the names of the variables
+        or the order of the triples and filters: the triples are sorted
+        (first with all variables alike), the variables renamed to ?v0,
+        ?v1, ... in the order of their first occurrence in the sorted
+        triples (and the variable of a COUNT last), and the triples
+        sorted again. Variables that are not in any triple are dropped
+        from the selected variables, like in sparql_to_sql.
+
+        >>> engine = SPARQL()
+        >>> engine.canonicalize(
+        ...     "SELECT ?x ?y WHERE { ?x spouse ?y . ?x occupation actor }"
         ... ) # doctest: +NORMALIZE_WHITESPACE
-        (['?x', '?y'], [('?x', 'pred_1', 'some_obj'),
-        ('?y', 'pred_2', '?z')], ('?x', True), 25)
-        """
-        # format the SPARQL query into a single line for parsing
-        sparql = " ".join(line.strip() for line in sparql.splitlines())
-
-        # transform all letters to lower cases.
-        sparqll = sparql.lower()
-
-        # find all variables in the SPARQL between the SELECT and WHERE clause.
-        select_start = sparqll.find("select ") + 7
-        select_end = sparqll.find(" where", select_start)
-        variables = sparql[select_start:select_end].split()
-
-        # find all triples between "WHERE {" and "}"
-        where_start = sparqll.find("{", select_end) + 1
-        where_end = sparqll.rfind("}", where_start)
-        where_text = sparql[where_start:where_end]
-        triple_texts = where_text.split(".")
-        triples = []
-        for triple_text in triple_texts:
-            subj, pred, obj = triple_text.strip().split(" ", 2)
-            triples.append((subj, pred, obj))
-
-        # find the (optional) ORDER BY clause
-        order_by_start = sparqll.find(" order by ", where_end)
-        if order_by_start > 0:
-            search = sparqll[order_by_start + 10:]
-            match = re.search(r"^(asc|desc)\((\?[^\s]+)\)", search)
-            assert match is not None, \
-                f"could not find order by direction or variable in {search}"
-            order_by = (match.group(2).strip(), match.group(1) == "asc")
-            order_by_end = order_by_start + 10 + len(match.group(0))
-        else:
-            order_by = None
-            order_by_end = where_end
+        "Query(variables=['?v0', '?v1'], triples=[('?v0', 'occupation',
+         'actor'), ('?v0', 'spouse', '?v1')])"
+        >>> engine.canonicalize(
+        ...     "SELECT ?a ?b ?c WHERE { ?a occupation actor . ?a spouse ?b }"
+        ... ) == engine.canonicalize(
+        ...     "SELECT ?x ?y WHERE { ?x spouse ?y . ?x occupation actor }"
+        ... )
+        True
+        """
+        query = self.parse_sparql(sparql)
 
-        # find the (optional) LIMIT clause
-        limit_start = sparqll.find(" limit ", order_by_end)
-        if limit_start > 0:
-            limit = int(sparql[limit_start + 7:].split()[0])
-        else:
-            limit = None
+        def shape(triple: Triple) -> Triple:
+            return tuple(  # type: ignore
+                "?" if is_variable(term) else term for term in triple
+            )
 
-        return variables, triples, order_by, limit
+        names: dict[str, str] = {}
+        for triple in sorted(query.triples, key=shape):
+            for term in triple:
+                if is_variable(term) and term not in names:
+                    names[term] = f"?v{len(names)}"
+        count = query.count
+        if count is not None:
+            names[count[0]] = f"?v{len(names)}"
+            counted = None if count[1] is None else names[count[1]]
+            count = (names[count[0]], counted, count[2])
+        return repr(Query(
+            [names[var] for var in query.result_variables()],
+            sorted(
+                tuple(  # type: ignore
+                    names.get(term, term) for term in triple
+                )
+                for triple in query.triples
+            ),
+            sorted(
+                (names.get(left, left), op, names.get(right, right))
+                for left, op, right in query.filters
+            ),
+            query.distinct,
+            count,
+            [names[var] for var in query.group_by],
+            [(names[var], asc) for var, asc in query.order_by],
+            query.limit,
+            query.offset
+        ))
 
-    def sparql_to_sql(self, sparql: str) -> str:
+    def sparql_to_sql(self, sparql: str) -> tuple[str, Params]:
         """
 
         Translates the given SPARQL query to a corresponding SQL query.
+        Returns a tuple of (SQL query, parameters): the constants of
+        the SPARQL query are not part of the SQL query, they are bound
+        to its ? placeholders. Thus no constant can break (or inject
+        code into) the SQL query, and SQLite can reuse the compiled
+        statement for all queries of the same shape.
 
         PLEASE NOTE: there are many ways to express the same SPARQL query in
         SQL. Stick to the implementation advice given in the lecture. Thus, in
@@ -131,94 +461,354 @@ class SPARQL:
         ...     "?y place_of_birth ?z "
         ...     "}"
         ... ) # doctest: +NORMALIZE_WHITESPACE
-        'SELECT t0.subject, \
-                t2.object \
-         FROM   wikidata as t0, \
-                wikidata as t1, \
-                wikidata as t2, \
-                wikidata as t3, \
-                wikidata as t4 \
-         WHERE  t0.object="politician" \
-                AND t0.predicate="occupation" \
-                AND t1.object="Germany" \
-                AND t1.predicate="country_of_citizenship" \
-                AND t2.predicate="spouse" \
-                AND t3.predicate="place_of_birth" \
-                AND t3.subject=t0.subject \
-                AND t3.subject=t1.subject \
-                AND t3.subject=t2.subject \
-                AND t4.object=t3.object \
-                AND t4.predicate="place_of_birth" \
-                AND t4.subject=t2.object;'
+        ('SELECT t0.subject, \
+                 t2.object \
+          FROM   wikidata as t0, \
+                 wikidata as t1, \
+                 wikidata as t2, \
+                 wikidata as t3, \
+                 wikidata as t4 \
+          WHERE  t0.object=? \
+                 AND t0.predicate=? \
+                 AND t1.object=? \
+                 AND t1.predicate=? \
+                 AND t2.predicate=? \
+                 AND t3.predicate=? \
+                 AND t3.subject=t0.subject \
+                 AND t3.subject=t1.subject \
+                 AND t3.subject=t2.subject \
+                 AND t4.object=t3.object \
+                 AND t4.predicate=? \
+                 AND t4.subject=t2.object;', \
+         ('politician', 'occupation', 'Germany', 'country_of_citizenship', \
+          'spouse', 'place_of_birth', 'place_of_birth'))
+        >>> engine.sparql_to_sql(
+        ...     "SELECT ?x WHERE { ?x title \\"'); DROP TABLE wikidata;\\" }"
+        ... )
+        ('SELECT t0.subject FROM wikidata as t0 WHERE t0.object=? \
+AND t0.predicate=?;', ("'); DROP TABLE wikidata;", 'title'))
+        >>> engine.sparql_to_sql(
+        ...     'SELECT ?x WHERE { ?x ?y "?y" . ?x name "" }'
+        ... ) # doctest: +NORMALIZE_WHITESPACE
+        ('SELECT t0.subject FROM wikidata as t0, wikidata as t1 \
+          WHERE t0.object=? AND t1.object=? AND t1.predicate=? \
+          AND t1.subject=t0.subject;', ('?y', '', 'name'))
+        >>> engine.sparql_to_sql(
+        ...     "SELECT ?x (COUNT(DISTINCT ?y) AS ?n) WHERE { "
+        ...     "?x spouse ?y FILTER(?y != Brad_Pitt) } "
+        ...     "GROUP BY ?x ORDER BY DESC(?n) ?x"
+        ... ) # doctest: +NORMALIZE_WHITESPACE
+        ('SELECT t0.subject, \
+                 COUNT(DISTINCT t0.object) AS n \
+          FROM   wikidata as t0 \
+          WHERE  t0.object!=? \
+                 AND t0.predicate=? \
+          GROUP BY t0.subject \
+          ORDER BY n DESC, t0.subject ASC;', ('Brad_Pitt', 'spouse'))
+        >>> SPARQL(encoded=True).sparql_to_sql(
+        ...     "SELECT ?x WHERE { ?x spouse Brad_Pitt }"
+        ... ) # doctest: +NORMALIZE_WHITESPACE
+        ('SELECT (SELECT text FROM terms WHERE id=t0.subject) \
+          FROM   triples as t0 \
+          WHERE  t0.object=(SELECT id FROM terms WHERE text=?) \
+                 AND t0.predicate=(SELECT id FROM terms WHERE text=?);', \
+         ('Brad_Pitt', 'spouse'))
         """
-        # parse the SPARQL query into its components, might raise an exception
-        # if the query is invalid
-        variables, triples, order_by, limit = self.parse_sparql(sparql)
+        with self._translations_lock:
+            translation = self._translations.get(sparql)
+            if translation is not None:
+                self._translations.move_to_end(sparql)
+                return translation
+
+        translation = self._sparql_to_sql(sparql)
+        with self._translations_lock:
+            self._translations[sparql] = translation
+            while len(self._translations) > self.translation_cache_size:
+                self._translations.popitem(last=False)
+        return translation
+
+    def _sparql_to_sql(self, sparql: str) -> tuple[str, Params]:
+        # translates a SPARQL query like sparql_to_sql, without the cache
+
+        # parse the SPARQL query into its abstract syntax tree, might raise
+        # an exception if the query is invalid
+        query = self.parse_sparql(sparql)
+        triples = query.triples
+        if self.statistics is not None:
+            triples = self.plan_triples(triples)
+
+        # in the integer-encoded schema, a constant is replaced by its id
+        if self.encoded:
+            table, constant = "triples", "(SELECT id FROM terms WHERE text=?)"
+        else:
+            table, constant = "wikidata", "?"
 
         # plan the SQL query
         var_map: dict[str, list[str]] = {}
         tables = []
-        wheres = []
+        # conditions with the constants bound to their placeholders
+        wheres: list[tuple[str, Params]] = []
         for i, (subj, pred, obj) in enumerate(triples):
             tables.append(f"t{i}")
 
             # process the subject
-            if subj[0] == "?":
+            if is_variable(subj):
                 if subj not in var_map:
                     var_map[subj] = []
                 var_map[subj].append(f"{tables[-1]}.subject")
             else:
-                wheres.append(f"{tables[-1]}.subject=\"{subj}\"")
+                wheres.append((
+                    f"{tables[-1]}.subject={constant}",
+                    (str(subj),)
+                ))
 
             # process the predicate
-            if pred[0] == "?":
+            if is_variable(pred):
                 if pred not in var_map:
                     var_map[pred] = []
                 var_map[pred].append(f"{tables[-1]}.predicate")
             else:
-                wheres.append(f"{tables[-1]}.predicate=\"{pred}\"")
+                wheres.append((
+                    f"{tables[-1]}.predicate={constant}",
+                    (str(pred),)
+                ))
 
             # process the object
-            if obj[0] == "?":
+            if is_variable(obj):
                 if obj not in var_map:
                     var_map[obj] = []
                 var_map[obj].append(f"{tables[-1]}.object")
             else:
-                wheres.append(f"{tables[-1]}.object=\"{obj}\"")
+                wheres.append((
+                    f"{tables[-1]}.object={constant}",
+                    (str(obj),)
+                ))
 
         # build the elements of the WHERE clause
         for var in var_map:
             var_list = var_map[var]
             for i in range(len(var_list) - 1):
-                wheres.append(f"{var_list[-1]}={var_list[i]}")
+                wheres.append((f"{var_list[-1]}={var_list[i]}", ()))
+        for left, op, right in query.filters:
+            operands = [
+                var_map[term][0] if is_variable(term) else "?"
+                for term in (left, right)
+            ]
+            constants = tuple(
+                str(term) for term in (left, right)
+                if not is_variable(term)
+            )
+            # ids are equal if their terms are, but not ordered like them
+            if self.encoded and (op not in ("=", "!=") or constants):
+                operands = [
+                    operand if operand == "?" else _decode(operand)
+                    for operand in operands
+                ]
+            wheres.append((f"{operands[0]}{op}{operands[1]}", constants))
 
-        # compose the SQL query
-        select_vars = [var_map[var][0] for var in variables if var in var_map]
-        sql = f"SELECT {', '.join(select_vars)}"
-        sql += f" FROM {', '.join([f'wikidata as {t}' for t in tables])}"
+        # compose the SQL query, the COUNT (if any) is named n
+        columns = {var: var_map[var][0] for var in var_map}
+        if query.count is not None:
+            var, counted, distinct = query.count
+            counted_sql = "*" if counted is None else var_map[counted][0]
+            distinct_sql = "DISTINCT " if distinct else ""
+            columns[var] = "n"
+        select_vars = []
+        for var in query.result_variables():
+            if query.count is not None and var == query.count[0]:
+                select_vars.append(f"COUNT({distinct_sql}{counted_sql}) AS n")
+            elif self.encoded:
+                select_vars.append(_decode(columns[var]))
+            else:
+                select_vars.append(columns[var])
+        sql = "SELECT DISTINCT" if query.distinct else "SELECT"
+        sql += f" {', '.join(select_vars)}"
+        # with statistics, the order of the triples is pinned with
+        # CROSS JOIN, which SQLite never reorders
+        join = ", " if self.statistics is None else " CROSS JOIN "
+        sql += f" FROM {join.join([f'{table} as {t}' for t in tables])}"
+        wheres.sort(key=lambda where: where[0])
         if len(wheres) > 0:
-            sql += f" WHERE {' AND '.join(sorted(wheres))}"
-        if order_by is not None:
-            var, asc = order_by
-            sql += f" ORDER BY {var_map[var][0]} {'ASC' if asc else 'DESC'}"
-        if limit is not None:
+            sql += f" WHERE {' AND '.join(where for where, _ in wheres)}"
+        if query.group_by:
+            sql += " GROUP BY " + ", ".join(
+                columns[var] for var in query.group_by
+            )
+        if query.order_by:
+            order_by = [
+                _decode(columns[var])
+                if self.encoded and columns[var] != "n" else columns[var]
+                for var, _ in query.order_by
+            ]
+            sql += " ORDER BY " + ", ".join(
+                f"{column} {'ASC' if asc else 'DESC'}"
+                for column, (_, asc) in zip(order_by, query.order_by)
+            )
+        if query.limit is not None or query.offset is not None:
+            # a negative limit is no limit, which OFFSET needs
+            limit = -1 if query.limit is None else query.limit
             sql += f" LIMIT {limit}"
+        if query.offset is not None:
+            sql += f" OFFSET {query.offset}"
         sql += ";"
+        params = tuple(param for _, params in wheres for param in params)
 
-        return sql
+        return sql, params
+
+    def estimate_size(
+        self,
+        triple: Triple,
+        bound: Collection[str] = ()
+    ) -> float:
+        """
+
+        Estimates the number of triples matching the given triple
+        pattern from the statistics of its predicate, assuming that the
+        subjects and objects are uniformly distributed. Variables in
+        bound are treated like constants (their values are known from
+        the patterns joined before).
+
+        >>> engine = SPARQL()
+        >>> engine.statistics = {"spouse": (18, 16, 16), None: (919, 90, 500)}
+        >>> engine.estimate_size(("?x", "spouse", "?y"))
+        18.0
+        >>> engine.estimate_size(("?x", "spouse", "?y"), {"?x"})
+        1.125
+        >>> engine.estimate_size(("?x", "?p", "Germany"))
+        1.838
+        >>> engine.estimate_size(("?x", "occupation", "?y"))
+        0.0
+        """
+        assert self.statistics is not None, "statistics not loaded"
+        subj, pred, obj = triple
+        if is_variable(pred) and pred not in bound:
+            stats = self.statistics[None]
+        else:
+            stats = self.statistics.get(pred, (0, 1, 1))
+        triples, subjects, objects = stats
+        size = float(triples)
+        if not is_variable(subj) or subj in bound:
+            size /= max(subjects, 1)
+        if not is_variable(obj) or obj in bound:
+            size /= max(objects, 1)
+        return size
+
+    def plan_triples(self, triples: list[Triple]) -> list[Triple]:
+        """
+
+        Orders the given triple patterns for joining them: greedily
+        picks the pattern with the smallest estimated size (see
+        estimate_size) first, and then always the connected pattern
+        (sharing a variable with the patterns picked so far) with the
+        smallest estimated size given the values of these variables.
+
+        >>> engine = SPARQL()
+        >>> engine.statistics = {
+        ...     "spouse": (18, 16, 16),
+        ...     "occupation": (200, 190, 40),
+        ...     "place_of_birth": (150, 150, 100),
+        ...     None: (919, 90, 500)
+        ... }
+        >>> engine.plan_triples([
+        ...     ("?x", "occupation", "politician"),
+        ...     ("?x", "spouse", "?y"),
+        ...     ("?x", "place_of_birth", "?z"),
+        ...     ("?y", "place_of_birth", "?z")
+        ... ]) # doctest: +NORMALIZE_WHITESPACE
+        [('?x', 'occupation', 'politician'), ('?x', 'place_of_birth', '?z'),
+         ('?x', 'spouse', '?y'), ('?y', 'place_of_birth', '?z')]
+        """
+        remaining = list(triples)
+        planned: list[Triple] = []
+        bound: set[str] = set()
+        while remaining:
+            connected = [
+                triple for triple in remaining
+                if any(term in bound for term in triple)
+            ]
+            triple = min(
+                connected or remaining,
+                key=lambda t: self.estimate_size(t, bound)
+            )
+            remaining.remove(triple)
+            planned.append(triple)
+            bound.update(term for term in triple if is_variable(term))
+        return planned
+
+    def load_statistics(self, db_name: str) -> None:
+        """
+
+        Loads the statistics of the predicates for planning from the
+        predicate_statistics table of the given SQLite3 database
+        (created by prepare_database), or computes them from the
+        wikidata (or triples) table if there is no such table.
+
+        >>> engine = SPARQL()
+        >>> engine.load_statistics("example.db")
+        >>> engine.statistics["spouse"], engine.statistics[None]
+        ((18, 16, 17), (919, 21, 711))
+        >>> sql, params = engine.sparql_to_sql(
+        ...     "SELECT ?x ?y WHERE {"
+        ...     "?x occupation politician . "
+        ...     "?x country_of_citizenship Germany . "
+        ...     "?x spouse ?y . "
+        ...     "?x place_of_birth ?z . "
+        ...     "?y place_of_birth ?z "
+        ...     "}"
+        ... )
+        >>> sql # doctest: +NORMALIZE_WHITESPACE
+        'SELECT t0.subject, \
+                t3.object \
+         FROM   wikidata as t0 \
+                CROSS JOIN wikidata as t1 \
+                CROSS JOIN wikidata as t2 \
+                CROSS JOIN wikidata as t3 \
+                CROSS JOIN wikidata as t4 \
+         WHERE  t0.object=? \
+                AND t0.predicate=? \
+                AND t1.object=? \
+                AND t1.predicate=? \
+                AND t2.predicate=? \
+                AND t3.predicate=? \
+                AND t3.subject=t0.subject \
+                AND t3.subject=t1.subject \
+                AND t3.subject=t2.subject \
+                AND t4.object=t2.object \
+                AND t4.predicate=? \
+                AND t4.subject=t3.object;'
+        >>> params # doctest: +NORMALIZE_WHITESPACE
+        ('politician', 'occupation', 'Germany', 'country_of_citizenship',
+         'place_of_birth', 'spouse', 'place_of_birth')
+        """
+        connection = self.pool.connection(db_name)
+        if "predicate_statistics" in _tables(connection):
+            rows = connection.execute(
+                "SELECT predicate, triples, subjects, objects "
+                "FROM predicate_statistics"
+            ).fetchall()
+        else:
+            rows = _compute_statistics(connection)
+        self.statistics = {
+            pred: (triples, subjects, objects)
+            for pred, triples, subjects, objects in rows
+        }
+        # the order of the triples in the translations has changed
+        with self._translations_lock:
+            self._translations.clear()
 
     def process_sql_query(
         self,
         db_name: str,
-        sql: str
+        sql: str,
+        params: Params = ()
     ) -> list[tuple[str, ...]]:
         """
 
-        Runs the given SQL query against the given instance of a SQLite3
-        database and returns the result rows.
+        Runs the given SQL query with the given parameters against the
+        given instance of a SQLite3 database and returns the result rows.
 
         >>> engine = SPARQL()
-        >>> sql = engine.sparql_to_sql(
+        >>> sql, params = engine.sparql_to_sql(
         ...     "SELECT ?x ?y WHERE {"
         ...     "?x occupation politician . "
         ...     "?x country_of_citizenship Germany . "
@@ -227,7 +817,7 @@ class SPARQL:
         ...     "?y place_of_birth ?z "
         ...     "}"
         ... )
-        >>> sorted(engine.process_sql_query("example.db", sql))
+        >>> sorted(engine.process_sql_query("example.db", sql, params))
         ... # doctest: +NORMALIZE_WHITESPACE
         [('Fritz_Kuhn', 'Waltraud_Ulshöfer'), \
          ('Helmut_Schmidt', 'Loki_Schmidt'), \
@@ -238,7 +828,423 @@ class SPARQL:
          ('Waltraud_Ulshöfer', 'Fritz_Kuhn'), \
          ('Wolfgang_Schäuble', 'Ingeborg_Schäuble')]
         """
+        connection = self.pool.connection(db_name)
+        if self.on_full_scan != "ignore":
+            self._check_query_plan(
+                connection,
+                sql,
+                params,
+                self.on_full_scan == "fail"
+            )
+        cursor = connection.execute(sql, params)
+        try:
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+
+    def stream_sql_query(
+        self,
+        db_name: str,
+        sql: str,
+        params: Params = (),
+        batch_size: int = 1000
+    ) -> Iterator[list[tuple[str, ...]]]:
+        """
+
+        Runs the given SQL query like process_sql_query, but yields the
+        result rows in batches of up to batch_size rows as SQLite
+        produces them, so that the first rows are available before the
+        query is finished and the rows never have to be in memory all
+        at once (unless the query sorts them). The query is started
+        before the first batch is requested, so invalid queries fail
+        when calling this function.
+
+        >>> engine = SPARQL()
+        >>> sql, params = engine.sparql_to_sql(
+        ...     "SELECT ?x ?y WHERE { ?x spouse ?y } "
+        ...     "ORDER BY ASC(?y) LIMIT 5 OFFSET 2"
+        ... )
+        >>> batches = engine.stream_sql_query(
+        ...     "example.db", sql, params, batch_size=2
+        ... )
+        >>> for batch in batches:
+        ...     print([y for x, y in batch])
+        ['Brad_Pitt', 'Emma_Adenauer']
+        ['Fritz_Kuhn', 'Hannelore_Kohl']
+        ['Helmut_Schmidt']
+        """
+        assert batch_size > 0, "batch size must be positive"
+        connection = self.pool.connection(db_name)
+        if self.on_full_scan != "ignore":
+            self._check_query_plan(
+                connection,
+                sql,
+                params,
+                self.on_full_scan == "fail"
+            )
+        cursor = connection.execute(sql, params)
+        return _batches(cursor, batch_size)
+
+    def process_sparql_query(
+        self,
+        db_name: str,
+        sparql: str
+    ) -> list[tuple[str, ...]]:
+        """
+
+        Translates the given SPARQL query to SQL and runs it against the
+        given database, like sparql_to_sql and process_sql_query. With a
+        result cache, the rows are cached by the canonical form of the
+        query (see canonicalize), so equivalent queries share them.
+
+        >>> engine = SPARQL(result_cache=ResultCache())
+        >>> rows = engine.process_sparql_query(
+        ...     "example.db",
+        ...     "SELECT ?x ?y WHERE { ?x spouse ?y . ?x occupation actor }"
+        ... )
+        >>> sorted(rows) # doctest: +NORMALIZE_WHITESPACE
+        [('Brad_Pitt', 'Angelina_Jolie'),
+         ('Vera_Oelschlegel', 'Konrad_Naumann')]
+        >>> rows = engine.process_sparql_query(
+        ...     "example.db",
+        ...     "SELECT ?a ?b WHERE { ?a occupation actor . ?a spouse ?b }"
+        ... )
+        >>> engine.result_cache.hits, engine.result_cache.misses
+        (1, 1)
+        >>> engine.process_sparql_query(
+        ...     "example.db",
+        ...     "SELECT ?x (COUNT(?y) AS ?n) WHERE { ?x award_received ?y } "
+        ...     "GROUP BY ?x ORDER BY DESC(?n) LIMIT 2"
+        ... )
+        [('Konrad_Adenauer', 44), ('Helmut_Kohl', 21)]
+        """
+        cache = self.result_cache
+        if cache is None:
+            return self.process_sql_query(
+                db_name,
+                *self.sparql_to_sql(sparql)
+            )
+        start = time.perf_counter()
+        key = self.canonicalize(sparql)
+        rows = cache.get(db_name, key)
+        hit = rows is not None
+        if rows is None:
+            rows = self.process_sql_query(
+                db_name,
+                *self.sparql_to_sql(sparql)
+            )
+            cache.put(db_name, key, rows)
+        cache.record(hit, time.perf_counter() - start)
+        # the cached list must not be changed by the caller
+        return list(rows)
+
+    def stream_sparql_query(
+        self,
+        db_name: str,
+        sparql: str,
+        batch_size: int = 1000
+    ) -> Iterator[list[tuple[str, ...]]]:
+        """
+
+        Translates the given SPARQL query to SQL and streams its result
+        rows in batches, like sparql_to_sql and stream_sql_query. With a
+        result cache, cached rows are streamed from the cache, and the
+        streamed rows are cached once they are exhausted, unless they
+        exceed the size of the cache (then they are not kept at all).
+
+        >>> engine = SPARQL(result_cache=ResultCache())
+        >>> query = "SELECT ?x WHERE { ?x occupation actor }"
+        >>> [sorted(batch) for batch in engine.stream_sparql_query(
+        ...     "example.db", query
+        ... )]
+        [[('Brad_Pitt',), ('Vera_Oelschlegel',)]]
+        >>> sorted(engine.stream_sparql_query("example.db", query, 1))
+        [[('Brad_Pitt',)], [('Vera_Oelschlegel',)]]
+        >>> engine.result_cache.hits, engine.result_cache.misses
+        (1, 1)
+        >>> list(engine.stream_sparql_query(
+        ...     "example.db",
+        ...     "SELECT ?x (COUNT(?y) AS ?n) WHERE { ?x award_received ?y } "
+        ...     "GROUP BY ?x ORDER BY DESC(?n) LIMIT 2 OFFSET 1",
+        ...     1
+        ... ))
+        [[('Helmut_Kohl', 21)], [('Brad_Pitt', 17)]]
+        """
+        assert batch_size > 0, "batch size must be positive"
+        cache = self.result_cache
+        if cache is None:
+            return self.stream_sql_query(
+                db_name,
+                *self.sparql_to_sql(sparql),
+                batch_size=batch_size
+            )
+        start = time.perf_counter()
+        key = self.canonicalize(sparql)
+        rows = cache.get(db_name, key)
+        if rows is not None:
+            batches = (
+                rows[i:i + batch_size]
+                for i in range(0, len(rows), batch_size)
+            )
+            cache.record(True, time.perf_counter() - start)
+            return batches
+        return self._cache_batches(
+            db_name,
+            key,
+            self.stream_sql_query(
+                db_name,
+                *self.sparql_to_sql(sparql),
+                batch_size=batch_size
+            ),
+            start
+        )
+
+    def _cache_batches(
+        self,
+        db_name: str,
+        key: str,
+        batches: Iterator[list[tuple[str, ...]]],
+        start: float
+    ) -> Iterator[list[tuple[str, ...]]]:
+        # passes the batches through and caches their rows
+        # once they are exhausted, if they fit into the cache
+        cache = self.result_cache
+        assert cache is not None
+        rows: list[tuple[str, ...]] | None = []
+        size = 0
+        for batch in batches:
+            if rows is not None:
+                size += _rows_size(batch)
+                if size <= cache.max_bytes:
+                    rows.extend(batch)
+                else:
+                    rows = None
+            yield batch
+        if rows is not None:
+            cache.put(db_name, key, rows)
+        cache.record(False, time.perf_counter() - start)
+
+    def close(self) -> None:
+        """
+
+        Closes the connections of the engine.
+
+        """
+        self.pool.close()
+
+    def prepare_database(self, db_name: str) -> None:
+        """
+
+        Prepares the wikidata table of the given SQLite3 database for
+        the generated queries: creates the covering indexes in INDEXES
+        (if they do not exist yet), so that every triple pattern with a
+        constant is answered by a search of an index alone, and runs
+        ANALYZE, so that the query planner knows the sizes of the
+        indexes and the selectivity of their columns. Also stores the
+        statistics of the predicates for load_statistics in the table
+        predicate_statistics. The triples table of the integer-encoded
+        schema (see bulk_load.py) gets the indexes in ENCODED_INDEXES,
+        and its terms table a unique index of their text.
+
+        >>> import os, shutil, tempfile
+        >>> db = os.path.join(tempfile.mkdtemp(), "example.db")
+        >>> _ = shutil.copy("example.db", db)
+        >>> engine = SPARQL()
+        >>> engine.prepare_database(db)
+        >>> sql, params = engine.sparql_to_sql(
+        ...     "SELECT ?x WHERE { ?x ?p Germany }"
+        ... )
+        >>> engine.full_scans(db, sql, params)
+        []
+        """
         connection = sqlite3.connect(db_name)
-        cursor = connection.cursor()
-        cursor.execute(sql)
-        return cursor.fetchall()
+        try:
+            tables = _tables(connection)
+            indexes: dict[str, str] = {}
+            if "wikidata" in tables:
+                indexes.update(
+                    (name, f"wikidata({', '.join(columns)})")
+                    for name, columns in INDEXES.items()
+                )
+            if "triples" in tables:
+                indexes.update(
+                    (name, f"triples({', '.join(columns)})")
+                    for name, columns in ENCODED_INDEXES.items()
+                )
+                connection.execute(
+                    "CREATE UNIQUE INDEX IF NOT EXISTS terms_text "
+                    "ON terms(text)"
+                )
+            for name, columns in indexes.items():
+                connection.execute(
+                    f"CREATE INDEX IF NOT EXISTS {name} ON {columns}"
+                )
+            connection.execute("ANALYZE")
+            connection.execute("DROP TABLE IF EXISTS predicate_statistics")
+            connection.execute(
+                "CREATE TABLE predicate_statistics(predicate TEXT, "
+                "triples INTEGER, subjects INTEGER, objects INTEGER)"
+            )
+            connection.executemany(
+                "INSERT INTO predicate_statistics VALUES (?, ?, ?, ?)",
+                _compute_statistics(connection)
+            )
+            connection.commit()
+        finally:
+            connection.close()
+
+    def full_scans(
+        self,
+        db_name: str,
+        sql: str,
+        params: Params = ()
+    ) -> list[str]:
+        """
+
+        Returns the steps of the plan of the given SQL query (from
+        EXPLAIN QUERY PLAN) that scan a whole table or index instead of
+        searching it, e.g. for triple patterns without any constant, or
+        if the indexes are missing.
+
+        >>> engine = SPARQL()
+        >>> sql, params = engine.sparql_to_sql(
+        ...     "SELECT ?x ?y WHERE { ?x spouse ?y . ?y ?p ?x }"
+        ... )
+        >>> engine.full_scans("example.db", sql, params)
+        []
+        >>> sql, params = engine.sparql_to_sql(
+        ...     "SELECT ?x ?y WHERE { ?x ?p ?y }"
+        ... )
+        >>> engine.full_scans("example.db", sql, params)
+        ['SCAN t0']
+        """
+        return _full_scans(self.pool.connection(db_name), sql, params)
+
+    def check_query_plan(
+        self,
+        db_name: str,
+        sql: str,
+        params: Params = (),
+        fail: bool = False
+    ) -> None:
+        """
+
+        Warns (or raises a ValueError if fail is set) if the given SQL
+        query would scan a whole table or index (see full_scans).
+
+        >>> engine = SPARQL()
+        >>> sql, params = engine.sparql_to_sql(
+        ...     "SELECT ?x ?y WHERE { ?x ?p ?y }"
+        ... )
+        >>> engine.check_query_plan("example.db", sql, params, fail=True)
+        Traceback (most recent call last):
+         ...
+        ValueError: query would scan the whole table (SCAN t0): \
+SELECT t0.subject, t0.object FROM wikidata as t0;
+        """
+        self._check_query_plan(
+            self.pool.connection(db_name),
+            sql,
+            params,
+            fail
+        )
+
+    def _check_query_plan(
+        self,
+        connection: sqlite3.Connection,
+        sql: str,
+        params: Params,
+        fail: bool
+    ) -> None:
+        scans = _full_scans(connection, sql, params)
+        if not scans:
+            return
+        message = f"query would scan the whole table " \
+            f"({', '.join(scans)}): {sql}"
+        if fail:
+            raise ValueError(message)
+        warnings.warn(message)
+
+
+def _rows_size(rows: list[tuple[str, ...]]) -> int:
+    # estimated memory used by rows of strings (and the integers
+    # of a COUNT) in bytes (list slot, tuple header and slots,
+    # string headers)
+    return sum(
+        64 + sum(
+            57 + len(value) if isinstance(value, str) else 36
+            for value in row
+        )
+        for row in rows
+    )
+
+
+def _batches(
+    cursor: sqlite3.Cursor,
+    batch_size: int
+) -> Iterator[list[tuple[str, ...]]]:
+    # the rows of a cursor in batches, closes the cursor when the
+    # rows are exhausted or the generator is closed
+    try:
+        while True:
+            batch = cursor.fetchmany(batch_size)
+            if not batch:
+                break
+            yield batch
+    finally:
+        cursor.close()
+
+
+def _compute_statistics(
+    connection: sqlite3.Connection
+) -> list[tuple[str | None, int, int, int]]:
+    # the statistics of each predicate and of all triples (with
+    # predicate None) from the wikidata table, or else from the
+    # triples table of the integer-encoded schema
+    statistics = "COUNT(*), COUNT(DISTINCT subject), COUNT(DISTINCT object)"
+    if "wikidata" in _tables(connection):
+        rows = connection.execute(
+            f"SELECT predicate, {statistics} FROM wikidata "
+            "GROUP BY predicate"
+        ).fetchall()
+        table = "wikidata"
+    else:
+        rows = connection.execute(
+            f"SELECT (SELECT text FROM terms WHERE id = predicate), "
+            f"{statistics} FROM triples GROUP BY predicate"
+        ).fetchall()
+        table = "triples"
+    # the distinct terms of all triples are counted by a scan of their
+    # index (if any), which is much faster than COUNT(DISTINCT ...)
+    rows += connection.execute(
+        f"SELECT NULL, (SELECT COUNT(*) FROM {table}), "
+        f"(SELECT COUNT(*) FROM (SELECT DISTINCT subject FROM {table})), "
+        f"(SELECT COUNT(*) FROM (SELECT DISTINCT object FROM {table}))"
+    ).fetchall()
+    return rows
+
+
+def _decode(column: str) -> str:
+    # the term of the id in the given column of the triples table
+    return f"(SELECT text FROM terms WHERE id={column})"
+
+
+def _tables(connection: sqlite3.Connection) -> set[str]:
+    # the names of the tables of the database
+    return {
+        name for name, in connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'"
+        )
+    }
+
+
+def _full_scans(
+    connection: sqlite3.Connection,
+    sql: str,
+    params: Params
+) -> list[str]:
+    # the details of the steps of the query plan that are full scans,
+    # like "SCAN t0" or "SCAN t0 USING COVERING INDEX idx1" (or "SCAN
+    # TABLE wikidata AS t0" in older versions of SQLite)
+    plan = connection.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+    return [detail for *_, detail in plan if detail.startswith("SCAN")]
@@ -0,0 +1,515 @@
+"""
+Copyright 2023, University of Freiburg,
+Chair of Algorithms and Data Structures.
+"""
+
+import argparse
+import sqlite3
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from operator import eq, ge, gt, itemgetter, le, lt, ne
+from typing import Iterable
+
+from bulk_load import read_tsv
+from sparql_parser import is_variable
+from sparql_to_sql import SPARQL, Triple
+
+# the positions of subject, predicate and object in each permutation,
+# e.g. the POS permutation is sorted by predicate, object and subject
+PERMUTATIONS = {
+    "spo": (0, 1, 2),
+    "pos": (1, 2, 0),
+    "osp": (2, 0, 1)
+}
+# the comparisons of FILTERs, by their operator
+COMPARISONS = {"=": eq, "!=": ne, "<": lt, "<=": le, ">": gt, ">=": ge}
+# a pattern is joined by lookups instead of a merge join if it has
+# this many times more triples than there are solutions so far
+_LOOKUP_FACTOR = 8
+# the permutation whose leading positions are exactly the bound
+# positions of a triple pattern, by the set of bound positions
+_PERMUTATION_FOR_BOUND = {
+    frozenset(): "spo",
+    frozenset({0}): "spo",
+    frozenset({1}): "pos",
+    frozenset({2}): "osp",
+    frozenset({0, 1}): "spo",
+    frozenset({1, 2}): "pos",
+    frozenset({0, 2}): "osp",
+    frozenset({0, 1, 2}): "spo"
+}
+
+
+class TripleStore:
+    """
+
+    A native in-memory triple store. All terms (IRIs and literals) are
+    dictionary-encoded to integer ids, which are assigned in the sorted
+    order of the terms, so comparing ids is the same as comparing the
+    terms. The triples are kept in three sorted permutations (SPO, POS
+    and OSP), each stored as three compact arrays of ids, one per
+    position. Every triple pattern is thus a contiguous range of one of
+    the permutations, found by binary search, and a basic graph pattern
+    is evaluated by merge joins of the ranges of its triple patterns.
+
+    """
+
+    def __init__(self) -> None:
+        """
+
+        Creates an empty triple store.
+
+        """
+        # map from id to term and from term to id
+        self.terms: list[str] = []
+        self.ids: dict[str, int] = {}
+        # map from name of a permutation to its three arrays of ids
+        self.permutations: dict[str, tuple[array, array, array]] = {}
+        self.parser = SPARQL()
+
+    def build(self, triples: Iterable[Triple]) -> None:
+        """
+
+        Builds the triple store from the given (subject, predicate,
+        object) triples.
+
+        >>> store = TripleStore()
+        >>> store.build([("b", "p", "c"), ("a", "p", "b"), ("a", "q", "c")])
+        >>> store.terms
+        ['a', 'b', 'c', 'p', 'q']
+        >>> [list(column) for column in store.permutations["pos"]]
+        [[3, 3, 4], [1, 2, 2], [0, 1, 0]]
+        """
+        triples = list(triples)
+        self.terms = sorted({term for triple in triples for term in triple})
+        self.ids = {term: i for i, term in enumerate(self.terms)}
+        ids = self.ids
+        encoded = [(ids[s], ids[p], ids[o]) for s, p, o in triples]
+        del triples
+
+        self.permutations = {}
+        for name, (i, j, k) in PERMUTATIONS.items():
+            rows = sorted((t[i], t[j], t[k]) for t in encoded)
+            self.permutations[name] = (
+                array("i", (row[0] for row in rows)),
+                array("i", (row[1] for row in rows)),
+                array("i", (row[2] for row in rows))
+            )
+
+    def build_from_file(self, file_name: str) -> None:
+        """
+
+        Builds the triple store from the given TSV file with one
+        triple per line, in the format subject\\tpredicate\\tobject
+        (see bulk_load.read_tsv).
+
+        """
+        self.build(read_tsv(file_name))
+
+    def build_from_db(self, db_name: str) -> None:
+        """
+
+        Builds the triple store from the wikidata table
+        of the given SQLite3 database.
+
+        """
+        connection = sqlite3.connect(db_name)
+        try:
+            self.build(connection.execute(
+                "SELECT subject, predicate, object FROM wikidata"
+            ))
+        finally:
+            connection.close()
+
+    def __len__(self) -> int:
+        return len(self.permutations["spo"][0]) if self.permutations else 0
+
+    def _range(
+        self,
+        permutation: str,
+        prefix: list[int]
+    ) -> tuple[int, int]:
+        # the range of the triples in the given permutation
+        # that start with the given ids
+        columns = self.permutations[permutation]
+        lo, hi = 0, len(columns[0])
+        for column, value in zip(columns, prefix):
+            lo = bisect_left(column, value, lo, hi)
+            hi = bisect_right(column, value, lo, hi)
+        return lo, hi
+
+    def match(
+        self,
+        pattern: Triple
+    ) -> tuple[list[str], list[tuple[int, ...]], str | None]:
+        """
+
+        Returns the solutions of a single triple pattern as a tuple of
+        (variables, rows of ids, variable the rows are sorted by).
+
+        >>> store = TripleStore()
+        >>> store.build([("b", "p", "c"), ("a", "p", "b"), ("a", "q", "c")])
+        >>> store.match(("?x", "p", "?y"))
+        (['?y', '?x'], [(1, 0), (2, 1)], '?y')
+        >>> store.match(("?x", "r", "?y"))
+        (['?y', '?x'], [], None)
+        """
+        return self._solutions(pattern, self._bound(pattern))
+
+    def _bound(self, pattern: Triple) -> dict[int, int]:
+        # the ids of the constants of a triple pattern by their
+        # position, -1 for constants that do not occur in any triple
+        return {
+            pos: self.ids.get(str(term), -1)
+            for pos, term in enumerate(pattern) if not is_variable(term)
+        }
+
+    def _pattern_range(
+        self,
+        bound: dict[int, int]
+    ) -> tuple[str, int, int]:
+        # the permutation and range of the triples matching
+        # the bound positions of a triple pattern
+        permutation = _PERMUTATION_FOR_BOUND[frozenset(bound)]
+        order = PERMUTATIONS[permutation]
+        prefix = [bound[pos] for pos in order[:len(bound)]]
+        if -1 in prefix:
+            return permutation, 0, 0
+        return (permutation, *self._range(permutation, prefix))
+
+    def _solutions(
+        self,
+        pattern: Triple,
+        bound: dict[int, int]
+    ) -> tuple[list[str], list[tuple[int, ...]], str | None]:
+        # the solutions of a triple pattern for the variables
+        # that are not bound, like match
+        permutation, lo, hi = self._pattern_range(bound)
+        order = PERMUTATIONS[permutation]
+        columns = self.permutations[permutation]
+
+        # the positions of the permutation holding the variables,
+        # and pairs of positions holding the same variable
+        variables: list[str] = []
+        positions: list[int] = []
+        same: list[tuple[int, int]] = []
+        for i, pos in enumerate(order):
+            term = pattern[pos]
+            if pos in bound:
+                continue
+            if term in variables:
+                same.append((positions[variables.index(term)], i))
+                continue
+            variables.append(term)
+            positions.append(i)
+
+        rows: list[tuple[int, ...]] = list(
+            zip(*(columns[i][lo:hi] for i in positions))
+        )
+        if not positions:
+            rows = [()] * (hi - lo)
+        if same:
+            rows = [
+                row for row, triple in zip(
+                    rows, zip(*(column[lo:hi] for column in columns))
+                ) if all(triple[i] == triple[j] for i, j in same)
+            ]
+        sorted_by = variables[0] if rows and variables else None
+        return variables, rows, sorted_by
+
+    def evaluate(
+        self,
+        triples: list[Triple]
+    ) -> tuple[list[str], list[tuple[int, ...]]]:
+        """
+
+        Evaluates the basic graph pattern of the given triple patterns
+        and returns its solutions as a tuple of (variables, rows of
+        ids). The patterns are joined greedily, always with the smallest
+        pattern that shares a variable with the patterns joined so far
+        (the sizes are known from the ranges, without reading them).
+        Patterns are joined by merge joins on the shared variables,
+        unless the solutions so far are much fewer than the triples of
+        the pattern, then each distinct value of the shared variables is
+        looked up in the permutations instead (index nested loop join).
+
+        >>> store = TripleStore()
+        >>> store.build([("b", "p", "c"), ("a", "p", "b"), ("a", "q", "c")])
+        >>> store.evaluate([("?x", "p", "?y"), ("?y", "p", "?z")])
+        (['?y', '?x', '?z'], [(1, 0, 2)])
+        """
+        bounds = [self._bound(pattern) for pattern in triples]
+        sizes = [
+            hi - lo for _, lo, hi in map(self._pattern_range, bounds)
+        ]
+        remaining = sorted(range(len(triples)), key=sizes.__getitem__)
+        first = remaining.pop(0)
+        variables, rows, sorted_by = \
+            self._solutions(triples[first], bounds[first])
+        while remaining:
+            # prefer the smallest pattern connected to the joined ones
+            connected = [
+                i for i in remaining
+                if any(term in variables for term in triples[i])
+            ]
+            i = (connected or remaining)[0]
+            remaining.remove(i)
+            if not rows:
+                # no solutions, whatever the remaining patterns are
+                for pattern in [triples[i]] + [triples[j] for j in remaining]:
+                    variables += [
+                        term for term in dict.fromkeys(pattern)
+                        if is_variable(term) and term not in variables
+                    ]
+                break
+            if connected and _LOOKUP_FACTOR * len(rows) < sizes[i]:
+                variables, rows = self._lookup_join(
+                    variables,
+                    rows,
+                    triples[i],
+                    bounds[i]
+                )
+            else:
+                variables, rows, sorted_by = _merge_join(
+                    (variables, rows, sorted_by),
+                    self._solutions(triples[i], bounds[i])
+                )
+        return variables, rows
+
+    def _lookup_join(
+        self,
+        variables: list[str],
+        rows: list[tuple[int, ...]],
+        pattern: Triple,
+        bound: dict[int, int]
+    ) -> tuple[list[str], list[tuple[int, ...]]]:
+        # index nested loop join of the solutions so far with a triple
+        # pattern, by looking up the triples of the pattern for each
+        # distinct value of the shared variables, keeps the order
+        shared = {
+            pos: variables.index(term) for pos, term in enumerate(pattern)
+            if term in variables
+        }
+        new_variables: list[str] = []
+        cache: dict[tuple[int, ...], list[tuple[int, ...]]] = {}
+        joined: list[tuple[int, ...]] = []
+        for row in rows:
+            key = tuple(row[i] for i in shared.values())
+            matches = cache.get(key)
+            if matches is None:
+                new_variables, matches, _ = self._solutions(
+                    pattern,
+                    bound | dict(zip(shared, key))
+                )
+                cache[key] = matches
+            joined.extend(row + match for match in matches)
+        return variables + new_variables, joined
+
+    def process_sparql_query(
+        self,
+        sparql: str
+    ) -> list[tuple[str | int, ...]]:
+        """
+
+        Evaluates the given SPARQL query (see SPARQL.parse_sparql for
+        the supported syntax) and returns the result rows, like
+        SPARQL.process_sql_query for the corresponding SQL query. Terms
+        are compared as strings by FILTER and ORDER BY.
+
+        >>> store = TripleStore()
+        >>> store.build_from_db("example.db")
+        >>> len(store)
+        919
+        >>> sparql = ("SELECT ?x ?y WHERE {"
+        ...     "?x occupation politician . "
+        ...     "?x country_of_citizenship Germany . "
+        ...     "?x spouse ?y . "
+        ...     "?x place_of_birth ?z . "
+        ...     "?y place_of_birth ?z "
+        ...     "}")
+        >>> engine = SPARQL()
+        >>> sql, params = engine.sparql_to_sql(sparql)
+        >>> sorted(store.process_sparql_query(sparql)) \\
+        ...     == sorted(engine.process_sql_query("example.db", sql, params))
+        True
+        >>> store.process_sparql_query(
+        ...     "SELECT ?x ?y WHERE {"
+        ...     "?x spouse ?y . "
+        ...     "?x occupation politician "
+        ...     "} ORDER BY DESC(?y) LIMIT 2"
+        ... )
+        [('Fritz_Kuhn', 'Waltraud_Ulshöfer'), \
+('Konrad_Naumann', 'Vera_Oelschlegel')]
+        >>> sparql = ("SELECT ?x (COUNT(DISTINCT ?y) AS ?n) WHERE {"
+        ...     "?x award_received ?y FILTER(?x != Konrad_Adenauer) "
+        ...     "} GROUP BY ?x ORDER BY DESC(?n) ?x LIMIT 3")
+        >>> store.process_sparql_query(sparql)
+        [('Helmut_Kohl', 21), ('Brad_Pitt', 17), ('Angelina_Jolie', 9)]
+        >>> store.process_sparql_query(sparql) \\
+        ...     == engine.process_sparql_query("example.db", sparql)
+        True
+        >>> store.process_sparql_query(
+        ...     "SELECT DISTINCT ?y WHERE { ?x occupation ?y } "
+        ...     "ORDER BY ?y LIMIT 2"
+        ... )
+        [('actor',), ('assessor',)]
+        """
+        query = self.parser.parse_sparql(sparql)
+        names, rows = self.evaluate(query.triples)
+        terms = self.terms
+
+        for left, op, right in query.filters:
+            compare = COMPARISONS[op]
+            if is_variable(left) and is_variable(right):
+                # ids are ordered like their terms
+                i, j = names.index(left), names.index(right)
+                rows = [row for row in rows if compare(row[i], row[j])]
+            elif is_variable(left):
+                i, right = names.index(left), str(right)
+                rows = [row for row in rows if compare(terms[row[i]], right)]
+            elif is_variable(right):
+                j, left = names.index(right), str(left)
+                rows = [row for row in rows if compare(left, terms[row[j]])]
+            elif not compare(left, right):
+                rows = []
+
+        if query.count is not None:
+            var, counted, distinct = query.count
+            keys = [names.index(key) for key in query.group_by]
+            value = None if counted is None else names.index(counted)
+            # without GROUP BY, there is one group even without rows
+            groups: dict[tuple[int, ...], list] = {} if keys else {(): []}
+            for row in rows:
+                groups.setdefault(tuple(row[key] for key in keys), []).append(
+                    row if value is None else row[value]
+                )
+            names = query.group_by + [var]
+            rows = [
+                key + (len(set(values)) if distinct else len(values),)
+                for key, values in groups.items()
+            ]
+
+        # ids are ordered like their terms, so sort by the ids, by
+        # the last key first, as the sort is stable
+        for var, asc in reversed(query.order_by):
+            rows.sort(key=itemgetter(names.index(var)), reverse=not asc)
+
+        selected = [names.index(var) for var in query.result_variables()]
+        rows = [tuple(row[i] for i in selected) for row in rows]
+        if query.distinct:
+            rows = list(dict.fromkeys(rows))
+        if query.offset is not None:
+            rows = rows[query.offset:]
+        if query.limit is not None:
+            rows = rows[:query.limit]
+
+        # the counts are values, not ids
+        is_id = [
+            query.count is None or var != query.count[0]
+            for var in query.result_variables()
+        ]
+        return [
+            tuple(
+                terms[value] if is_id[i] else value
+                for i, value in enumerate(row)
+            )
+            for row in rows
+        ]
+
+
+def _merge_join(
+    left: tuple[list[str], list[tuple[int, ...]], str | None],
+    right: tuple[list[str], list[tuple[int, ...]], str | None]
+) -> tuple[list[str], list[tuple[int, ...]], str | None]:
+    # merge join of two relations of (variables, rows, sorted by)
+    # on their shared variables, the result has the variables of
+    # the left relation followed by the new variables of the right
+    left_vars, left_rows, left_sorted = left
+    right_vars, right_rows, right_sorted = right
+    shared = [var for var in left_vars if var in right_vars]
+    new = [i for i, var in enumerate(right_vars) if var not in left_vars]
+    variables = left_vars + [right_vars[i] for i in new]
+
+    if not shared:
+        # cross product of relations without shared variables
+        product = [
+            l_row + tuple(r_row[i] for i in new)
+            for l_row in left_rows for r_row in right_rows
+        ]
+        return variables, product, left_sorted
+
+    # keys of single variables are ids, otherwise tuples of ids
+    lkey = itemgetter(*(left_vars.index(var) for var in shared))
+    rkey = itemgetter(*(right_vars.index(var) for var in shared))
+    # sort only what is not sorted by the join key already
+    if len(shared) > 1 or left_sorted != shared[0]:
+        left_rows = sorted(left_rows, key=lkey)
+    if len(shared) > 1 or right_sorted != shared[0]:
+        right_rows = sorted(right_rows, key=rkey)
+
+    rows: list[tuple[int, ...]] = []
+    i, j = 0, 0
+    while i < len(left_rows) and j < len(right_rows):
+        lk, rk = lkey(left_rows[i]), rkey(right_rows[j])
+        if lk < rk:
+            i += 1
+        elif lk > rk:
+            j += 1
+        else:
+            # join the blocks of rows with the same key
+            i_end = i + 1
+            while i_end < len(left_rows) and lkey(left_rows[i_end]) == lk:
+                i_end += 1
+            j_end = j + 1
+            while j_end < len(right_rows) and rkey(right_rows[j_end]) == rk:
+                j_end += 1
+            for l_row in left_rows[i:i_end]:
+                for r_row in right_rows[j:j_end]:
+                    rows.append(l_row + tuple(r_row[k] for k in new))
+            i, j = i_end, j_end
+    return variables, rows, shared[0] if len(shared) == 1 else None
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "triples",
+        type=str,
+        help="path to a TSV file with triples or to a sqlite3 database"
+    )
+    parser.add_argument(
+        "query",
+        type=str,
+        help="path to a file with a SPARQL query"
+    )
+    return parser.parse_args()
+
+
+def main(args: argparse.Namespace) -> None:
+    print(f"Building triple store from {args.triples}.")
+    start = time.perf_counter()
+    store = TripleStore()
+    if args.triples.endswith(".tsv"):
+        store.build_from_file(args.triples)
+    else:
+        store.build_from_db(args.triples)
+    print(
+        f"Done, {len(store):,} triples, {len(store.terms):,} terms, "
+        f"took {(time.perf_counter() - start) * 1000:.1f}ms."
+    )
+
+    with open(args.query, "r", encoding="utf8") as f:
+        sparql = f.read()
+    start = time.perf_counter()
+    rows = store.process_sparql_query(sparql)
+    print(
+        f"Got {len(rows)} result(s), took "
+        f"\033[1m{(time.perf_counter() - start) * 1000:.1f} ms\033[0m."
+    )
+    for row in rows:
+        print("\t".join(str(value) for value in row))
+
+
+if __name__ == "__main__":
+    main(parse_args())